@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Local mode benchmark of column expressions in cms_columns.py against the
+Python user defined functions they replaced. Results of both are compared
+and script fails if they differ.
+
+Usage: python benchmark_columns.py --rows=1000000
+"""
+
+# system modules
+import time
+import random
+import argparse
+
+# pyspark modules
+from pyspark import SparkContext
+from pyspark.sql import SQLContext
+from pyspark.sql.functions import col, udf
+from pyspark.sql.types import IntegerType, LongType, StringType
+
+# local modules
+from cms_columns import dataset_campaign, dataset_primary, dataset_tier
+from cms_columns import is_disk_site, site_tier, size_on_disk, unix_to_date
+
+SITES = ['T0_CH_CERN_MSS', 'T1_US_FNAL_Buffer', 'T1_US_FNAL_MSS', 'T1_DE_KIT_Disk', 'T1_IT_CNAF_Export',
+         'T2_CH_CERN', 'T2_US_Nebraska', 'T2_DE_DESY', 'T3_US_FNALLPC', 'T3_IT_Trieste']
+TIERS = ['AOD', 'AODSIM', 'MINIAOD', 'MINIAODSIM', 'RAW', 'RECO', 'GEN-SIM', 'USER']
+
+# Python implementations which were used as user defined functions in aggregation scripts
+def unix2human(tstamp):
+    return time.strftime('%Y%m%d', time.gmtime(tstamp))
+
+def site_filter(site):
+    if site.endswith('_MSS') or site.endswith('_Buffer') or site.endswith('_Export'):
+        return 0
+    return 1
+
+UDF_COLUMNS = {
+    'primary': lambda: udf(lambda dataset: dataset.split('/')[1], StringType())(col('dataset')),
+    'campaign': lambda: udf(lambda dataset: dataset.split('/')[2], StringType())(col('dataset')),
+    'tier': lambda: udf(lambda dataset: dataset.split('/')[3], StringType())(col('dataset')),
+    'site_tier': lambda: udf(lambda site: site[:2], StringType())(col('site')),
+    'disk_site': lambda: udf(site_filter, IntegerType())(col('site')) == 1,
+    'size_on_disk': lambda: udf(lambda site, size: 0 if site.endswith(('_MSS', '_Buffer', '_Export')) else size,
+                                LongType())(col('site'), col('size')),
+    'replica_date': lambda: udf(unix2human, StringType())(col('replica_time_create')),
+}
+
+NATIVE_COLUMNS = {
+    'primary': lambda: dataset_primary(col('dataset')),
+    'campaign': lambda: dataset_campaign(col('dataset')),
+    'tier': lambda: dataset_tier(col('dataset')),
+    'site_tier': lambda: site_tier(col('site')),
+    'disk_site': lambda: is_disk_site(col('site')),
+    'size_on_disk': lambda: size_on_disk(col('site'), col('size')),
+    'replica_date': lambda: unix_to_date('replica_time_create'),
+}
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Local mode benchmark of native column expressions against Python UDFs"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("--rows", action="store", type=int,
+            dest="rows", default=1000000, help='Number of generated rows, default 1000000')
+        self.parser.add_argument("--seed", action="store", type=int,
+            dest="seed", default=42, help='Seed of random generator, default 42')
+
+def generate_rows(nrows, seed):
+    "Generate PhEDEx like rows: dataset, site, size, replica_time_create"
+    rnd = random.Random(seed)
+    rows = []
+    for idx in range(nrows):
+        dataset = '/Primary%s/Campaign%s-v%s/%s' % (rnd.randint(0, 500), rnd.randint(0, 50), rnd.randint(1, 3), rnd.choice(TIERS))
+        # time stamps around midnight GMT check that dates are counted in GMT
+        tstamp = rnd.randint(1262304000, 1514764800) + rnd.random()
+        rows.append((dataset, rnd.choice(SITES), rnd.randint(0, 10**12), tstamp))
+    return rows
+
+def compute(df, columns):
+    "Compute all columns and return sorted rows and elapsed time"
+    time0 = time.time()
+    result = df.select([columns[name]().alias(name) for name in sorted(columns)]).collect()
+    return sorted(tuple(x) for x in result), time.time() - time0
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+
+    ctx = SparkContext('local[*]', 'benchmark_columns')
+    sqlContext = SQLContext(ctx)
+
+    df = sqlContext.createDataFrame(generate_rows(opts.rows, opts.seed),
+                                    ['dataset', 'site', 'size', 'replica_time_create'])
+    df.cache()
+    df.count()
+
+    print('| Column | UDF (s) | Native (s) | Speedup |')
+    print('| ------- | ------ | ------ | ------ |')
+    mismatches = []
+    for name in sorted(UDF_COLUMNS):
+        udf_rows, udf_time = compute(df, {name: UDF_COLUMNS[name]})
+        native_rows, native_time = compute(df, {name: NATIVE_COLUMNS[name]})
+        if udf_rows != native_rows:
+            mismatches.append(name)
+        print('| %s | %.2f | %.2f | %.1fx |' % (name, udf_time, native_time, udf_time / max(native_time, 1e-6)))
+
+    ctx.stop()
+
+    if mismatches:
+        raise Exception('Native expressions differ from UDF results: %s' % ', '.join(mismatches))
+    print('Native expressions produce the same results as UDFs for %s rows' % opts.rows)
+
+if __name__ == '__main__':
+    main()
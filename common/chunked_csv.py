@@ -0,0 +1,47 @@
+"""
+Aggregation of large csv files in chunks of rows.
+
+Only given columns are read with explicit dtypes, every chunk is aggregated
+into partial sums and counts, and partial results are summed by their keys.
+Peak memory is bounded by chunk size and number of groups instead of the
+size of the whole file.
+"""
+
+import pandas as pd
+
+# local modules
+from csv_snapshot import read_chunks as snapshot_chunks
+
+CHUNK_ROWS = 1000000
+
+def read_chunks(fname, columns, chunk_rows=CHUNK_ROWS):
+    """
+    Iterates over chunks of csv file with given columns, columns is a
+    dictionary of column dtypes. Chunks come from binary snapshot of the file
+    if there is one, see csv_snapshot.py
+    """
+    return snapshot_chunks(fname, sorted(columns), columns, chunk_rows)
+
+def merge_partials(partials, keys):
+    "Sums partial aggregates with the same keys"
+    df = pd.concat([x.reset_index() for x in partials], ignore_index=True)
+    # Categories of chunks differ, keys are merged as plain values
+    for key in keys:
+        if df[key].dtype.name == 'category':
+            df[key] = df[key].astype(object)
+    return df.groupby(keys).sum()
+
+def chunked_aggregate(fname, columns, aggregate, keys, chunk_rows=CHUNK_ROWS):
+    """
+    Aggregates csv file chunk by chunk. aggregate(chunk) returns data frame
+    indexed by keys whose columns are sums or counts, so partial results of
+    chunks are summed into the result of the whole file.
+    """
+    total = None
+    for chunk in read_chunks(fname, columns, chunk_rows):
+        partial = aggregate(chunk)
+        total = merge_partials([partial] if total is None else [total, partial], keys)
+    if total is None:
+        # File has only header
+        total = merge_partials([aggregate(pd.read_csv(fname, usecols=list(columns), dtype=columns))], keys)
+    return total
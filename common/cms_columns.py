@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+Spark column expressions for CMS dataset and site names and dates.
+
+All functions build native Spark SQL expressions, so rows are never sent
+to Python workers as they would be with user defined functions.
+"""
+
+# pyspark modules
+from pyspark.sql.functions import date_format, expr, split, substring, when
+
+SPECIAL_SITE_SUFFIXES = ['_MSS', '_Buffer', '_Export']
+
+def dataset_part(dataset, index):
+    "Part of /primary/campaign/tier dataset name column, 1 is primary, 2 is campaign and 3 is tier"
+    return split(dataset, '/').getItem(index)
+
+def dataset_primary(dataset):
+    "Primary dataset of /primary/campaign/tier dataset name column"
+    return dataset_part(dataset, 1)
+
+def dataset_campaign(dataset):
+    "Campaign of /primary/campaign/tier dataset name column"
+    return dataset_part(dataset, 2)
+
+def dataset_tier(dataset):
+    "Data tier of /primary/campaign/tier dataset name column"
+    return dataset_part(dataset, 3)
+
+def site_tier(site):
+    "Tier (T0, T1, T2 or T3) of site name column"
+    return substring(site, 1, 2)
+
+def is_special_site(site):
+    "True for site name column ending with _MSS or _Buffer or _Export"
+    condition = None
+    for suffix in SPECIAL_SITE_SUFFIXES:
+        ends = site.endswith(suffix)
+        condition = ends if condition is None else condition | ends
+    return condition
+
+def is_disk_site(site):
+    "True for site name column without _MSS or _Buffer or _Export"
+    return ~is_special_site(site)
+
+def size_on_disk(site, size):
+    "Size column for disk sites and 0 for _MSS, _Buffer and _Export sites"
+    return when(is_disk_site(site), size).otherwise(0)
+
+def unix_to_date(name):
+    """
+    YYYYMMDD string of unix time stamp column of given name. Date is counted
+    in GMT independently of the time zone of Spark executors.
+    """
+    days = expr("date_add(cast('1970-01-01' as date), cast(floor(`%s` / 86400) as int))" % name)
+    return date_format(days, 'yyyyMMdd')
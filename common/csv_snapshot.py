@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+"""
+Binary snapshots of csv files read by analyse.py and visualize.py scripts.
+
+First read of a csv file writes its columns as typed binary arrays to the
+snapshot cache. Later reads of the same columns memory-map these arrays
+instead of parsing the text again, numeric columns are used without copying.
+String columns are kept as codes of distinct values and restored as strings
+(or as categorical columns if they were read as categorical). Distinct values
+are kept in meta.json, so files with a string column of more than MAX_VALUES
+distinct values (e.g. dataset names) are not snapshotted and are always read
+from csv.
+
+Snapshot is valid while size and modification time of the csv file are the
+same. If only modification time changed (e.g. file was restored from result
+cache), content hash of the file decides and snapshot is kept if the hash is
+the same.
+
+Usage:
+    python csv_snapshot.py list
+    python csv_snapshot.py clear [--source=phedex_df.csv]
+
+Cache is kept in ~/.cache/cern_tasks/csv (or in $CSV_CACHE if it is set).
+Set CSV_CACHE_DISABLE to read csv files without snapshots.
+"""
+
+# system modules
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cern_tasks', 'csv')
+META_FILE = 'meta.json'
+CHUNK_ROWS = 1000000
+NUMERIC_KINDS = 'biuf'
+MAX_VALUES = 10000
+# changes of the format make snapshots written before them unused
+FORMAT = 2
+
+def cache_dir():
+    "Location of the cache"
+    return os.environ.get('CSV_CACHE') or CACHE_DIR
+
+def file_hash(fname):
+    "SHA-256 checksum of file content"
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as istream:
+        for chunk in iter(lambda: istream.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def snapshot_desc(fname, usecols=None, dtype=None):
+    "Snapshot of a file is kept for every selection of columns and their types"
+    return {'format': FORMAT,
+            'source': os.path.abspath(fname),
+            'usecols': sorted(usecols) if usecols is not None else None,
+            'dtype': dict((k, str(v)) for k, v in dtype.items()) if dtype else None}
+
+def snapshot_key(fname, usecols=None, dtype=None):
+    desc = snapshot_desc(fname, usecols, dtype)
+    return hashlib.sha256(json.dumps(desc, sort_keys=True).encode('utf-8')).hexdigest()
+
+class SnapshotWriter(object):
+    "Writes chunks of a data frame to column files of a temporary snapshot directory"
+
+    def __init__(self, edir, source, usecols=None, dtype=None):
+        self.edir = edir
+        self.tmp_dir = '%s.tmp%s' % (edir, os.getpid())
+        self.source = source
+        self.desc = snapshot_desc(source, usecols, dtype)
+        self.columns = None
+        self.rows = 0
+        self.valid = True
+
+    def add(self, chunk):
+        """
+        Appends chunk, snapshot is abandoned if column types are not supported
+        or change, or if a string column has more than MAX_VALUES distinct values
+        """
+        if not self.valid:
+            return
+        if self.columns is None:
+            self.columns = []
+            for idx, name in enumerate(chunk.columns):
+                kind = chunk[name].dtype.kind
+                if chunk[name].dtype.name == 'category':
+                    column = {'type': 'category', 'dtype': 'int32', 'values': {}}
+                elif kind == 'O':
+                    column = {'type': 'object', 'dtype': 'int32', 'values': {}}
+                elif kind in NUMERIC_KINDS:
+                    column = {'type': 'numeric', 'dtype': chunk[name].dtype.str}
+                else:
+                    self.valid = False
+                    return
+                column.update({'name': name, 'file': '%s.bin' % idx})
+                self.columns.append(column)
+            if os.path.isdir(self.tmp_dir):
+                shutil.rmtree(self.tmp_dir)
+            os.makedirs(self.tmp_dir)
+        if list(chunk.columns) != [x['name'] for x in self.columns]:
+            self.valid = False
+            return
+        for column in self.columns:
+            values = chunk[column['name']]
+            if column['type'] == 'numeric':
+                if values.dtype.str != column['dtype']:
+                    self.valid = False
+                    return
+                data = values.values
+            else:
+                # distinct values get codes in order of their first appearance
+                codes, uniques = pd.factorize(values.astype(object))
+                mapping = column['values']
+                for value in uniques:
+                    mapping.setdefault(value, len(mapping))
+                if len(mapping) > MAX_VALUES:
+                    self.valid = False
+                    self.columns = None
+                    self.abort()
+                    return
+                lookup = np.array([mapping[x] for x in uniques] + [-1], dtype=column['dtype'])
+                data = lookup[codes]
+            with open(os.path.join(self.tmp_dir, column['file']), 'ab') as ostream:
+                ostream.write(np.ascontiguousarray(data).tobytes())
+        self.rows += len(chunk)
+
+    def finish(self):
+        "Makes snapshot available, returns True if it was written"
+        if not self.valid or self.columns is None:
+            self.abort()
+            return False
+        stat = os.stat(self.source)
+        columns = []
+        for column in self.columns:
+            values = column.pop('values', None)
+            if values is not None:
+                column['values'] = sorted(values, key=values.get)
+            if column['type'] == 'category':
+                self.sort_categories(column)
+            columns.append(column)
+        meta = dict(self.desc, size=stat.st_size, mtime=stat.st_mtime, hash=file_hash(self.source),
+                    rows=self.rows, columns=columns, created=time.time())
+        with open(os.path.join(self.tmp_dir, META_FILE), 'w') as ostream:
+            json.dump(meta, ostream, sort_keys=True)
+        if os.path.isdir(self.edir):
+            shutil.rmtree(self.edir)
+        os.rename(self.tmp_dir, self.edir)
+        return True
+
+    def sort_categories(self, column):
+        """
+        Categories are sorted as pandas.read_csv sorts them, codes of the
+        column file are renumbered from order of first appearance
+        """
+        categories = sorted(column['values'])
+        position = dict((value, idx) for idx, value in enumerate(categories))
+        remap = np.array([position[x] for x in column['values']] + [-1], dtype=column['dtype'])
+        column['values'] = categories
+        if not self.rows:
+            return
+        codes = np.memmap(os.path.join(self.tmp_dir, column['file']), dtype=column['dtype'], mode='r+',
+                          shape=(self.rows,))
+        for start in range(0, self.rows, CHUNK_ROWS):
+            codes[start:start + CHUNK_ROWS] = remap[codes[start:start + CHUNK_ROWS]]
+        codes.flush()
+        del codes
+
+    def abort(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+class Snapshot(object):
+    "Memory-mapped columns of a snapshot"
+
+    def __init__(self, edir, meta):
+        self.edir = edir
+        self.meta = meta
+        self.rows = meta['rows']
+        self.arrays = []
+        for column in meta['columns']:
+            fname = os.path.join(edir, column['file'])
+            if self.rows:
+                self.arrays.append(np.memmap(fname, dtype=column['dtype'], mode='r', shape=(self.rows,)))
+            else:
+                self.arrays.append(np.zeros(0, dtype=column['dtype']))
+        # distinct values of string columns, the last one is the missing value of code -1
+        self.values = [np.array(x['values'] + [np.nan], dtype=object) if 'values' in x else None
+                       for x in meta['columns']]
+
+    def frame(self, start=0, stop=None):
+        "Data frame of rows from start to stop"
+        data = {}
+        for column, array, values in zip(self.meta['columns'], self.arrays, self.values):
+            # plain array view of memory-mapped file, data is not copied
+            codes = array[start:stop].view(np.ndarray)
+            if column['type'] == 'numeric':
+                data[column['name']] = codes
+            elif column['type'] == 'category':
+                data[column['name']] = pd.Categorical.from_codes(codes, column['values'])
+            else:
+                data[column['name']] = values.take(codes)
+        names = [x['name'] for x in self.meta['columns']]
+        return pd.DataFrame(data, columns=names, copy=False)
+
+    def chunks(self, chunk_rows=CHUNK_ROWS):
+        for start in range(0, self.rows, chunk_rows):
+            yield self.frame(start, start + chunk_rows)
+
+class SnapshotCache(object):
+    "Cache entries are directories named by keys with column files and meta.json"
+
+    def __init__(self, location=None):
+        self.location = location or cache_dir()
+        if not os.path.isdir(self.location):
+            os.makedirs(self.location)
+
+    def entry_dir(self, key):
+        return os.path.join(self.location, key)
+
+    def entries(self):
+        "List of meta data of all entries"
+        result = []
+        for key in sorted(os.listdir(self.location)):
+            meta_file = os.path.join(self.location, key, META_FILE)
+            if os.path.isfile(meta_file):
+                with open(meta_file) as istream:
+                    result.append(dict(json.load(istream), key=key))
+        return result
+
+    def load(self, fname, usecols=None, dtype=None):
+        "Valid snapshot of csv file or None"
+        edir = self.entry_dir(snapshot_key(fname, usecols, dtype))
+        meta_file = os.path.join(edir, META_FILE)
+        if not os.path.isfile(meta_file):
+            return None
+        with open(meta_file) as istream:
+            meta = json.load(istream)
+        stat = os.stat(fname)
+        if stat.st_size != meta['size']:
+            return None
+        if stat.st_mtime != meta['mtime']:
+            if file_hash(fname) != meta['hash']:
+                return None
+            meta['mtime'] = stat.st_mtime
+            with open(meta_file, 'w') as ostream:
+                json.dump(meta, ostream, sort_keys=True)
+        return Snapshot(edir, meta)
+
+    def writer(self, fname, usecols=None, dtype=None):
+        return SnapshotWriter(self.entry_dir(snapshot_key(fname, usecols, dtype)), fname, usecols, dtype)
+
+    def clear(self, source=None):
+        "Removes snapshots of source file (all files if not given), returns number of removed snapshots"
+        removed = 0
+        for meta in self.entries():
+            if source and meta['source'] != os.path.abspath(source):
+                continue
+            shutil.rmtree(self.entry_dir(meta['key']), ignore_errors=True)
+            removed += 1
+        return removed
+
+def enabled():
+    return not os.environ.get('CSV_CACHE_DISABLE')
+
+def read_csv(fname, usecols=None, dtype=None):
+    "Reads csv file like pandas.read_csv, from its snapshot if there is a valid one"
+    if not enabled():
+        return pd.read_csv(fname, usecols=usecols, dtype=dtype)
+    cache = SnapshotCache()
+    snapshot = cache.load(fname, usecols, dtype)
+    if snapshot:
+        return snapshot.frame()
+    df = pd.read_csv(fname, usecols=usecols, dtype=dtype)
+    writer = cache.writer(fname, usecols, dtype)
+    writer.add(df)
+    writer.finish()
+    return df
+
+def read_chunks(fname, usecols=None, dtype=None, chunk_rows=CHUNK_ROWS):
+    "Iterates over chunks of csv file, from its snapshot if there is a valid one"
+    if not enabled():
+        for chunk in pd.read_csv(fname, usecols=usecols, dtype=dtype, chunksize=chunk_rows):
+            yield chunk
+        return
+    cache = SnapshotCache()
+    snapshot = cache.load(fname, usecols, dtype)
+    if snapshot:
+        for chunk in snapshot.chunks(chunk_rows):
+            yield chunk
+        return
+    # snapshot is written while csv file is read, it is used only if all chunks were read
+    writer = cache.writer(fname, usecols, dtype)
+    try:
+        for chunk in pd.read_csv(fname, usecols=usecols, dtype=dtype, chunksize=chunk_rows):
+            writer.add(chunk)
+            yield chunk
+        writer.finish()
+    finally:
+        writer.abort()
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Binary snapshots of csv files read by analysis scripts"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("command", choices=['list', 'clear'],
+            help='list snapshots or remove them')
+        self.parser.add_argument("--source", action="store",
+            dest="source", default='', help='csv file whose snapshots are removed, all snapshots by default')
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+    cache = SnapshotCache()
+
+    if opts.command == 'clear':
+        print('Removed %s snapshots from %s' % (cache.clear(opts.source), cache.location))
+        return
+
+    print('| Source | Columns | Rows | Size (MB) | Created | Status |')
+    print('| ------- | ------ | ------ | ------ | ------ | ------ |')
+    for meta in cache.entries():
+        edir = cache.entry_dir(meta['key'])
+        size = sum(os.path.getsize(os.path.join(edir, x)) for x in os.listdir(edir))
+        if not os.path.isfile(meta['source']):
+            status = 'source missing'
+        elif cache.load(meta['source'], meta['usecols'], meta['dtype']):
+            status = 'valid'
+        else:
+            status = 'stale'
+        print('| %s | %s | %s | %.1f | %s | %s |' % (meta['source'], ', '.join(x['name'] for x in meta['columns']),
+              meta['rows'], size / 1024. / 1024, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['created'])),
+              status))
+
+if __name__ == '__main__':
+    main()
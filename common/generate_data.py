@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+"""
+Generator of synthetic PhEDEx block-replica snapshots and DBS tables for
+running and benchmarking Spark jobs without the production HDFS tree.
+
+Files are written in the layout and CSV format of CMS dumps, which is read by
+phedex_tables and dbs_tables of CMSSpark (see table_cache.py):
+    <hdir>/phedex/block-replicas-snapshots/csv/time=YYYY-MM-DD_00h00m00s/part-m-NNNNN
+    <hdir>/CMS_DBS3_PROD_<INST>/current/<TABLE>/part-m-NNNNN
+where TABLE is DATASETS, BLOCKS, FILES or DATASET_ACCESS_TYPES. Default
+hdir is $HDFS_LOCAL_ROOT/project/awg/cms, so jobs of pipelines run with
+--local read generated data (CMS_HDIR is set to it by pipeline.py).
+
+Datasets are /primary/campaign/tier names. Popularity of campaigns and sites
+follows Zipf distribution with exponent --skew, so a few campaigns have most
+of the datasets and a few sites have most of the replicas. Replicas are
+created over time, so snapshot of every date contains replicas created
+before its end. Output is the same for the same options and --seed.
+Datasets are generated in parts of --part-datasets datasets, every part is
+written to its own part file, so memory does not grow with size of output.
+
+Usage: python generate_data.py --datasets=100000 --date=20170227,20170228 --skew=1.2 --seed=1
+"""
+
+# system modules
+import os
+import json
+import time
+import argparse
+import calendar
+
+import numpy as np
+import pandas as pd
+
+DBS_INSTANCES = ['GLOBAL', 'PHYS01', 'PHYS02', 'PHYS03']
+
+PHEDEX_COLUMNS = ['now_sec', 'dataset_name', 'dataset_id', 'dataset_is_open', 'dataset_time_create',
+                  'dataset_time_update', 'block_name', 'block_id', 'block_files', 'block_bytes', 'block_is_open',
+                  'block_time_create', 'block_time_update', 'node_name', 'node_id', 'br_is_active',
+                  'br_src_files', 'br_src_bytes', 'br_dest_files', 'br_dest_bytes', 'br_node_files',
+                  'br_node_bytes', 'br_xfer_files', 'br_xfer_bytes', 'br_is_custodial', 'br_user_group_id',
+                  'replica_time_create', 'replica_time_updater']
+DATASETS_COLUMNS = ['d_dataset_id', 'd_dataset', 'd_is_dataset_valid', 'd_primary_ds_id', 'd_processed_ds_id',
+                    'd_data_tier_id', 'd_dataset_access_type_id', 'd_acquisition_era_id', 'd_processing_era_id',
+                    'd_physics_group_id', 'd_xtcrosssection', 'd_prep_id', 'd_creation_date', 'd_create_by',
+                    'd_last_modification_date', 'd_last_modified_by']
+BLOCKS_COLUMNS = ['b_block_id', 'b_block_name', 'b_dataset_id', 'b_open_for_writing', 'b_origin_site_name',
+                  'b_block_size', 'b_file_count', 'b_creation_date', 'b_create_by', 'b_last_modification_date',
+                  'b_last_modified_by']
+FILES_COLUMNS = ['f_file_id', 'f_logical_file_name', 'f_is_file_valid', 'f_dataset_id', 'f_block_id',
+                 'f_file_type_id', 'f_check_sum', 'f_event_count', 'f_file_size', 'f_branch_hash_id', 'f_adler32',
+                 'f_md5', 'f_auto_cross_section', 'f_creation_date', 'f_create_by', 'f_last_modification_date',
+                 'f_last_modified_by']
+
+ACCESS_TYPES = ['VALID', 'INVALID', 'PRODUCTION', 'DEPRECATED', 'DELETED']
+ACCESS_WEIGHTS = [0.75, 0.1, 0.05, 0.05, 0.05]
+TIERS = ['AOD', 'AODSIM', 'MINIAOD', 'MINIAODSIM', 'RAW', 'RECO', 'GEN-SIM', 'GEN-SIM-RECO', 'DQMIO', 'USER']
+TIER_WEIGHTS = [0.12, 0.2, 0.12, 0.25, 0.05, 0.05, 0.1, 0.05, 0.02, 0.04]
+PRIMARIES = ['SingleMuon', 'SingleElectron', 'DoubleEG', 'DoubleMuon', 'JetHT', 'MET', 'ZeroBias', 'MinimumBias',
+             'Charmonium', 'HLTPhysics', 'DYJetsToLL_M-50', 'TTJets', 'WJetsToLNu', 'QCD_Pt-15to7000', 'GluGluHToZZTo4L']
+ERAS = ['RunIISummer16MiniAODv2', 'RunIISpring16DR80', 'RunIIFall15MiniAODv2', 'Run2016B', 'Run2016C', 'Run2016G',
+        'Run2015D', 'PhaseIIFall16DR82', 'RunIISummer15GS', 'CMSSW_8_0_21']
+COUNTRIES = ['CH', 'US', 'DE', 'IT', 'FR', 'ES', 'UK', 'RU', 'IN', 'BR', 'KR', 'CN', 'BE', 'PL', 'PT', 'TW']
+SITE_KINDS = ['MSS', 'Buffer', 'Export', 'Disk']
+# share of datasets of PHYS instances relative to GLOBAL
+PHYS_SHARE = 0.05
+
+DAY = 86400
+YEAR = 365 * DAY
+
+def default_hdir():
+    root = os.environ.get('HDFS_LOCAL_ROOT', os.path.join(os.path.expanduser('~'), 'local_hdfs'))
+    return os.path.join(root, 'project', 'awg', 'cms')
+
+def date_stamp(date):
+    "Unix time of midnight GMT of YYYYMMDD date"
+    return calendar.timegm(time.strptime(date, '%Y%m%d'))
+
+def zipf_weights(count, skew):
+    "Weights of count items decreasing as 1/rank^skew, skew 0 gives equal weights"
+    weights = 1. / np.arange(1, count + 1) ** skew
+    return weights / weights.sum()
+
+def campaign_names(count, rnd):
+    "Campaign (processed dataset) names like RunIISummer16MiniAODv2-PUMoriond17_80X_v6-v1"
+    return ['%s-%s_%sX_v%s-v%s' % (ERAS[i % len(ERAS)], 'PU%s' % (i // len(ERAS)), rnd.randint(70, 95),
+                                   rnd.randint(1, 9), rnd.randint(1, 3)) for i in range(count)]
+
+def site_names(count, rnd):
+    """
+    PhEDEx node names, about a tenth of them are T1 sites with _MSS, _Buffer,
+    _Export and _Disk nodes, the rest are T2 and T3 sites
+    """
+    names = ['T0_CH_CERN_MSS', 'T0_CH_CERN_Export']
+    t1 = 0
+    while len(names) < count:
+        country = COUNTRIES[rnd.randint(len(COUNTRIES))]
+        if len(names) < count // 10:
+            t1 += 1
+            names.extend('T1_%s_Site%s_%s' % (country, t1, kind) for kind in SITE_KINDS)
+        else:
+            tier = 'T2' if rnd.rand() < 0.7 else 'T3'
+            names.append('%s_%s_Site%s' % (tier, country, len(names)))
+    return names[:count]
+
+def hex_names(rnd, count, digits=32):
+    "Random hexadecimal strings as used in block names and checksums"
+    values = rnd.randint(0, 2**31 - 1, size=(count, (digits + 7) // 8))
+    return [''.join('%08x' % v for v in row)[:digits] for row in values]
+
+class Generator(object):
+    "Generates tables of all DBS instances and PhEDEx snapshots part by part"
+
+    def __init__(self, opts):
+        self.opts = opts
+        self.dates = opts.date.split(',')
+        self.stamps = [date_stamp(x) for x in self.dates]
+        rnd = np.random.RandomState(opts.seed)
+        self.campaigns = campaign_names(opts.campaigns, rnd)
+        self.campaign_weights = zipf_weights(opts.campaigns, opts.skew)
+        self.sites = site_names(opts.sites, rnd)
+        # popular sites are shuffled, so T0 and T1 nodes are not always the biggest ones
+        self.site_weights = zipf_weights(opts.sites, opts.skew)[rnd.permutation(opts.sites)]
+        self.counts = {}
+
+    def rnd(self, inst, part):
+        "Random generator of a part of an instance, independent of other parts"
+        return np.random.RandomState([self.opts.seed, DBS_INSTANCES.index(inst) + 1, part])
+
+    def datasets(self, inst, part, first_id, count):
+        "Datasets table of a part, dataset names are unique within instance"
+        rnd = self.rnd(inst, part)
+        campaigns = rnd.choice(len(self.campaigns), size=count, p=self.campaign_weights)
+        tiers = rnd.choice(len(TIERS), size=count, p=TIER_WEIGHTS) if inst == 'GLOBAL' \
+            else np.full(count, TIERS.index('USER'))
+        primaries = rnd.randint(len(PRIMARIES), size=count)
+        ids = np.arange(first_id, first_id + count)
+        # dataset id in primary dataset name keeps names unique and campaigns shared
+        names = ['/%s_%s/%s/%s' % (PRIMARIES[p], i, self.campaigns[c], TIERS[t])
+                 for p, c, i, t in zip(primaries, campaigns, ids, tiers)]
+        created = self.stamps[0] - rnd.randint(DAY, 3 * YEAR, size=count)
+        access = rnd.choice(len(ACCESS_TYPES), size=count, p=ACCESS_WEIGHTS) + 1
+        return pd.DataFrame({'d_dataset_id': ids, 'd_dataset': names,
+                             'd_is_dataset_valid': (access == 1).astype(int),
+                             'd_primary_ds_id': ids, 'd_processed_ds_id': campaigns + 1,
+                             'd_data_tier_id': tiers + 1, 'd_dataset_access_type_id': access,
+                             'd_acquisition_era_id': campaigns % len(ERAS) + 1, 'd_processing_era_id': 1,
+                             'd_physics_group_id': 'null', 'd_xtcrosssection': 'null', 'd_prep_id': 'null',
+                             'd_creation_date': created, 'd_create_by': 'cmsprod',
+                             'd_last_modification_date': created, 'd_last_modified_by': 'cmsprod'},
+                            columns=DATASETS_COLUMNS)
+
+    def blocks(self, inst, part, first_id, datasets):
+        "Blocks table of datasets of a part"
+        rnd = self.rnd(inst, part)
+        counts = rnd.poisson(self.opts.blocks - 1, size=len(datasets)) + 1
+        count = counts.sum()
+        dataset_ids = np.repeat(datasets.d_dataset_id.values, counts)
+        names = np.repeat(datasets.d_dataset.values, counts)
+        created = np.repeat(datasets.d_creation_date.values, counts) + rnd.randint(0, 30 * DAY, size=count)
+        uuids = hex_names(rnd, count)
+        return pd.DataFrame({'b_block_id': np.arange(first_id, first_id + count),
+                             'b_block_name': ['%s#%s-%s-%s-%s-%s' % (n, u[:8], u[8:12], u[12:16], u[16:20], u[20:])
+                                              for n, u in zip(names, uuids)],
+                             'b_dataset_id': dataset_ids, 'b_open_for_writing': 0,
+                             'b_origin_site_name': [self.sites[x] for x in rnd.randint(len(self.sites), size=count)],
+                             'b_block_size': 0, 'b_file_count': 0,
+                             'b_creation_date': created, 'b_create_by': 'cmsprod',
+                             'b_last_modification_date': created, 'b_last_modified_by': 'cmsprod'},
+                            columns=BLOCKS_COLUMNS)
+
+    def files(self, inst, part, first_id, datasets, blocks):
+        "Files table of blocks of a part, sizes and file counts of blocks are set from it"
+        rnd = self.rnd(inst, part)
+        counts = rnd.poisson(self.opts.files - 1, size=len(blocks)) + 1
+        count = counts.sum()
+        ids = np.arange(first_id, first_id + count)
+        # file sizes are log-normal around 2 GB
+        sizes = np.exp(rnd.normal(np.log(2e9), 0.8, size=count)).astype(np.int64)
+        block_ids = np.repeat(blocks.b_block_id.values, counts)
+        dataset_ids = np.repeat(blocks.b_dataset_id.values, counts)
+        valid = datasets.set_index('d_dataset_id').d_is_dataset_valid.reindex(dataset_ids).values
+        names = np.repeat(blocks.b_block_name.str.split('#').str[0].values, counts)
+        created = np.repeat(blocks.b_creation_date.values, counts) + rnd.randint(0, DAY, size=count)
+        blocks['b_block_size'] = np.bincount(np.repeat(np.arange(len(blocks)), counts), weights=sizes).astype(np.int64)
+        blocks['b_file_count'] = counts
+        return pd.DataFrame({'f_file_id': ids,
+                             'f_logical_file_name': ['/store%s/%s.root' % (n, i) for n, i in zip(names, ids)],
+                             'f_is_file_valid': valid, 'f_dataset_id': dataset_ids, 'f_block_id': block_ids,
+                             'f_file_type_id': 1, 'f_check_sum': rnd.randint(0, 2**31 - 1, size=count),
+                             'f_event_count': sizes // rnd.randint(50000, 1000000, size=count),
+                             'f_file_size': sizes, 'f_branch_hash_id': 'null',
+                             'f_adler32': hex_names(rnd, count, 8), 'f_md5': 'null',
+                             'f_auto_cross_section': 'null', 'f_creation_date': created, 'f_create_by': 'cmsprod',
+                             'f_last_modification_date': created, 'f_last_modified_by': 'cmsprod'},
+                            columns=FILES_COLUMNS)
+
+    def replicas(self, part, datasets, blocks):
+        """
+        Block replicas at PhEDEx nodes, every block has about --replicas
+        replicas at distinct nodes chosen by popularity of sites
+        """
+        rnd = self.rnd('GLOBAL', part)
+        counts = rnd.poisson(self.opts.replicas - 1, size=len(blocks)) + 1
+        rows = np.repeat(np.arange(len(blocks)), counts)
+        nodes = rnd.choice(len(self.sites), size=len(rows), p=self.site_weights)
+        # the same node drawn twice for a block is one replica
+        pairs = pd.DataFrame({'row': rows, 'node': nodes}).drop_duplicates()
+        rows, nodes = pairs.row.values, pairs.node.values
+        block = blocks.iloc[rows]
+        dataset = datasets.set_index('d_dataset_id').reindex(block.b_dataset_id.values)
+        created = block.b_creation_date.values + \
+            (rnd.rand(len(rows)) * np.maximum(self.stamps[-1] + DAY - block.b_creation_date.values, 0)).astype(np.int64)
+        names = [self.sites[x] for x in nodes]
+        sizes = block.b_block_size.values
+        files = block.b_file_count.values
+        groups = rnd.randint(1, self.opts.groups + 1, size=len(rows)).astype(object)
+        groups[rnd.rand(len(rows)) < 0.1] = 'null'
+        return pd.DataFrame({'now_sec': 0, 'dataset_name': dataset.d_dataset.values,
+                             'dataset_id': block.b_dataset_id.values, 'dataset_is_open': 'n',
+                             'dataset_time_create': dataset.d_creation_date.values,
+                             'dataset_time_update': dataset.d_creation_date.values,
+                             'block_name': block.b_block_name.values, 'block_id': block.b_block_id.values,
+                             'block_files': files, 'block_bytes': sizes, 'block_is_open': 'n',
+                             'block_time_create': block.b_creation_date.values,
+                             'block_time_update': block.b_creation_date.values,
+                             'node_name': names, 'node_id': nodes + 1, 'br_is_active': 'y',
+                             'br_src_files': 0, 'br_src_bytes': 0, 'br_dest_files': files, 'br_dest_bytes': sizes,
+                             'br_node_files': files, 'br_node_bytes': sizes, 'br_xfer_files': 0, 'br_xfer_bytes': 0,
+                             'br_is_custodial': ['y' if x.endswith('_MSS') else 'n' for x in names],
+                             'br_user_group_id': groups, 'replica_time_create': created,
+                             'replica_time_updater': created}, columns=PHEDEX_COLUMNS)
+
+    def write(self, df, path, part):
+        "Writes rows of a part as CSV file without header like CMS dumps"
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        df.to_csv(os.path.join(path, 'part-m-%05d' % part), header=False, index=False)
+        self.counts[path] = self.counts.get(path, 0) + len(df)
+
+    def dbs_path(self, inst, table):
+        return os.path.join(self.opts.hdir, 'CMS_DBS3_PROD_%s' % inst, 'current', table)
+
+    def phedex_path(self, date):
+        return os.path.join(self.opts.hdir, 'phedex', 'block-replicas-snapshots', 'csv',
+                            'time=%s-%s-%s_00h00m00s' % (date[:4], date[4:6], date[6:]))
+
+    def generate(self, inst):
+        "Writes DBS tables of an instance and PhEDEx snapshots of GLOBAL datasets"
+        total = self.opts.datasets if inst == 'GLOBAL' else max(1, int(self.opts.datasets * PHYS_SHARE))
+        access = pd.DataFrame({'dataset_access_type_id': np.arange(1, len(ACCESS_TYPES) + 1),
+                               'dataset_access_type': ACCESS_TYPES})
+        self.write(access, self.dbs_path(inst, 'DATASET_ACCESS_TYPES'), 0)
+        block_id = file_id = 1
+        for part, first in enumerate(range(0, total, self.opts.part_datasets)):
+            datasets = self.datasets(inst, part, first + 1, min(self.opts.part_datasets, total - first))
+            blocks = self.blocks(inst, part, block_id, datasets)
+            files = self.files(inst, part, file_id, datasets, blocks)
+            block_id += len(blocks)
+            file_id += len(files)
+            self.write(datasets, self.dbs_path(inst, 'DATASETS'), part)
+            self.write(blocks, self.dbs_path(inst, 'BLOCKS'), part)
+            self.write(files, self.dbs_path(inst, 'FILES'), part)
+            if inst != 'GLOBAL':
+                continue
+            replicas = self.replicas(part, datasets, blocks)
+            for date, stamp in zip(self.dates, self.stamps):
+                snapshot = replicas[replicas.replica_time_create < stamp + DAY].copy()
+                snapshot['now_sec'] = stamp + DAY - 1
+                self.write(snapshot, self.phedex_path(date), part)
+
+def write_manifest(generator, elapsed):
+    "Writes options and row counts of generated tables to <hdir>/generator.json"
+    opts = dict(vars(generator.opts))
+    manifest = {'options': opts, 'elapsed': elapsed,
+                'rows': dict((os.path.relpath(k, opts['hdir']), v) for k, v in generator.counts.items())}
+    with open(os.path.join(opts['hdir'], 'generator.json'), 'w') as ostream:
+        json.dump(manifest, ostream, indent=2, sort_keys=True)
+    return manifest
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Generate synthetic PhEDEx snapshots and DBS tables in the layout of CMS dumps"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        hdir = default_hdir()
+        self.parser.add_argument("--hdir", action="store",
+            dest="hdir", default=hdir, help='Output directory, default %s' % hdir)
+        self.parser.add_argument("--date", action="store",
+            dest="date", default="20170228", help='PhEDEx snapshot dates (comma-separated list of YYYYMMDD), default 20170228')
+        self.parser.add_argument("--inst", action="store",
+            dest="inst", default="global,phys01,phys02,phys03", help='DBS instances, default global,phys01,phys02,phys03')
+        self.parser.add_argument("--datasets", action="store", type=int,
+            dest="datasets", default=10000, help='Number of GLOBAL datasets, PHYS instances get %s of it, default 10000' % PHYS_SHARE)
+        self.parser.add_argument("--blocks", action="store", type=float,
+            dest="blocks", default=5, help='Mean number of blocks of a dataset, default 5')
+        self.parser.add_argument("--files", action="store", type=float,
+            dest="files", default=10, help='Mean number of files of a block, default 10')
+        self.parser.add_argument("--replicas", action="store", type=float,
+            dest="replicas", default=2, help='Mean number of replicas of a block, default 2')
+        self.parser.add_argument("--campaigns", action="store", type=int,
+            dest="campaigns", default=200, help='Number of campaigns, default 200')
+        self.parser.add_argument("--sites", action="store", type=int,
+            dest="sites", default=100, help='Number of PhEDEx nodes, default 100')
+        self.parser.add_argument("--groups", action="store", type=int,
+            dest="groups", default=30, help='Number of PhEDEx user groups, default 30')
+        self.parser.add_argument("--skew", action="store", type=float,
+            dest="skew", default=1.1, help='Zipf exponent of popularity of campaigns and sites, 0 is uniform, default 1.1')
+        self.parser.add_argument("--part-datasets", action="store", type=int,
+            dest="part_datasets", default=20000, help='Number of datasets in one part file, default 20000')
+        self.parser.add_argument("--seed", action="store", type=int,
+            dest="seed", default=42, help='Seed of random generator, default 42')
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+    for date in opts.date.split(','):
+        if len(date) != 8:
+            raise Exception('Invalid date "%s". Example: 20170228' % date)
+    instances = [x.upper() for x in opts.inst.split(',')]
+    for inst in instances:
+        if inst not in DBS_INSTANCES:
+            raise Exception('Unsupported DBS instance "%s"' % inst)
+    if opts.sites < 10:
+        raise Exception('At least 10 sites are needed')
+    time0 = time.time()
+    generator = Generator(opts)
+    for inst in instances:
+        generator.generate(inst)
+    manifest = write_manifest(generator, time.time() - time0)
+    for path in sorted(manifest['rows']):
+        print('%12d %s' % (manifest['rows'][path], path))
+    print('Generated in %.1f s' % manifest['elapsed'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+"""
+HDFS client used by scripts instead of hadoop fs subprocesses.
+
+Client has list, du, get, open (stream of file content), delete and exists
+operations and one of three backends:
+    WebHdfsClient - WebHDFS REST API of the namenode, every thread keeps its
+                    HTTP connection open, so calls do not start a JVM and do
+                    not connect again. Used if WEBHDFS_URL is set, e.g.
+                    http://namenode:50070
+    LocalClient   - files of a local directory which mimics HDFS. Used if
+                    HDFS_LOCAL_ROOT is set (e.g. by pipeline.py --local)
+    HadoopClient  - hadoop fs command, used otherwise
+file:// paths are always local files.
+
+Client counts calls of every operation and their time. If HDFS_STATS is set
+to a file, counters of every process are appended to it as JSON lines when
+the process exits and `python hdfs_client.py stats` summarizes them.
+
+Usage: python hdfs_client.py ls|du|get|cat|rm|exists|stats [path] [local path]
+"""
+
+# system modules
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import threading
+import subprocess
+
+try:
+    import httplib
+    from urllib import quote, urlencode
+    from urlparse import urlparse
+except ImportError:
+    import http.client as httplib
+    from urllib.parse import quote, urlencode, urlparse
+
+CHUNK_SIZE = 1024 * 1024
+TIMEOUT = 120
+OPERATIONS = ['list', 'du', 'get', 'open', 'delete', 'exists']
+
+def hdfs_path(path):
+    "Absolute HDFS path of hdfs://host/path, hdfs:///path, /path or path relative to user home"
+    if path.startswith('hdfs://'):
+        path = '/' + path[len('hdfs://'):].split('/', 1)[-1]
+    if not path.startswith('/'):
+        path = '/user/%s/%s' % (os.environ.get('USER', 'user'), path)
+    return path
+
+class Client(object):
+    "Base of clients, counts calls of operations and their time"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = dict((op, {'calls': 0, 'seconds': 0.}) for op in OPERATIONS)
+        self.local = None if isinstance(self, LocalClient) else LocalClient()
+
+    def call(self, op, path, *args):
+        "Runs operation of backend of path and records its time"
+        backend = self.local if self.local and path.startswith('file://') else self
+        time0 = time.time()
+        try:
+            return getattr(backend, '_' + op)(path, *args)
+        finally:
+            with self.lock:
+                self.stats[op]['calls'] += 1
+                self.stats[op]['seconds'] += time.time() - time0
+
+    def list(self, path):
+        "Returns sorted list of name, size pairs of files in directory"
+        return self.call('list', path)
+
+    def du(self, path, timeout=TIMEOUT):
+        "Returns total size of files in path in bytes"
+        return self.call('du', path, timeout)
+
+    def get(self, path, local_path):
+        "Copies file to local_path"
+        return self.call('get', path, local_path)
+
+    def open(self, path):
+        "Returns binary stream with content of the file, time of reading it is not counted"
+        return self.call('open', path)
+
+    def delete(self, path):
+        "Removes file or directory with its content, returns False if it did not exist"
+        return self.call('delete', path)
+
+    def exists(self, path):
+        return self.call('exists', path)
+
+    def _get(self, path, local_path):
+        stream = self._open(path)
+        try:
+            with open(local_path, 'wb') as ostream:
+                shutil.copyfileobj(stream, ostream, CHUNK_SIZE)
+        finally:
+            stream.close()
+
+    def stats_table(self):
+        "Markdown table of calls and their time"
+        return stats_table(self.stats)
+
+class LocalClient(Client):
+    """
+    Files of a local directory which mimics HDFS. HDFS paths are mapped to
+    root directory, file:// paths are local files.
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+        Client.__init__(self)
+
+    def local_path(self, path):
+        if path.startswith('file://'):
+            return path[len('file://'):]
+        if not self.root:
+            return path
+        return os.path.join(self.root, hdfs_path(path).lstrip('/'))
+
+    def _exists(self, path):
+        return os.path.exists(self.local_path(path))
+
+    def _list(self, path):
+        local = self.local_path(path)
+        names = [x for x in os.listdir(local) if os.path.isfile(os.path.join(local, x))]
+        return sorted((x, os.path.getsize(os.path.join(local, x))) for x in names)
+
+    def _du(self, path, timeout=None):
+        local = self.local_path(path)
+        if os.path.isfile(local):
+            return os.path.getsize(local)
+        if not os.path.isdir(local):
+            raise Exception('%s: No such file or directory' % path)
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(local) for f in files)
+
+    def _get(self, path, local_path):
+        shutil.copyfile(self.local_path(path), local_path)
+
+    def _open(self, path):
+        return open(self.local_path(path), 'rb')
+
+    def _delete(self, path):
+        local = self.local_path(path)
+        if os.path.isdir(local):
+            shutil.rmtree(local)
+        elif os.path.exists(local):
+            os.remove(local)
+        else:
+            return False
+        return True
+
+class HadoopClient(Client):
+    "hadoop fs command, every call is a new JVM"
+
+    def __init__(self):
+        Client.__init__(self)
+        self.local = None
+
+    def run(self, args, timeout=None):
+        "Output of hadoop fs command, raises exception if it fails or does not finish within timeout seconds"
+        proc = subprocess.Popen(['hadoop', 'fs'] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timed_out = []
+
+        def kill():
+            timed_out.append(True)
+            proc.kill()
+
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer:
+            timer.start()
+        try:
+            out, err = proc.communicate()
+        finally:
+            if timer:
+                timer.cancel()
+        if timed_out:
+            raise Exception('hadoop fs %s did not finish in %s s' % (' '.join(args), timeout))
+        if proc.returncode != 0:
+            raise Exception('hadoop fs %s failed with exit code %s: %s'
+                            % (' '.join(args), proc.returncode, err.decode('utf-8', 'replace').strip()))
+        return out.decode('utf-8')
+
+    def _exists(self, path):
+        return subprocess.call(['hadoop', 'fs', '-test', '-e', path]) == 0
+
+    def _list(self, path):
+        files = []
+        for line in self.run(['-ls', path]).splitlines():
+            fields = line.split()
+            # skip 'Found N items' line and directories
+            if len(fields) < 8 or fields[0].startswith('d'):
+                continue
+            files.append((os.path.basename(fields[-1]), int(fields[4])))
+        return sorted(files)
+
+    def _du(self, path, timeout=TIMEOUT):
+        return int(self.run(['-du', '-s', path], timeout).split()[0])
+
+    def _get(self, path, local_path):
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        self.run(['-get', path, local_path])
+
+    def _open(self, path):
+        return HadoopStream(path)
+
+    def _delete(self, path):
+        if not self._exists(path):
+            return False
+        self.run(['-rm', '-r', path])
+        return True
+
+class HadoopStream(object):
+    "Output of hadoop fs -cat of a single file"
+
+    def __init__(self, path):
+        self.path = path
+        self.eof = False
+        self.proc = subprocess.Popen(['hadoop', 'fs', '-cat', path], stdout=subprocess.PIPE)
+
+    def read(self, size=-1):
+        data = self.proc.stdout.read(size)
+        if not data:
+            self.eof = True
+        return data
+
+    def readline(self):
+        return self.proc.stdout.readline()
+
+    def close(self):
+        # file which was not read to the end is not an error
+        if not self.eof:
+            self.proc.kill()
+        self.proc.stdout.close()
+        if self.proc.wait() != 0 and self.eof:
+            raise Exception('Failed to read %s' % self.path)
+
+class WebHdfsClient(Client):
+    """
+    WebHDFS REST API. Every thread keeps one connection to the namenode, file
+    content is read from datanodes the namenode redirects to. Requests are
+    made as user.name=$USER, or with a delegation token if WEBHDFS_TOKEN is set.
+    """
+
+    def __init__(self, url, user=None, token=None, timeout=TIMEOUT):
+        Client.__init__(self)
+        url = urlparse(url)
+        self.scheme = url.scheme
+        self.netloc = url.netloc
+        self.user = user or os.environ.get('USER', 'user')
+        self.token = token
+        self.timeout = timeout
+        self.connections = threading.local()
+
+    def connection(self, scheme, netloc, timeout):
+        "New HTTP connection"
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=timeout)
+        return httplib.HTTPConnection(netloc, timeout=timeout)
+
+    def url(self, path, op, **params):
+        params['op'] = op
+        if self.token:
+            params['delegation'] = self.token
+        else:
+            params['user.name'] = self.user
+        return '/webhdfs/v1%s?%s' % (quote(hdfs_path(path)), urlencode(sorted(params.items())))
+
+    def request(self, method, path, op, timeout=None, **params):
+        "Response of namenode on the connection of this thread, connection is opened again if it was closed"
+        url = self.url(path, op, **params)
+        for attempt in range(2):
+            conn = getattr(self.connections, 'conn', None)
+            if conn is None:
+                conn = self.connections.conn = self.connection(self.scheme, self.netloc, self.timeout)
+            try:
+                conn.request(method, url)
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout or self.timeout)
+                return conn.getresponse()
+            except (httplib.HTTPException, IOError):
+                # server closed the kept connection
+                conn.close()
+                self.connections.conn = None
+                if attempt:
+                    raise
+
+    def json(self, method, path, op, timeout=None, **params):
+        "JSON response of namenode, raises exception with message of remote exception"
+        response = self.request(method, path, op, timeout, **params)
+        data = response.read()
+        result = json.loads(data.decode('utf-8')) if data else {}
+        if response.status >= 400:
+            error = result.get('RemoteException', {})
+            raise WebHdfsError(response.status, '%s %s: %s' % (op, path, error.get('message', response.reason)))
+        return result
+
+    def _exists(self, path):
+        try:
+            self.json('GET', path, 'GETFILESTATUS')
+        except WebHdfsError as exc:
+            if exc.status == 404:
+                return False
+            raise
+        return True
+
+    def _list(self, path):
+        statuses = self.json('GET', path, 'LISTSTATUS')['FileStatuses']['FileStatus']
+        return sorted((x['pathSuffix'], x['length']) for x in statuses if x['type'] == 'FILE')
+
+    def _du(self, path, timeout=TIMEOUT):
+        return self.json('GET', path, 'GETCONTENTSUMMARY', timeout)['ContentSummary']['length']
+
+    def _open(self, path):
+        response = self.request('GET', path, 'OPEN')
+        if response.status in (301, 302, 307):
+            location = urlparse(response.getheader('Location'))
+            response.read()
+            # datanode connection is not kept, it serves only this file
+            conn = self.connection(location.scheme, location.netloc, self.timeout)
+            conn.request('GET', '%s?%s' % (location.path, location.query))
+            response = conn.getresponse()
+        if response.status >= 400:
+            data = response.read()
+            error = json.loads(data.decode('utf-8')).get('RemoteException', {}) if data else {}
+            raise WebHdfsError(response.status, 'OPEN %s: %s' % (path, error.get('message', response.reason)))
+        return WebHdfsStream(response)
+
+    def _delete(self, path):
+        return self.json('DELETE', path, 'DELETE', recursive='true')['boolean']
+
+class WebHdfsError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+class WebHdfsStream(object):
+    "Content of a file read from HTTP response"
+
+    def __init__(self, response):
+        self.response = response
+        self.buffer = b''
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.buffer + self.response.read()
+            self.buffer = b''
+            return data
+        if len(self.buffer) < size:
+            self.buffer += self.response.read(size - len(self.buffer))
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self):
+        while b'\n' not in self.buffer:
+            data = self.response.read(CHUNK_SIZE)
+            if not data:
+                break
+            self.buffer += data
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def close(self):
+        self.response.close()
+
+_client = None
+
+def default_client():
+    """
+    Client of this process, chosen by HDFS_LOCAL_ROOT and WEBHDFS_URL. It is
+    created once, so its connections are reused by all calls.
+    """
+    global _client
+    if _client is None:
+        if os.environ.get('HDFS_LOCAL_ROOT'):
+            _client = LocalClient(os.environ['HDFS_LOCAL_ROOT'])
+        elif os.environ.get('WEBHDFS_URL'):
+            _client = WebHdfsClient(os.environ['WEBHDFS_URL'], token=os.environ.get('WEBHDFS_TOKEN'))
+        else:
+            _client = HadoopClient()
+        if os.environ.get('HDFS_STATS'):
+            atexit.register(write_stats, _client, os.environ['HDFS_STATS'])
+    return _client
+
+def write_stats(client, fname):
+    "Appends counters of used operations of client to fname as a JSON line"
+    stats = dict((op, x) for op, x in client.stats.items() if x['calls'])
+    if not stats:
+        return
+    record = {'time': time.time(), 'client': type(client).__name__,
+              'command': ' '.join(os.path.basename(x) for x in sys.argv), 'stats': stats}
+    with open(fname, 'a') as ostream:
+        ostream.write(json.dumps(record, sort_keys=True) + '\n')
+
+def read_stats(fname):
+    "Counters of all processes in fname summed by operation"
+    stats = dict((op, {'calls': 0, 'seconds': 0.}) for op in OPERATIONS)
+    with open(fname) as istream:
+        for line in istream:
+            for op, values in json.loads(line)['stats'].items():
+                stats[op]['calls'] += values['calls']
+                stats[op]['seconds'] += values['seconds']
+    return stats
+
+def stats_table(stats):
+    "Markdown table of calls of operations and their time"
+    lines = ['| Operation | Calls | Time | Mean |', '| ------- | ------ | ------ | ------ |']
+    for op in OPERATIONS:
+        values = stats[op]
+        if values['calls']:
+            lines.append('| %s | %s | %.2f s | %.3f s |' % (op, values['calls'], values['seconds'],
+                                                              values['seconds'] / values['calls']))
+    return '\n'.join(lines)
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "HDFS operations with the client of hdfs_client.py"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("command", choices=['ls', 'du', 'get', 'cat', 'rm', 'exists', 'stats'],
+            help='ls, du -s, get, cat, rm -r, test -e, or stats of HDFS_STATS file')
+        self.parser.add_argument("path", nargs='?', default='', help='HDFS path')
+        self.parser.add_argument("local_path", nargs='?', default='', help='Local file of get')
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+    if opts.command == 'stats':
+        print(stats_table(read_stats(opts.path or os.environ['HDFS_STATS'])))
+        return
+    client = default_client()
+    if opts.command == 'ls':
+        for name, size in client.list(opts.path):
+            print('%12d %s' % (size, name))
+    elif opts.command == 'du':
+        print('%s  %s' % (client.du(opts.path), opts.path))
+    elif opts.command == 'get':
+        client.get(opts.path, opts.local_path or os.path.basename(opts.path.rstrip('/')))
+    elif opts.command == 'cat':
+        stream = client.open(opts.path)
+        try:
+            shutil.copyfileobj(stream, getattr(sys.stdout, 'buffer', sys.stdout), CHUNK_SIZE)
+        finally:
+            stream.close()
+    elif opts.command == 'rm':
+        if client.delete(opts.path):
+            print('Deleted %s' % opts.path)
+        else:
+            print('%s does not exist' % opts.path)
+    elif opts.command == 'exists':
+        sys.exit(0 if client.exists(opts.path) else 1)
+
+if __name__ == '__main__':
+    main()
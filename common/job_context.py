@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Spark and SQL contexts of Spark jobs.
+
+Jobs started by run_spark create and stop their own Spark context. Jobs
+started by spark_service.py run in a long-lived driver, they share its warm
+Spark context and each of them gets its own SQL session, so temporary tables
+of one job are not visible to others.
+"""
+
+from pyspark.sql import HiveContext
+
+# CMSSpark modules
+from CMSSpark.spark_utils import spark_context
+
+SHARED = {}
+
+def share_context(ctx, sqlContext):
+    "Makes jobs use given Spark context and sessions of given SQL context"
+    SHARED['ctx'] = ctx
+    SHARED['sql'] = sqlContext
+
+def unshare_context():
+    "Makes jobs create their own Spark contexts again"
+    SHARED.clear()
+
+def job_context(name, yarn=None, verbose=None):
+    "Shared Spark context if there is one, otherwise a new Spark context"
+    if 'ctx' in SHARED:
+        return SHARED['ctx']
+    return spark_context(name, yarn, verbose)
+
+def job_sql_context(ctx):
+    "New session of shared SQL context for shared Spark context, otherwise a new HiveContext"
+    if SHARED.get('ctx') is ctx:
+        return SHARED['sql'].newSession()
+    return HiveContext(ctx)
+
+def stop_context(ctx):
+    "Stops Spark context of a job unless it is shared"
+    if SHARED.get('ctx') is not ctx:
+        ctx.stop()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Merges CSV part files of a Spark output directory into a single CSV file.
+
+Part files are streamed straight into their place in the output file, so
+output directory is neither downloaded nor written locally twice. Parts are
+fetched concurrently. Every part starts with the same header line, which is
+kept only once: first line of every part is dropped by its position and
+data rows are never matched against the header. A JSON manifest with row
+counts and checksums of all parts and of the output is written next to it.
+
+Usage: python merge_parts.py --src=hdfs:///cms/users/$USER/campaigns/phedex --fout=campaigns_phedex_df.csv
+
+Files are read with the client of hdfs_client.py. Set HDFS_LOCAL_ROOT to a
+local directory to read hdfs:// paths from it instead of HDFS, e.g.
+hdfs:///cms/users/x is then $HDFS_LOCAL_ROOT/cms/users/x.
+"""
+
+# system modules
+import json
+import time
+import hashlib
+import argparse
+from multiprocessing.pool import ThreadPool
+
+from hdfs_client import LocalClient, default_client
+
+CHUNK_SIZE = 1024 * 1024
+WORKERS = 4
+
+def part_files(backend, src):
+    "Sorted list of name, size pairs of Spark part files in src directory"
+    return [x for x in backend.list(src) if x[0].startswith('part-')]
+
+def read_header(backend, src, parts):
+    "Header line (with line end) of the first non-empty part"
+    for name, size in parts:
+        if size == 0:
+            continue
+        stream = backend.open('%s/%s' % (src, name))
+        try:
+            return stream.readline()
+        finally:
+            stream.close()
+    return b''
+
+def copy_part(backend, src, name, fout, offset, header):
+    """
+    Streams part file without its first line to fout at given offset.
+    Returns manifest entry of the part.
+    """
+    md5 = hashlib.md5()
+    nbytes = 0
+    rows = 0
+    last = b'\n'
+    stream = backend.open('%s/%s' % (src, name))
+    try:
+        first = stream.readline()
+        if first and first != header:
+            raise Exception('First line of %s differs from header' % name)
+        with open(fout, 'r+b') as ostream:
+            ostream.seek(offset)
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                ostream.write(chunk)
+                md5.update(chunk)
+                nbytes += len(chunk)
+                rows += chunk.count(b'\n')
+                last = chunk[-1:]
+    finally:
+        stream.close()
+    if last != b'\n':
+        rows += 1
+    return {'name': name, 'bytes': nbytes, 'rows': rows, 'md5': md5.hexdigest()}
+
+def file_md5(fname):
+    "MD5 checksum of local file"
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as istream:
+        for chunk in iter(lambda: istream.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def merge_parts(src, fout, backend=None, workers=WORKERS, manifest=None):
+    """
+    Merges part files of src directory into fout CSV file and writes manifest
+    (fout.manifest.json by default). Returns manifest dictionary.
+    """
+    backend = backend or default_client()
+    manifest = manifest or '%s.manifest.json' % fout
+    time0 = time.time()
+
+    parts = part_files(backend, src)
+    header = read_header(backend, src, parts)
+
+    # Every non-empty part starts with the header, so the place of each part
+    # in the output is known from sizes of the parts before it
+    offsets = []
+    offset = len(header)
+    for name, size in parts:
+        offsets.append(offset)
+        if size:
+            offset += size - len(header)
+
+    with open(fout, 'wb') as ostream:
+        ostream.write(header)
+        ostream.truncate(offset)
+
+    def copy(args):
+        name, offset = args
+        return copy_part(backend, src, name, fout, offset, header)
+
+    jobs = [(name, offset) for (name, size), offset in zip(parts, offsets) if size]
+    pool = ThreadPool(max(1, min(workers, len(jobs))))
+    try:
+        entries = pool.map(copy, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    result = {'source': src,
+              'output': fout,
+              'header': header.decode('utf-8').rstrip('\r\n'),
+              'parts': entries,
+              'rows': sum(x['rows'] for x in entries),
+              'bytes': offset,
+              'md5': file_md5(fout),
+              'elapsed': time.time() - time0}
+
+    with open(manifest, 'w') as ostream:
+        json.dump(result, ostream, indent=2, sort_keys=True)
+
+    return result
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Merge CSV part files of Spark output directory into a single CSV file"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("--src", action="store",
+            dest="src", default="", help='Spark output directory, e.g. hdfs:///cms/users/$USER/campaigns/phedex')
+        self.parser.add_argument("--fout", action="store",
+            dest="fout", default="", help='Output CSV file')
+        self.parser.add_argument("--manifest", action="store",
+            dest="manifest", default="", help='Manifest file, default <fout>.manifest.json')
+        self.parser.add_argument("--workers", action="store", type=int,
+            dest="workers", default=WORKERS, help='Number of parts fetched concurrently, default %s' % WORKERS)
+        self.parser.add_argument("--local-root", action="store",
+            dest="local_root", default="", help='Local directory which mimics HDFS, default $HDFS_LOCAL_ROOT')
+        self.parser.add_argument("--skip-missing", action="store_true",
+            dest="skip_missing", default=False, help="Do nothing if src does not exist")
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+    backend = LocalClient(opts.local_root) if opts.local_root else default_client()
+    if opts.skip_missing and not backend.exists(opts.src):
+        print('Skip %s, it does not exist' % opts.src)
+        return
+    result = merge_parts(opts.src, opts.fout, backend, opts.workers, opts.manifest)
+    print('Merged %s parts of %s into %s: %s rows, %s bytes in %.1f s'
+          % (len(result['parts']), opts.src, opts.fout, result['rows'], result['bytes'], result['elapsed']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Markdown tables of Spark metrics written by spark_metrics.py for reports.
+"""
+
+# system modules
+import os
+import json
+import time
+
+from report_builder import bytes_to_readable
+
+def seconds_to_readable(sec):
+    if sec is None:
+        return '-'
+    return '%.1f s' % sec
+
+def skew_to_readable(skew):
+    if skew is None:
+        return '-'
+    return '%.1f' % skew
+
+def read_metrics(file_path):
+    if not os.path.exists(file_path):
+        return None
+    with open(file_path) as f:
+        return json.load(f)
+
+def read_history(file_path, limit=10):
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path) as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    return runs[-limit:]
+
+def timing_breakdown(metrics):
+    lines = ['| Action / Stage | Duration | Input | Shuffle Read | Shuffle Write | Spill | Task Skew |',
+             '| ------- | ------ | ------ | ------ | ------ | ------ | ------ |']
+
+    stages = dict((x['id'], x) for x in metrics.get('stages', []))
+
+    for action in metrics.get('actions', []):
+        lines.append('| **' + action['name'] + '**' +
+                     ' | ' + seconds_to_readable(action['duration']) +
+                     ' | ' + bytes_to_readable(action.get('input_bytes', 0)) +
+                     ' | ' + bytes_to_readable(action.get('shuffle_read_bytes', 0)) +
+                     ' | ' + bytes_to_readable(action.get('shuffle_write_bytes', 0)) +
+                     ' | ' + bytes_to_readable(action.get('memory_spill_bytes', 0) + action.get('disk_spill_bytes', 0)) +
+                     ' | ' + skew_to_readable(action.get('max_task_skew')) +
+                     ' |')
+
+        for stage_id in action.get('stages', []):
+            if stage_id not in stages:
+                continue
+            stage = stages[stage_id]
+            lines.append('| Stage ' + str(stage['id']) + ': ' + stage['name'].split(' at ')[0] +
+                         ' | ' + seconds_to_readable(stage['duration']) +
+                         ' | ' + bytes_to_readable(stage['input_bytes']) +
+                         ' | ' + bytes_to_readable(stage['shuffle_read_bytes']) +
+                         ' | ' + bytes_to_readable(stage['shuffle_write_bytes']) +
+                         ' | ' + bytes_to_readable(stage['memory_spill_bytes'] + stage['disk_spill_bytes']) +
+                         ' | ' + skew_to_readable(stage['task_skew']) +
+                         ' |')
+
+    return '\n'.join(lines)
+
+def runs_trend(history):
+    lines = ['| Run | Duration | Executors | Input | Shuffle Read | Shuffle Write | Spill |',
+             '| ------- | ------ | ------ | ------ | ------ | ------ | ------ |']
+
+    for run in history:
+        totals = run.get('totals') or {}
+        lines.append('| ' + time.strftime('%Y-%m-%d %H:%M', time.gmtime(run['start'])) +
+                     ' | ' + seconds_to_readable(run['duration']) +
+                     ' | ' + str(run.get('executors') or '-') +
+                     ' | ' + bytes_to_readable(totals.get('input_bytes', 0)) +
+                     ' | ' + bytes_to_readable(totals.get('shuffle_read_bytes', 0)) +
+                     ' | ' + bytes_to_readable(totals.get('shuffle_write_bytes', 0)) +
+                     ' | ' + bytes_to_readable(totals.get('memory_spill_bytes', 0) + totals.get('disk_spill_bytes', 0)) +
+                     ' |')
+
+    return '\n'.join(lines)
+
+def spark_metrics_report(metrics_file, history_file):
+    """
+    Returns markdown with timing breakdown of the latest Spark run and trend
+    of previous runs. Returns empty string if there are no metrics.
+    """
+    metrics = read_metrics(metrics_file)
+    if metrics is None:
+        return ''
+
+    sections = ['#### Spark job timing breakdown', timing_breakdown(metrics)]
+
+    history = read_history(history_file)
+    if len(history) > 1:
+        sections.append('#### Spark job runs trend')
+        sections.append(runs_trend(history))
+
+    return '\n'.join(sections)
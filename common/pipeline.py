@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+Runner of pipelines of shell commands declared as a DAG.
+
+Pipeline is a list of nodes, every node is a dictionary:
+    {'name': 'phedex_csv',              # unique node name
+     'command': 'python merge_parts.py --src={hdir}/phedex --fout=phedex_df.csv',
+     'deps': ['phedex'],                # nodes which must finish first
+     'skip': 'python result_cache.py get ...', # optional, node is skipped if it exits with 0
+     'skip_with': 'phedex'}             # optional, node is skipped if this node was skipped
+
+Commands are formatted with pipeline parameters and run by shell. Nodes
+whose dependencies are finished run in parallel, at most max_parallel of
+them at a time. Failed commands are retried with exponential backoff. State
+of nodes is kept in a JSON file, so rerun of a failed pipeline with the same
+parameters resumes from nodes which did not finish. Timing summary with a
+Gantt chart is printed and written to a markdown file at the end.
+
+In local mode hdfs_client.py and hadoop command (replaced by local_bin/hadoop)
+work with files under HDFS_LOCAL_ROOT directory and Spark jobs run in local[*]
+mode, so a pipeline can run end-to-end without a Hadoop cluster.
+"""
+
+# system modules
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+MAX_PARALLEL = 2
+RETRIES = 2
+BACKOFF = 30
+GANTT_WIDTH = 50
+LOCAL_BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_bin')
+LOCAL_ROOT = os.path.join(os.path.expanduser('~'), 'local_hdfs')
+
+DONE = ['done', 'skipped']
+
+def check_pipeline(nodes):
+    "Raises exception if node names are not unique or dependencies are unknown or cyclic"
+    names = [x['name'] for x in nodes]
+    if len(set(names)) != len(names):
+        raise Exception('Node names are not unique: %s' % ', '.join(names))
+    for node in nodes:
+        for dep in node.get('deps', []) + ([node['skip_with']] if node.get('skip_with') else []):
+            if dep not in names:
+                raise Exception('Node "%s" depends on unknown node "%s"' % (node['name'], dep))
+    # every node must be reachable in topological order
+    ordered = set()
+    while len(ordered) < len(nodes):
+        ready = [x['name'] for x in nodes if x['name'] not in ordered
+                 and all(d in ordered for d in x.get('deps', []))]
+        if not ready:
+            raise Exception('Pipeline has cyclic dependencies')
+        ordered.update(ready)
+
+def local_environment(env=None):
+    "Environment with local stand-ins of hadoop and Spark"
+    env = dict(env or os.environ)
+    env['PATH'] = LOCAL_BIN + os.pathsep + env.get('PATH', '')
+    env.setdefault('HDFS_LOCAL_ROOT', LOCAL_ROOT)
+    # CSV dumps written by generate_data.py
+    env.setdefault('CMS_HDIR', 'file://%s/project/awg/cms' % env['HDFS_LOCAL_ROOT'])
+    env['SPARK_LOCAL'] = '1'
+    return env
+
+class Pipeline(object):
+    "Runs nodes of a pipeline and keeps their state in state_file"
+
+    def __init__(self, name, nodes, params, state_file=None, max_parallel=MAX_PARALLEL,
+                 retries=RETRIES, backoff=BACKOFF, env=None, cwd=None):
+        check_pipeline(nodes)
+        self.name = name
+        self.nodes = nodes
+        self.params = params
+        self.state_file = state_file or '.pipeline_%s.json' % name
+        self.max_parallel = max(1, max_parallel)
+        self.retries = retries
+        self.backoff = backoff
+        self.env = env
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.state = self.load_state()
+
+    def load_state(self):
+        "State of unfinished previous run with the same parameters, otherwise empty state"
+        if os.path.isfile(self.state_file):
+            with open(self.state_file) as istream:
+                state = json.load(istream)
+            finished = all(state['nodes'].get(x['name'], {}).get('status') in DONE for x in self.nodes)
+            if state.get('params') == self.params and not finished:
+                # nodes which were running when previous run was killed start again
+                for record in state['nodes'].values():
+                    if record['status'] not in DONE:
+                        record['status'] = 'pending'
+                return state
+        return {'pipeline': self.name, 'params': self.params, 'nodes': {}}
+
+    def save_state(self):
+        with self.lock:
+            tmp = '%s.tmp' % self.state_file
+            with open(tmp, 'w') as ostream:
+                json.dump(self.state, ostream, indent=2, sort_keys=True)
+            os.rename(tmp, self.state_file)
+
+    def record(self, name):
+        return self.state['nodes'].setdefault(name, {'status': 'pending', 'attempts': 0})
+
+    def log(self, message):
+        with self.lock:
+            print('%s [%s] %s' % (time.strftime('%H:%M:%S'), self.name, message))
+            sys.stdout.flush()
+
+    def shell(self, command):
+        "Runs formatted command and returns its exit code"
+        return subprocess.call(command.format(**self.params), shell=True, env=self.env, cwd=self.cwd)
+
+    def run_node(self, node):
+        "Runs node with retries and returns its final status"
+        record = self.record(node['name'])
+        record['start'] = time.time()
+        if node.get('skip') and self.shell(node['skip']) == 0:
+            record['end'] = time.time()
+            return 'skipped'
+        for attempt in range(self.retries + 1):
+            record['attempts'] += 1
+            code = self.shell(node['command'])
+            if code == 0:
+                record['end'] = time.time()
+                return 'done'
+            record['error'] = 'exit code %s' % code
+            if attempt < self.retries:
+                delay = self.backoff * 2 ** attempt
+                self.log('%s failed with exit code %s, retry in %s s' % (node['name'], code, delay))
+                time.sleep(delay)
+        record['end'] = time.time()
+        return 'failed'
+
+    def run(self):
+        "Runs all nodes which are not finished yet, returns True if all of them finished"
+        time0 = time.time()
+        self.state['start'] = time0
+        finished = queue.Queue()
+        running = set()
+        nodes = dict((x['name'], x) for x in self.nodes)
+
+        def worker(node):
+            try:
+                status = self.run_node(node)
+            except Exception as exc:
+                self.record(node['name'])['error'] = str(exc)
+                status = 'failed'
+            finished.put((node['name'], status))
+
+        for name in nodes:
+            if self.record(name)['status'] in DONE:
+                self.log('%s already %s' % (name, self.record(name)['status']))
+
+        while True:
+            statuses = dict((name, self.record(name)['status']) for name in nodes)
+            blocked = [name for name, node in nodes.items() if statuses[name] == 'pending'
+                       and [d for d in node.get('deps', []) if statuses[d] in ['failed', 'blocked']]]
+            for name in blocked:
+                self.record(name)['status'] = 'blocked'
+                self.log('%s is blocked by failed dependencies' % name)
+            if blocked:
+                continue
+
+            ready = [name for name, node in nodes.items() if statuses[name] == 'pending'
+                     and all(statuses[d] in DONE for d in node.get('deps', []))]
+            for name in ready:
+                if len(running) >= self.max_parallel:
+                    break
+                skip_with = nodes[name].get('skip_with')
+                if skip_with and statuses[skip_with] == 'skipped':
+                    record = self.record(name)
+                    record['status'] = 'skipped'
+                    record['start'] = record['end'] = time.time()
+                    self.log('%s skipped with %s' % (name, skip_with))
+                    continue
+                self.record(name)['status'] = 'running'
+                running.add(name)
+                self.log('%s started' % name)
+                thread = threading.Thread(target=worker, args=(nodes[name],))
+                thread.daemon = True
+                thread.start()
+            self.save_state()
+
+            if not running:
+                if [x for x in ready if self.record(x)['status'] == 'skipped']:
+                    continue
+                break
+
+            name, status = finished.get()
+            running.discard(name)
+            record = self.record(name)
+            record['status'] = status
+            self.log('%s %s in %.1f s' % (name, status, record['end'] - record['start']))
+            self.save_state()
+
+        self.state['end'] = time.time()
+        self.save_state()
+        return all(self.record(x)['status'] in DONE for x in nodes)
+
+    def summary(self):
+        "Markdown table with status, attempts and timing of nodes and their Gantt chart"
+        records = [(x['name'], self.record(x['name'])) for x in self.nodes]
+        starts = [r['start'] for _, r in records if r.get('start')]
+        ends = [r['end'] for _, r in records if r.get('end')]
+        time0 = min(starts) if starts else 0
+        total = (max(ends) - time0) if ends else 0
+        scale = GANTT_WIDTH / total if total else 0
+        lines = ['| Node | Status | Attempts | Start | Duration | Timeline |',
+                 '| ------- | ------ | ------ | ------ | ------ | ------ |']
+        for name, record in records:
+            if record.get('start') and record.get('end'):
+                offset = record['start'] - time0
+                duration = record['end'] - record['start']
+                bar = '.' * int(offset * scale) + '#' * max(1, int(duration * scale))
+                lines.append('| %s | %s | %s | %.1f s | %.1f s | `%s` |' % (name, record['status'], record['attempts'],
+                             offset, duration, bar.ljust(GANTT_WIDTH)))
+            else:
+                lines.append('| %s | %s | %s | - | - | |' % (name, record['status'], record['attempts']))
+        lines.append('')
+        lines.append('Total time: %.1f s' % total)
+        return '\n'.join(lines)
+
+def pipeline_parser(desc):
+    "Argument parser with options common to all pipelines"
+    parser = argparse.ArgumentParser(prog='PROG', description=desc)
+    parser.add_argument("--max-parallel", action="store", type=int,
+        dest="max_parallel", default=MAX_PARALLEL, help='Maximal number of nodes running at once, default %s' % MAX_PARALLEL)
+    parser.add_argument("--retries", action="store", type=int,
+        dest="retries", default=RETRIES, help='Number of retries of failed nodes, default %s' % RETRIES)
+    parser.add_argument("--backoff", action="store", type=float,
+        dest="backoff", default=BACKOFF, help='Delay before the first retry in seconds, it doubles with every retry, default %s' % BACKOFF)
+    parser.add_argument("--restart", action="store_true",
+        dest="restart", default=False, help="Run all nodes again instead of resuming previous run")
+    parser.add_argument("--local", action="store_true",
+        dest="local", default=False, help="Use local stand-ins of hadoop and Spark, see local_bin/hadoop")
+    return parser
+
+def run_pipeline(name, nodes, params, opts):
+    "Runs pipeline with options of pipeline_parser, exits with 1 if it did not finish"
+    env = local_environment() if opts.local else None
+    state_file = '.pipeline_%s.json' % name
+    if opts.restart and os.path.isfile(state_file):
+        os.remove(state_file)
+    pipeline = Pipeline(name, nodes, params, state_file, opts.max_parallel, opts.retries, opts.backoff, env)
+    ok = pipeline.run()
+    summary = pipeline.summary()
+    print(summary)
+    with open('pipeline_%s_summary.md' % name, 'w') as ostream:
+        ostream.write(summary + '\n')
+    if not ok:
+        print('Pipeline %s did not finish, run it again to resume' % name)
+        sys.exit(1)
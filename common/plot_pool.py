@@ -0,0 +1,123 @@
+"""
+Rendering of report plots in worker processes.
+
+Plot function gets a small data payload (e.g. an aggregated data frame) and
+the output file name, it is run in a pool of worker processes while report
+tables are built in the main process. Figures are closed after every plot,
+so memory of workers does not grow. Rendering time of every plot is
+recorded and written to a JSON file when all plots are finished.
+
+Every plot is keyed by a hash of its data, source of its plot function and
+its file name. Keys of rendered plots are kept in a manifest file and a plot
+is not rendered again if its file exists and its key did not change.
+"""
+
+# system modules
+import os
+import json
+import time
+import hashlib
+import inspect
+from multiprocessing import Pool, cpu_count
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+PLOT_WORKERS = min(cpu_count(), 4)
+TIMINGS_FILE = 'plot_timings.json'
+MANIFEST_FILE = '.plot_manifest.json'
+
+def payload_text(payload):
+    "Text representation of plot data, data frames are represented by their csv"
+    if hasattr(payload, 'to_csv'):
+        return payload.to_csv()
+    return repr(payload)
+
+def plot_key(func, payload, fname):
+    "Hash of plot data, plot function and file name"
+    try:
+        source = inspect.getsource(func)
+    except (IOError, TypeError):
+        source = func.__name__
+    sha = hashlib.sha256()
+    for part in [fname, source, matplotlib.__version__, payload_text(payload)]:
+        if not isinstance(part, bytes):
+            part = part.encode('utf-8')
+        sha.update(part)
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+def render(func, payload, fname):
+    "Runs plot function and closes its figures, returns timing record"
+    time0 = time.time()
+    try:
+        func(payload, fname)
+    finally:
+        plt.close('all')
+    return {'plot': fname, 'function': func.__name__, 'seconds': time.time() - time0, 'pid': os.getpid(),
+            'cached': False}
+
+class PlotPool(object):
+    "Renders plots in worker processes, or in this process if workers is 0"
+
+    def __init__(self, workers=PLOT_WORKERS, timings_file=TIMINGS_FILE, manifest_file=MANIFEST_FILE):
+        self.pool = Pool(workers) if workers > 0 else None
+        self.timings_file = timings_file
+        self.manifest_file = manifest_file
+        self.manifest = {}
+        if manifest_file and os.path.isfile(manifest_file):
+            with open(manifest_file) as istream:
+                self.manifest = json.load(istream)
+        self.keys = {}
+        self.pending = []
+        self.timings = []
+
+    def submit(self, func, payload, fname):
+        """
+        Starts rendering of a plot unless it was already rendered from the
+        same data and returns its file name, func must be a module level function
+        """
+        key = plot_key(func, payload, fname) if self.manifest_file else None
+        if key and self.manifest.get(fname) == key and os.path.isfile(fname):
+            self.timings.append({'plot': fname, 'function': func.__name__, 'seconds': 0., 'pid': os.getpid(),
+                                 'cached': True})
+            return fname
+        # plot is out of date until it is rendered again
+        self.manifest.pop(fname, None)
+        self.keys[fname] = key
+        if self.pool:
+            self.pending.append(self.pool.apply_async(render, (func, payload, fname)))
+        else:
+            self.add(render(func, payload, fname))
+        return fname
+
+    def add(self, record):
+        self.timings.append(record)
+        if self.keys.get(record['plot']):
+            self.manifest[record['plot']] = self.keys[record['plot']]
+
+    def wait(self):
+        "Waits for all submitted plots and returns their file names"
+        try:
+            while self.pending:
+                self.add(self.pending.pop(0).get())
+        finally:
+            if self.manifest_file:
+                with open(self.manifest_file, 'w') as ostream:
+                    json.dump(self.manifest, ostream, indent=2, sort_keys=True)
+        with open(self.timings_file, 'w') as ostream:
+            json.dump(self.timings, ostream, indent=2, sort_keys=True)
+        return [x['plot'] for x in self.timings]
+
+    def close(self):
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+def timings_table(timings):
+    "Markdown table of plot rendering times"
+    lines = ['| Plot | Time |', '| ------- | ------ |']
+    for record in timings:
+        lines.append('| %s | %s |' % (record['plot'], 'not changed' if record.get('cached') else '%.1f s' % record['seconds']))
+    return '\n'.join(lines)
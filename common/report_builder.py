@@ -0,0 +1,76 @@
+"""
+Markdown reports of analyse.py and visualize.py scripts.
+
+Report keeps its lines in a list and writes them once, so building a report
+does not copy the whole text on every appended line. Tables are rendered
+column by column: unit conversions of a column are done at once with numpy
+and values are formatted without creating a row object for every table row.
+Formatting of values keeps the rounding and number types of the previous
+per-row formatting, so reports are byte-identical.
+"""
+
+import numpy as np
+
+class ReportBuilder(object):
+    "Markdown report assembled from appended lines"
+
+    def __init__(self, text=''):
+        self.parts = [text] if text else []
+
+    def append(self, lines):
+        self.parts.append(lines)
+        self.parts.append('\n')
+
+    def table(self, header, columns):
+        "Appends table with header and columns given as lists of formatted cells"
+        self.append('| ' + ' | '.join(header) + ' |')
+        self.append('| ' + ' | '.join(['-------'] + ['------'] * (len(header) - 1)) + ' |')
+        for cells in zip(*columns):
+            self.append('| ' + ' | '.join(cells) + ' |')
+
+    def text(self):
+        return ''.join(self.parts)
+
+    def write(self, fname):
+        with open(fname, 'w') as f:
+            f.writelines(self.parts)
+
+def bytes_to_readable(num, suffix='B'):
+    "Binary multiple of bytes, e.g. 1.5 GB"
+    for unit in ['','K','M','G','T','P','E','Z']:
+        if abs(num) < 1024.0:
+            return "%3.1f %s%s" % (num, unit, suffix)
+        num /= 1024.0
+    return "%.1f %s%s" % (num, 'Yi', suffix)
+
+def head_rows(df, head=0):
+    "First head rows of data frame or all of them if head is 0"
+    if head != 0:
+        return df[:head]
+    return df
+
+def strings(values):
+    return [str(x) for x in values]
+
+def int_strings(values):
+    return [str(int(x)) for x in values]
+
+def rounded_strings(values, digits):
+    "Values rounded to digits, values keep their types, so numpy and Python values round as before"
+    return [str(round(x, digits)) for x in values]
+
+def pb_strings(values, decimal_points=1):
+    "Bytes in petabytes as strings"
+    return rounded_strings((np.asarray(values, dtype=float) / float(1000**5)).tolist(), decimal_points + 1)
+
+def pib_strings(values, decimal_points=1):
+    "Bytes in pebibytes as strings"
+    return rounded_strings((np.asarray(values, dtype=float) / float(1024**5)).tolist(), decimal_points)
+
+def pb_pib_strings(values, decimal_points=1):
+    "Bytes as 'PB - PiB' strings"
+    return [pb + ' - ' + pib for pb, pib in zip(pb_strings(values, decimal_points), pib_strings(values, decimal_points))]
+
+def ratio_strings(numerators, denominators):
+    "Ratios with two decimal points, values are divided with types they have in data frame rows"
+    return ['{:.2f}'.format(float(x / y)) for x, y in zip(numerators, denominators)]
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Local cache of results of aggregation jobs.
+
+Results are stored under a key which is a hash of job name, snapshot date,
+DBS instances, job options and content of job source files. If the same job
+was already run with the same inputs and sources, aggregate scripts restore
+its result files from the cache instead of launching spark-submit.
+
+Usage:
+    python result_cache.py get --job=campaigns --date=20170228 --sources=a.py,b.py --outputs=df.csv
+    python result_cache.py put --job=campaigns --date=20170228 --sources=a.py,b.py --outputs=df.csv
+    python result_cache.py invalidate --job=campaigns [--date=20170228]
+    python result_cache.py evict --max-size=5G --max-age=30
+    python result_cache.py stats
+
+get exits with 0 and copies result files to current directory on a hit and
+exits with 1 on a miss. Cache is kept in ~/.cache/cern_tasks/results (or in
+$RESULT_CACHE if it is set). Set RESULT_CACHE_REFRESH to treat every get as
+a miss, results are then recomputed and replaced by put.
+"""
+
+# system modules
+import os
+import sys
+import json
+import fcntl
+import time
+import shutil
+import hashlib
+import argparse
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cern_tasks', 'results')
+STATS_FILE = 'stats.json'
+LOCK_FILE = 'stats.lock'
+LOG_FILE = 'cache.log'
+META_FILE = 'meta.json'
+MAX_SIZE = '5G'
+MAX_AGE = 30
+
+def cache_dir():
+    "Location of the cache"
+    return os.environ.get('RESULT_CACHE') or CACHE_DIR
+
+def parse_size(size):
+    "Number of bytes of size with optional K, M, G or T suffix"
+    units = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    size = str(size).strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+def file_hash(fname):
+    "SHA-256 checksum of file content"
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as istream:
+        for chunk in iter(lambda: istream.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def source_hash(sources):
+    "Hash of content of job source files, missing files are part of the hash too"
+    sha = hashlib.sha256()
+    for fname in sorted(sources):
+        digest = file_hash(fname) if os.path.isfile(fname) else 'missing'
+        sha.update(('%s:%s\n' % (os.path.basename(fname), digest)).encode('utf-8'))
+    return sha.hexdigest()
+
+def cache_key(job, date, instances, options, sources):
+    "Returns key and description of the result of a job"
+    desc = {'job': job,
+            'date': date,
+            'instances': sorted(instances),
+            'options': sorted(options),
+            'sources': source_hash(sources)}
+    key = hashlib.sha256(json.dumps(desc, sort_keys=True).encode('utf-8')).hexdigest()
+    return key, desc
+
+class ResultCache(object):
+    "Cache entries are directories named by keys with result files and meta.json"
+
+    def __init__(self, location=None):
+        self.location = location or cache_dir()
+        if not os.path.isdir(self.location):
+            os.makedirs(self.location)
+
+    def entry_dir(self, key):
+        return os.path.join(self.location, key)
+
+    def entries(self):
+        "List of meta data of all entries"
+        result = []
+        for key in sorted(os.listdir(self.location)):
+            meta_file = os.path.join(self.location, key, META_FILE)
+            if os.path.isfile(meta_file):
+                with open(meta_file) as istream:
+                    result.append(json.load(istream))
+        return result
+
+    def log(self, message):
+        "Prints message and appends it to the log of the cache"
+        line = '%s %s' % (time.strftime('%Y-%m-%d %H:%M:%S'), message)
+        print(line)
+        with open(os.path.join(self.location, LOG_FILE), 'a') as ostream:
+            ostream.write(line + '\n')
+
+    def count(self, job, event):
+        """
+        Increases number of hits or misses of job. Jobs of a pipeline may
+        count at the same time, so the update holds a lock and statistics
+        are replaced by rename, readers never see a partially written file.
+        """
+        fname = os.path.join(self.location, STATS_FILE)
+        with open(os.path.join(self.location, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                stats = {}
+                if os.path.isfile(fname):
+                    with open(fname) as istream:
+                        stats = json.load(istream)
+                job_stats = stats.setdefault(job, {'hit': 0, 'miss': 0})
+                job_stats[event] += 1
+                tmp = '%s.tmp%s' % (fname, os.getpid())
+                with open(tmp, 'w') as ostream:
+                    json.dump(stats, ostream, indent=2, sort_keys=True)
+                os.rename(tmp, fname)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get(self, key, desc, outputs, dest='.'):
+        """
+        Copies result files of key to dest directory. Returns True on a hit
+        and False on a miss.
+        """
+        edir = self.entry_dir(key)
+        meta_file = os.path.join(edir, META_FILE)
+        hit = os.path.isfile(meta_file) and not os.environ.get('RESULT_CACHE_REFRESH')
+        if hit:
+            with open(meta_file) as istream:
+                meta = json.load(istream)
+            hit = sorted(meta['files']) == sorted(os.path.basename(x) for x in outputs)
+        if not hit:
+            self.count(desc['job'], 'miss')
+            self.log('miss %s %s %s' % (desc['job'], desc['date'], key[:12]))
+            return False
+
+        for name in meta['files']:
+            shutil.copy2(os.path.join(edir, name), os.path.join(dest, name))
+        meta['used'] = time.time()
+        with open(meta_file, 'w') as ostream:
+            json.dump(meta, ostream, indent=2, sort_keys=True)
+        self.count(desc['job'], 'hit')
+        self.log('hit %s %s %s, created %s' % (desc['job'], desc['date'], key[:12],
+                 time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(meta['created']))))
+        return True
+
+    def put(self, key, desc, outputs):
+        "Stores result files of key, nothing is stored if some of them are missing"
+        missing = [x for x in outputs if not os.path.isfile(x)]
+        if missing:
+            self.log('skip %s %s, missing outputs: %s' % (desc['job'], desc['date'], ', '.join(missing)))
+            return False
+
+        # files are copied to a temporary directory first, so an entry is
+        # either complete or absent
+        edir = self.entry_dir(key)
+        tmp_dir = '%s.tmp%s' % (edir, os.getpid())
+        os.makedirs(tmp_dir)
+        size = 0
+        for fname in outputs:
+            shutil.copy2(fname, os.path.join(tmp_dir, os.path.basename(fname)))
+            size += os.path.getsize(fname)
+        meta = dict(desc, key=key, files=[os.path.basename(x) for x in outputs],
+                    size=size, created=time.time(), used=time.time())
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as ostream:
+            json.dump(meta, ostream, indent=2, sort_keys=True)
+        if os.path.isdir(edir):
+            shutil.rmtree(edir)
+        os.rename(tmp_dir, edir)
+        self.log('put %s %s %s, %s bytes' % (desc['job'], desc['date'], key[:12], size))
+        return True
+
+    def remove(self, meta, reason):
+        shutil.rmtree(self.entry_dir(meta['key']), ignore_errors=True)
+        self.log('remove %s %s %s, %s' % (meta['job'], meta['date'], meta['key'][:12], reason))
+
+    def invalidate(self, job=None, date=None):
+        "Removes entries of job (all jobs if not given) and date (all dates if not given)"
+        removed = 0
+        for meta in self.entries():
+            if (job and meta['job'] != job) or (date and meta['date'] != date):
+                continue
+            self.remove(meta, 'invalidated')
+            removed += 1
+        return removed
+
+    def evict(self, max_size=None, max_age=None):
+        """
+        Removes entries older than max_age days and then least recently used
+        entries until total size is at most max_size bytes.
+        """
+        entries = self.entries()
+        if max_age is not None:
+            limit = time.time() - max_age * 24 * 3600
+            for meta in [x for x in entries if x['created'] < limit]:
+                self.remove(meta, 'older than %s days' % max_age)
+                entries.remove(meta)
+        if max_size is not None:
+            entries.sort(key=lambda x: x['used'])
+            total = sum(x['size'] for x in entries)
+            while entries and total > max_size:
+                meta = entries.pop(0)
+                total -= meta['size']
+                self.remove(meta, 'cache is larger than %s bytes' % max_size)
+
+    def stats(self):
+        "Markdown table with hits, misses, entries and size of every job"
+        job_counts = {}
+        fname = os.path.join(self.location, STATS_FILE)
+        if os.path.isfile(fname):
+            with open(fname) as istream:
+                job_counts = json.load(istream)
+        entries = self.entries()
+        jobs = sorted(set(job_counts) | set(x['job'] for x in entries))
+        lines = ['| Job | Hits | Misses | Hit rate | Entries | Size |',
+                 '| ------- | ------ | ------ | ------ | ------ | ------ |']
+        for job in jobs:
+            counts = job_counts.get(job, {'hit': 0, 'miss': 0})
+            total = counts['hit'] + counts['miss']
+            rate = '%.0f%%' % (100.0 * counts['hit'] / total) if total else '-'
+            job_entries = [x for x in entries if x['job'] == job]
+            lines.append('| %s | %s | %s | %s | %s | %s |' % (job, counts['hit'], counts['miss'], rate,
+                         len(job_entries), sum(x['size'] for x in job_entries)))
+        return '\n'.join(lines)
+
+def split_list(value):
+    return [x for x in value.split(',') if x] if value else []
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Local cache of results of aggregation jobs"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("command", choices=['get', 'put', 'invalidate', 'evict', 'stats'],
+            help='get or put results, invalidate or evict entries or print statistics')
+        self.parser.add_argument("--job", action="store",
+            dest="job", default="", help='Job name')
+        self.parser.add_argument("--date", action="store",
+            dest="date", default="", help='Snapshot date (YYYYMMDD)')
+        self.parser.add_argument("--inst", action="store",
+            dest="inst", default="", help='Comma-separated list of DBS instances')
+        self.parser.add_argument("--options", action="store",
+            dest="options", default="", help='Comma-separated list of job options which change results')
+        self.parser.add_argument("--sources", action="store",
+            dest="sources", default="", help='Comma-separated list of job source files')
+        self.parser.add_argument("--outputs", action="store",
+            dest="outputs", default="", help='Comma-separated list of result files')
+        self.parser.add_argument("--max-size", action="store",
+            dest="max_size", default=MAX_SIZE, help='Maximal size of the cache, default %s' % MAX_SIZE)
+        self.parser.add_argument("--max-age", action="store", type=float,
+            dest="max_age", default=MAX_AGE, help='Maximal age of entries in days, default %s' % MAX_AGE)
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+    cache = ResultCache()
+
+    if opts.command in ['get', 'put']:
+        outputs = split_list(opts.outputs)
+        key, desc = cache_key(opts.job, opts.date, split_list(opts.inst),
+                              split_list(opts.options), split_list(opts.sources))
+        if opts.command == 'get':
+            sys.exit(0 if cache.get(key, desc, outputs) else 1)
+        cache.put(key, desc, outputs)
+        cache.evict(parse_size(opts.max_size), opts.max_age)
+    elif opts.command == 'invalidate':
+        removed = cache.invalidate(opts.job, opts.date)
+        print('Removed %s entries' % removed)
+    elif opts.command == 'evict':
+        cache.evict(parse_size(opts.max_size), opts.max_age)
+    else:
+        print(cache.stats())
+
+if __name__ == '__main__':
+    main()
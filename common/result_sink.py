@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""
+Writes results of Spark scripts either to HDFS or directly to local files.
+
+Small results are collected to the driver and written to a local CSV (or
+Parquet) file with a header line, the same file as downloading and merging
+HDFS output would produce. Larger results are written to HDFS as before.
+"""
+
+# system modules
+import os
+import csv
+import sys
+
+from pyspark import StorageLevel
+
+MAX_ROWS = 100000
+FORMATS = ['csv', 'parquet']
+
+def csv_value(value):
+    "Value of a CSV cell, nulls are written as empty cells as by spark-csv"
+    if value is None:
+        return ''
+    if sys.version_info[0] == 2 and isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def write_local_csv(columns, rows, fname):
+    "Writes header and rows to local CSV file"
+    mode = 'wb' if sys.version_info[0] == 2 else 'w'
+    kwargs = {} if sys.version_info[0] == 2 else {'newline': ''}
+    with open(fname, mode, **kwargs) as ostream:
+        writer = csv.writer(ostream, lineterminator='\n')
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([csv_value(x) for x in row])
+
+def write_local_parquet(columns, rows, fname):
+    "Writes rows to local Parquet file, requires pandas with pyarrow"
+    import pandas as pd
+    pd.DataFrame([tuple(x) for x in rows], columns=columns).to_parquet(fname, index=False)
+
+def local_file(local, fmt):
+    "Local file name of given format, CSV file name with .csv suffix replaced for Parquet"
+    if fmt == 'parquet':
+        return os.path.splitext(local)[0] + '.parquet'
+    return local
+
+def write_result(df, fout=None, local=None, max_rows=MAX_ROWS, fmt='csv'):
+    """
+    Writes df to local file if local file name is given and df has at most
+    max_rows rows. Otherwise df is written to fout directory on HDFS as CSV.
+    Returns name of written file or directory.
+    """
+    if local:
+        # rows are counted by the same job which collects them, df is
+        # kept around in case it is too large and has to go to HDFS
+        df.persist(StorageLevel.MEMORY_AND_DISK)
+        rows = df.take(max_rows + 1)
+        if len(rows) <= max_rows:
+            fname = local_file(local, fmt)
+            if fmt == 'parquet':
+                write_local_parquet(df.columns, rows, fname)
+            else:
+                write_local_csv(df.columns, rows, fname)
+            df.unpersist()
+            print('Wrote %s rows to %s' % (len(rows), fname))
+            return fname
+
+    if fout:
+        df.write.format("com.databricks.spark.csv")\
+                .option("header", "true").save(fout)
+    if local:
+        df.unpersist()
+    return fout
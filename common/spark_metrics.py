@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Collection of per-action and per-stage metrics of running Spark application.
+
+Metrics are taken from Spark monitoring REST API of the application UI
+(/api/v1/applications/<app-id>/...) before Spark context is stopped:
+    metrics = SparkMetrics(ctx, 'phedex')
+    with metrics.action('write phedex'):
+        df.write...
+    metrics.write('phedex_metrics.json', 'phedex_metrics_history.json')
+"""
+
+# system modules
+import json
+import time
+import datetime
+from contextlib import contextmanager
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+REST_TIMEOUT = 10
+
+def ui_url(ctx):
+    "Returns address of Spark UI of given Spark context"
+    try:
+        return ctx._jsc.sc().ui().get().appUIAddress()
+    except Exception:
+        host = ctx._conf.get('spark.driver.host', 'localhost')
+        port = ctx._conf.get('spark.ui.port', '4040')
+        return 'http://%s:%s' % (host, port)
+
+def fetch(url):
+    "Returns decoded JSON document of given url"
+    return json.loads(urlopen(url, timeout=REST_TIMEOUT).read().decode('utf-8'))
+
+def rest_time(value):
+    "Converts time of Spark REST API (2017-02-28T10:00:00.000GMT) to sec since epoch"
+    if  not value:
+        return None
+    date = datetime.datetime.strptime(value.replace('GMT', ''), '%Y-%m-%dT%H:%M:%S.%f')
+    return (date - datetime.datetime(1970, 1, 1)).total_seconds()
+
+def duration(start, end):
+    "Returns difference of two times or None if any of them is missing"
+    if  start is None or end is None:
+        return None
+    return end - start
+
+def stage_metrics(stage, summary=None):
+    "Converts stage data of Spark REST API to metrics record"
+    record = {'id': stage['stageId'],
+              'attempt': stage['attemptId'],
+              'name': stage.get('name', ''),
+              'status': stage.get('status', ''),
+              'duration': duration(rest_time(stage.get('submissionTime')), rest_time(stage.get('completionTime'))),
+              'tasks': stage.get('numCompleteTasks', 0) + stage.get('numFailedTasks', 0),
+              'failed_tasks': stage.get('numFailedTasks', 0),
+              'executor_run_time': stage.get('executorRunTime', 0) / 1000.0,
+              'input_bytes': stage.get('inputBytes', 0),
+              'shuffle_read_bytes': stage.get('shuffleReadBytes', 0),
+              'shuffle_write_bytes': stage.get('shuffleWriteBytes', 0),
+              'memory_spill_bytes': stage.get('memoryBytesSpilled', 0),
+              'disk_spill_bytes': stage.get('diskBytesSpilled', 0),
+              'task_skew': None}
+
+    # Skew is the ratio of the longest and median task run time
+    if  summary:
+        median, longest = summary['executorRunTime']
+        if  median:
+            record['task_skew'] = longest / float(median)
+    return record
+
+def totals(stages):
+    "Sums byte counters of given stage records"
+    keys = ['input_bytes', 'shuffle_read_bytes', 'shuffle_write_bytes', 'memory_spill_bytes', 'disk_spill_bytes']
+    result = dict((key, 0) for key in keys)
+    for stage in stages:
+        for key in keys:
+            result[key] += stage[key]
+    skews = [x['task_skew'] for x in stages if x['task_skew'] is not None]
+    result['max_task_skew'] = max(skews) if skews else None
+    return result
+
+class SparkMetrics(object):
+    "Collects metrics of Spark actions, jobs, stages and executors of running application"
+    def __init__(self, ctx, name):
+        self.ctx = ctx
+        self.name = name
+        self.time0 = time.time()
+        self.actions = []
+
+    @contextmanager
+    def action(self, name):
+        "Context manager which assigns all Spark jobs started inside it to action of given name"
+        # start time keeps groups unique when jobs share an application
+        group = '%s-%d-%s' % (self.name, self.time0 * 1000, len(self.actions))
+        self.ctx.setJobGroup(group, name)
+        time0 = time.time()
+        try:
+            yield
+        finally:
+            self.actions.append({'name': name, 'group': group, 'duration': time.time() - time0})
+            self.ctx._jsc.clearJobGroup()
+
+    def collect(self):
+        "Returns dictionary with metrics of the application, it must run before Spark context is stopped"
+        metrics = {'job': self.name,
+                   'application_id': self.ctx.applicationId,
+                   'start': self.time0,
+                   'duration': time.time() - self.time0,
+                   'actions': [dict(x) for x in self.actions]}
+        try:
+            base = '%s/api/v1/applications/%s' % (ui_url(self.ctx), self.ctx.applicationId)
+            # Only Spark jobs started after this object was created belong to
+            # it, other jobs may run in the same application of spark_service.py
+            jobs = [x for x in fetch('%s/jobs' % base)
+                    if (rest_time(x.get('submissionTime')) or self.time0) >= int(self.time0)]
+            job_stages = set(sid for x in jobs for sid in x.get('stageIds', []))
+            executors = fetch('%s/executors' % base)
+            stages = []
+            for stage in fetch('%s/stages' % base):
+                if  stage['stageId'] not in job_stages:
+                    continue
+                summary = None
+                if  stage.get('status') == 'COMPLETE' and stage.get('numCompleteTasks', 0) > 1:
+                    url = '%s/stages/%s/%s/taskSummary?quantiles=0.5,1.0' % (base, stage['stageId'], stage['attemptId'])
+                    summary = fetch(url)
+                stages.append(stage_metrics(stage, summary))
+        except Exception as exc:
+            # Metrics must never break the job itself
+            print('Unable to collect Spark metrics: %s' % exc)
+            metrics['error'] = str(exc)
+            return metrics
+
+        metrics['executors'] = len([x for x in executors if x.get('id') != 'driver'])
+        metrics['stages'] = sorted(stages, key=lambda x: (x['id'], x['attempt']))
+        metrics['totals'] = totals(stages)
+
+        # Assign jobs and their stages to actions
+        for action in metrics['actions']:
+            action_jobs = [x for x in jobs if x.get('jobGroup') == action['group']]
+            stage_ids = set(sid for x in action_jobs for sid in x.get('stageIds', []))
+            action_stages = [x for x in stages if x['id'] in stage_ids]
+            action['jobs'] = sorted(x['jobId'] for x in action_jobs)
+            action['stages'] = sorted(stage_ids)
+            action.update(totals(action_stages))
+        return metrics
+
+    def write(self, fname, fhistory=None):
+        """
+        Writes metrics of the application as JSON to fname. Summary of the
+        run is appended to fhistory (one JSON document per line) if it is given.
+        """
+        metrics = self.collect()
+        with open(fname, 'w') as ostream:
+            json.dump(metrics, ostream, indent=2, sort_keys=True)
+
+        if  fhistory:
+            summary = dict((key, metrics.get(key)) for key in
+                           ['job', 'application_id', 'start', 'duration', 'executors', 'totals'])
+            summary['actions'] = [{'name': x['name'], 'duration': x['duration']} for x in metrics['actions']]
+            with open(fhistory, 'a') as ostream:
+                ostream.write(json.dumps(summary, sort_keys=True) + '\n')
+        return metrics
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Long-lived Spark driver which runs Spark jobs of this repository.
+
+Service keeps a warm Spark context and runs job requests one after another.
+Job request is a module of CMSSpark package and its command line arguments,
+job runs main() of the module in the working directory of the client. Jobs
+get their own SQL sessions (see job_context.py), so temporary tables are not
+shared between them, and data they persisted is released when they finish.
+Modules of CMSSpark package are imported again for every job, so updated
+job sources and their helpers are used, except job_context.py which holds
+the shared context.
+
+Usage:
+    spark-submit spark_service.py serve --port=50505
+    python spark_service.py submit aggregate_phedex --fout=hdfs:///... --date=20170228
+    python spark_service.py stats
+    python spark_service.py shutdown
+    spark-submit spark_service.py run "aggregate_phedex --date=20170228" "aggregate_dbs --inst=global"
+
+run executes jobs of its arguments in one Spark context without a server.
+Service runs in local[*] mode unless a master is given by spark-submit.
+Timings of all jobs are appended to spark_service_jobs.json of the directory
+where service was started.
+"""
+
+# system modules
+import os
+import sys
+import json
+import time
+import shlex
+import socket
+import argparse
+import importlib
+import traceback
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+HOST = '127.0.0.1'
+PORT = 50505
+MASTER = 'local[*]'
+PACKAGE = 'CMSSpark'
+JOBS_FILE = 'spark_service_jobs.json'
+# modules of the package which are kept between jobs
+KEEP_MODULES = ['%s.job_context' % PACKAGE]
+
+def forget_modules(name, package=PACKAGE, keep=KEEP_MODULES):
+    "Removes module name and modules of package from sys.modules, so they are imported again"
+    for module in list(sys.modules):
+        if (module == name or module.startswith(package + '.')) and module not in keep:
+            del sys.modules[module]
+
+class JobRunner(object):
+    "Runs jobs in a shared Spark context and keeps their timings"
+
+    def __init__(self, master=MASTER, name='spark_service'):
+        from pyspark import SparkConf, SparkContext
+        from pyspark.sql import HiveContext
+        from CMSSpark.job_context import share_context
+
+        conf = SparkConf().setAppName(name)
+        if not conf.contains('spark.master'):
+            conf.setMaster(master)
+        time0 = time.time()
+        self.ctx = SparkContext(conf=conf)
+        self.sqlContext = HiveContext(self.ctx)
+        # HiveContext is initialized lazily, first query makes it warm
+        self.sqlContext.sql('SELECT 1').collect()
+        share_context(self.ctx, self.sqlContext)
+        self.jobs_file = os.path.abspath(JOBS_FILE)
+        self.jobs = []
+        print('Spark context of %s is ready in %.1f s' % (self.ctx.master, time.time() - time0))
+
+    def release(self):
+        """
+        Unpersists data which was persisted by the last job, cached tables
+        and data frames are removed from the SQL cache first and RDDs which
+        were persisted directly are unpersisted afterwards
+        """
+        self.sqlContext.clearCache()
+        for rdd in self.ctx._jsc.getPersistentRDDs().values():
+            rdd.unpersist()
+
+    def run(self, module, args, cwd=None):
+        "Runs main() of the module with given arguments, returns job record"
+        name = module if '.' in module else '%s.%s' % (PACKAGE, module)
+        record = {'id': len(self.jobs) + 1, 'module': name, 'args': list(args),
+                  'cwd': cwd or os.getcwd(), 'start': time.time(), 'status': 'ok'}
+        argv = sys.argv
+        pwd = os.getcwd()
+        try:
+            os.chdir(record['cwd'])
+            # job sources and their helpers may be updated between jobs
+            forget_modules(name)
+            job = importlib.import_module(name)
+            sys.argv = [name] + list(args)
+            job.main()
+        except SystemExit as exc:
+            # argparse exits on wrong arguments
+            if exc.code:
+                record['status'] = 'error'
+                record['error'] = 'exit code %s' % exc.code
+        except Exception as exc:
+            traceback.print_exc()
+            record['status'] = 'error'
+            record['error'] = '%s: %s' % (exc.__class__.__name__, exc)
+        finally:
+            sys.argv = argv
+            os.chdir(pwd)
+            self.ctx._jsc.clearJobGroup()
+            self.release()
+        record['elapsed'] = time.time() - record['start']
+        self.jobs.append(record)
+        with open(self.jobs_file, 'a') as ostream:
+            ostream.write(json.dumps(record, sort_keys=True) + '\n')
+        print('Job %s %s %s: %s in %.1f s' % (record['id'], name, ' '.join(args), record['status'], record['elapsed']))
+        return record
+
+    def stop(self):
+        from CMSSpark.job_context import unshare_context
+        unshare_context()
+        self.ctx.stop()
+
+def timings(jobs):
+    "Markdown table with timings of jobs"
+    lines = ['| Job | Module | Arguments | Status | Elapsed |',
+             '| ------- | ------ | ------ | ------ | ------ |']
+    for job in jobs:
+        lines.append('| %s | %s | %s | %s | %.1f s |' % (job['id'], job['module'], ' '.join(job['args']),
+                                                         job['status'], job['elapsed']))
+    return '\n'.join(lines)
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    "Handles one JSON request per connection and replies with one JSON document"
+
+    def handle(self):
+        runner = self.server.runner
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            command = request.get('command')
+            if command == 'run':
+                reply = runner.run(request['module'], request.get('args', []), request.get('cwd'))
+            elif command == 'stats':
+                reply = {'status': 'ok', 'jobs': runner.jobs}
+            elif command == 'shutdown':
+                reply = {'status': 'ok'}
+                self.server.stopping = True
+            else:
+                reply = {'status': 'error', 'error': 'Unknown command "%s"' % command}
+        except Exception as exc:
+            reply = {'status': 'error', 'error': str(exc)}
+        self.wfile.write((json.dumps(reply, sort_keys=True) + '\n').encode('utf-8'))
+
+class JobServer(socketserver.TCPServer):
+    "Local TCP server which handles requests one at a time"
+    allow_reuse_address = True
+
+    def __init__(self, runner, host=HOST, port=PORT):
+        socketserver.TCPServer.__init__(self, (host, port), RequestHandler)
+        self.runner = runner
+        self.stopping = False
+
+    def serve(self):
+        while not self.stopping:
+            self.handle_request()
+        self.server_close()
+
+def request(message, host=HOST, port=PORT):
+    "Sends request to the service and returns its reply"
+    sock = socket.create_connection((host, port))
+    try:
+        stream = sock.makefile('rwb')
+        stream.write((json.dumps(message) + '\n').encode('utf-8'))
+        stream.flush()
+        return json.loads(stream.readline().decode('utf-8'))
+    finally:
+        sock.close()
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Long-lived Spark driver which runs Spark jobs of this repository"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("command", choices=['serve', 'submit', 'run', 'stats', 'shutdown'],
+            help='serve jobs, submit job to service, run jobs without service, print timings or stop service')
+        self.parser.add_argument("job", nargs='*',
+            help='submit: job module and its arguments, run: quoted jobs with arguments. '
+                 'Options of the service must be given before them')
+        self.parser.add_argument("--port", action="store", type=int,
+            dest="port", default=PORT, help='Port of the service, default %s' % PORT)
+        self.parser.add_argument("--master", action="store",
+            dest="master", default=MASTER, help='Spark master if it is not given by spark-submit, default %s' % MASTER)
+
+def parse_args(parser, argv):
+    """
+    Parses command and options of the service, which are given before the
+    job. Everything from the job module on are arguments of the job, even if
+    they look like options of the service.
+    """
+    idx = 0
+    command = None
+    while idx < len(argv):
+        name = argv[idx].split('=', 1)[0]
+        if name in ['--port', '--master']:
+            idx += 1 if '=' in argv[idx] else 2
+        elif name in ['-h', '--help']:
+            idx += 1
+        elif command is None and not name.startswith('-'):
+            command = argv[idx]
+            idx += 1
+        else:
+            break
+    opts = parser.parse_args(argv[:idx])
+    opts.job = argv[idx:]
+    return opts
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = parse_args(optmgr.parser, sys.argv[1:])
+
+    if opts.command == 'serve':
+        server = JobServer(JobRunner(opts.master), port=opts.port)
+        print('Serving Spark jobs on %s:%s' % (HOST, opts.port))
+        try:
+            server.serve()
+        finally:
+            print(timings(server.runner.jobs))
+            server.runner.stop()
+    elif opts.command == 'run':
+        runner = JobRunner(opts.master)
+        try:
+            for job in opts.job:
+                args = shlex.split(job)
+                runner.run(args[0], args[1:])
+        finally:
+            print(timings(runner.jobs))
+            runner.stop()
+        if [x for x in runner.jobs if x['status'] != 'ok']:
+            sys.exit(1)
+    elif opts.command == 'submit':
+        if not opts.job:
+            optmgr.parser.error('job module is required')
+        reply = request({'command': 'run', 'module': opts.job[0], 'args': opts.job[1:], 'cwd': os.getcwd()},
+                        port=opts.port)
+        if reply['status'] != 'ok':
+            print('Job failed: %s' % reply.get('error'))
+            sys.exit(1)
+        print('Job %s finished in %.1f s' % (reply['id'], reply['elapsed']))
+    elif opts.command == 'stats':
+        reply = request({'command': 'stats'}, port=opts.port)
+        print(timings(reply['jobs']))
+    else:
+        request({'command': 'shutdown'}, port=opts.port)
+
+if __name__ == '__main__':
+    main()
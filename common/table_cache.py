@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+Spark script to convert PhEDEx block-replica snapshots and DBS tables on HDFS
+into Parquet cache, and functions to read them back from it.
+
+Cache layout (cache can be any Hadoop supported location, e.g. hdfs:///... or
+file:///... for a local directory):
+    <cache>/phedex/date=YYYYMMDD
+    <cache>/dbs/<table>/inst=GLOBAL
+Jobs read only the columns they need from the cache. When a date or instance
+is not in the cache yet, tables are read from CSV files with CMSSpark. CSV
+files are read from hdfs:///project/awg/cms, or from CMS_HDIR if it is set
+(e.g. to data of generate_data.py).
+"""
+
+# system modules
+import os
+import time
+import argparse
+
+# CMSSpark modules
+from CMSSpark.spark_utils import dbs_tables, phedex_tables
+from CMSSpark.job_context import job_context, job_sql_context, stop_context
+from CMSSpark.utils import elapsed_time
+
+DBS_TABLES = ['daf', 'ddf', 'bdf', 'fdf']
+HDIR = os.environ.get('CMS_HDIR', 'hdfs:///project/awg/cms')
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Spark script to convert DBS and PhEDEx tables to Parquet cache"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("--cache", action="store",
+            dest="cache", default="", help='Location of Parquet cache, e.g. hdfs:///cms/users/USER/parquet_cache')
+        self.parser.add_argument("--date", action="store",
+            dest="date", default="", help='Convert PhEDEx snapshots of given dates (comma-separated list of YYYYMMDD)')
+        msg = 'Convert tables of given DBS instances (comma-separated list of global, phys01, phys02, phys03)'
+        self.parser.add_argument("--inst", action="store",
+            dest="inst", default="", help=msg)
+        self.parser.add_argument("--no-log4j", action="store_true",
+            dest="no-log4j", default=False, help="Disable spark log4j messages")
+        self.parser.add_argument("--yarn", action="store_true",
+            dest="yarn", default=False, help="run job on analytics cluster via yarn resource manager")
+        self.parser.add_argument("--verbose", action="store_true",
+            dest="verbose", default=False, help="verbose output")
+
+def phedex_partition(cache, date):
+    "Location of PhEDEx snapshot of given date (YYYYMMDD) in the cache"
+    return '%s/phedex/date=%s' % (cache, date)
+
+def dbs_partition(cache, table, inst):
+    "Location of DBS table of given instance in the cache"
+    return '%s/dbs/%s/inst=%s' % (cache, table, inst)
+
+def is_cached(sqlContext, path):
+    """
+    Checks whether given cache partition was completely written. Spark writes
+    _SUCCESS file only after all parts of the partition are written.
+    """
+    ctx = sqlContext._sc
+    jpath = ctx._jvm.org.apache.hadoop.fs.Path('%s/_SUCCESS' % path)
+    fs = jpath.getFileSystem(ctx._jsc.hadoopConfiguration())
+    return fs.exists(jpath)
+
+def cache_phedex(sqlContext, cache, date, verbose=None):
+    "Converts PhEDEx snapshot of given date (YYYYMMDD) to Parquet cache"
+    fromdate = '%s-%s-%s' % (date[:4], date[4:6], date[6:])
+    todate = fromdate
+    tables = phedex_tables(sqlContext, hdir=HDIR, verbose=verbose, fromdate=fromdate, todate=todate)
+    tables['phedex_df'].write.mode('overwrite').parquet(phedex_partition(cache, date))
+
+def cache_dbs(sqlContext, cache, inst, verbose=None):
+    "Converts DBS tables of given instance to Parquet cache"
+    tables = dbs_tables(sqlContext, hdir=HDIR, inst=inst, verbose=verbose)
+    for name in DBS_TABLES:
+        tables[name].write.mode('overwrite').parquet(dbs_partition(cache, name, inst))
+
+def phedex_table(sqlContext, date, columns, cache=None, verbose=None):
+    """
+    Returns given columns of PhEDEx snapshot of given date (YYYYMMDD). Snapshot
+    is read from the cache if it is there, otherwise from CSV files on HDFS.
+    """
+    if cache and is_cached(sqlContext, phedex_partition(cache, date)):
+        if verbose:
+            print('Reading PhEDEx snapshot %s from cache %s' % (date, cache))
+        return sqlContext.read.parquet(phedex_partition(cache, date)).select(columns)
+
+    fromdate = '%s-%s-%s' % (date[:4], date[4:6], date[6:])
+    todate = fromdate
+    tables = phedex_tables(sqlContext, hdir=HDIR, verbose=verbose, fromdate=fromdate, todate=todate)
+    return tables['phedex_df'].select(columns)
+
+def dbs_table_columns(sqlContext, inst, columns, cache=None, verbose=None):
+    """
+    Returns dictionary of DBS tables of given instance. columns is a
+    dictionary of table name and list of columns to read, e.g.
+    {'fdf': ['f_dataset_id', 'f_file_size']}. Tables are read from the cache
+    if they are there, otherwise from CSV files on HDFS.
+    """
+    tables = {}
+    csv_tables = None
+    for name, cols in columns.items():
+        if cache and is_cached(sqlContext, dbs_partition(cache, name, inst)):
+            if verbose:
+                print('Reading DBS %s table %s from cache %s' % (inst, name, cache))
+            tables[name] = sqlContext.read.parquet(dbs_partition(cache, name, inst)).select(cols)
+            continue
+
+        if csv_tables is None:
+            csv_tables = dbs_tables(sqlContext, hdir=HDIR, inst=inst, verbose=verbose)
+        tables[name] = csv_tables[name].select(cols)
+
+    return tables
+
+def run(cache, dates, instances, yarn=None, verbose=None):
+    """
+    Main function to run pyspark job. Converts PhEDEx snapshots of given
+    dates and DBS tables of given instances to Parquet cache.
+    """
+    # define spark context, it's main object which allow to communicate with spark
+    ctx = job_context('cms', yarn, verbose)
+    sqlContext = job_sql_context(ctx)
+
+    for date in dates:
+        print('Converting PhEDEx snapshot %s' % date)
+        cache_phedex(sqlContext, cache, date, verbose)
+
+    for inst in instances:
+        print('Converting DBS %s tables' % inst)
+        cache_dbs(sqlContext, cache, inst, verbose)
+
+    stop_context(ctx)
+
+def main():
+    "Main function"
+    optmgr  = OptionParser()
+    opts = optmgr.parser.parse_args()
+    print("Input arguments: %s" % opts)
+    time0 = time.time()
+    if  not opts.cache:
+        raise Exception('Cache location is not given')
+    dates = opts.date.split(',') if opts.date else []
+    for date in dates:
+        if  len(date) != 8:
+            raise Exception('Invalid date "%s". Example: 20170228' % date)
+    instances = opts.inst.split(',') if opts.inst else []
+    for inst in instances:
+        if  inst not in ['global', 'phys01', 'phys02', 'phys03']:
+            raise Exception('Unsupported DBS instance "%s"' % inst)
+    instances = [x.upper() for x in instances]
+    run(opts.cache, dates, instances, opts.yarn, opts.verbose)
+    print('Start time  : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time0)))
+    print('End time    : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time.time())))
+    print('Elapsed time: %s sec' % elapsed_time(time0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Checks of parsing of spark_service.py command lines used by run_job and
+spark_service_start and of importing job modules again. Spark is not needed.
+
+Usage: python -m unittest test_spark_service
+"""
+
+# system modules
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import importlib
+
+from spark_service import MASTER, PORT, OptionParser, forget_modules, parse_args
+
+def parse(line):
+    return parse_args(OptionParser().parser, line.split())
+
+class ParseArgsTest(unittest.TestCase):
+
+    def test_submit_of_run_job(self):
+        # ../common/run_job: spark_service.py submit --port=$SPARK_SERVICE ${script%.py} "$@"
+        opts = parse('submit --port=50506 aggregate_phedex --fout=hdfs:///cms/users/x/phedex --yarn --verbose '
+                     '--date=20170228 --cache=')
+        self.assertEqual(opts.command, 'submit')
+        self.assertEqual(opts.port, 50506)
+        self.assertEqual(opts.job, ['aggregate_phedex', '--fout=hdfs:///cms/users/x/phedex', '--yarn', '--verbose',
+                                    '--date=20170228', '--cache='])
+
+    def test_serve_of_spark_service_start(self):
+        # spark_service_start: spark_service.py serve --port=$port
+        opts = parse('serve --port=50506')
+        self.assertEqual((opts.command, opts.port, opts.master, opts.job), ('serve', 50506, MASTER, []))
+
+    def test_stats_and_shutdown(self):
+        for command in ['stats', 'shutdown']:
+            opts = parse('%s --port 50507' % command)
+            self.assertEqual((opts.command, opts.port, opts.job), (command, 50507, []))
+
+    def test_options_before_command(self):
+        opts = parse('--master=yarn --port=50508 serve')
+        self.assertEqual((opts.command, opts.port, opts.master), ('serve', 50508, 'yarn'))
+
+    def test_job_options_like_service_options(self):
+        # options after the job module belong to the job
+        opts = parse('submit aggregate_all --port=1 --master=x')
+        self.assertEqual((opts.port, opts.master), (PORT, MASTER))
+        self.assertEqual(opts.job, ['aggregate_all', '--port=1', '--master=x'])
+
+    def test_run(self):
+        opts = parse_args(OptionParser().parser, ['run', '--master=local[2]', 'aggregate_phedex --date=20170228',
+                                                  'aggregate_dbs'])
+        self.assertEqual(opts.master, 'local[2]')
+        self.assertEqual(opts.job, ['aggregate_phedex --date=20170228', 'aggregate_dbs'])
+
+class ForgetModulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'jobpkg'))
+        for name in ['__init__', 'context']:
+            self.write(name, '')
+        self.write('helper', 'VALUE = 1\n')
+        self.write('job', 'from jobpkg.helper import VALUE\n')
+        sys.path.insert(0, self.directory)
+
+    def tearDown(self):
+        sys.path.remove(self.directory)
+        forget_modules('jobpkg', 'jobpkg', [])
+        shutil.rmtree(self.directory)
+
+    def write(self, name, text):
+        with open(os.path.join(self.directory, 'jobpkg', '%s.py' % name), 'w') as ostream:
+            ostream.write(text)
+        for cached in [name + '.pyc', '__pycache__']:
+            path = os.path.join(self.directory, 'jobpkg', cached)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.isfile(path):
+                os.remove(path)
+
+    def test_helpers_are_imported_again(self):
+        job = importlib.import_module('jobpkg.job')
+        context = importlib.import_module('jobpkg.context')
+        self.assertEqual(job.VALUE, 1)
+        self.write('helper', 'VALUE = 2\n')
+        forget_modules('jobpkg.job', 'jobpkg', ['jobpkg.context'])
+        job = importlib.import_module('jobpkg.job')
+        self.assertEqual(job.VALUE, 2)
+        self.assertTrue(importlib.import_module('jobpkg.context') is context)
+
+if __name__ == '__main__':
+    unittest.main()
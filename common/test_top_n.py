@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Checks of top_n.py heaps against sorted(), which orders rows as
+orderBy(...).limit(n) does: nulls first in ascending and last in descending
+order, ties in order of partitions and of rows within them.
+
+Usage: python -m unittest test_top_n
+"""
+
+# system modules
+import random
+import unittest
+
+from top_n import merge_heaps, partition_heaps
+
+def top_by_partitions(partitions, rankings, n):
+    "Top rows of rows split into partitions, computed as on Spark executors and driver"
+    heaps = []
+    for index, rows in enumerate(partitions):
+        heaps.extend(partition_heaps(rankings, n)(index, iter(rows)))
+    return merge_heaps(heaps, rankings, n)
+
+def top_by_sort(partitions, column, ascending, n):
+    "Top rows by stable sort of all rows in partition order"
+    rows = [row for rows in partitions for row in rows]
+    nulls = [x for x in rows if x[column] is None]
+    values = sorted([x for x in rows if x[column] is not None], key=lambda x: x[column], reverse=not ascending)
+    return ((nulls + values) if ascending else (values + nulls))[:n]
+
+class TopNTest(unittest.TestCase):
+
+    def check(self, partitions, n):
+        rankings = {'size_desc': ('size', False), 'size_asc': ('size', True),
+                    'name_desc': ('name', False), 'name_asc': ('name', True)}
+        result = top_by_partitions(partitions, rankings, n)
+        for name, (column, ascending) in rankings.items():
+            self.assertEqual(result[name], top_by_sort(partitions, column, ascending, n),
+                             '%s, n=%s, partitions=%s' % (name, n, partitions))
+
+    def test_ties_and_nulls(self):
+        partitions = [[{'id': 1, 'size': 5, 'name': 'b'}, {'id': 2, 'size': None, 'name': 'a'}],
+                      [],
+                      [{'id': 3, 'size': 5, 'name': None}, {'id': 4, 'size': 7, 'name': 'b'},
+                       {'id': 5, 'size': None, 'name': 'b'}],
+                      [{'id': 6, 'size': 5, 'name': 'a'}]]
+        for n in range(1, 8):
+            self.check(partitions, n)
+
+    def test_random(self):
+        rnd = random.Random(42)
+        for _ in range(200):
+            partitions = [[{'id': rnd.random(),
+                            'size': rnd.choice([None, 0, 1, 2, 3]),
+                            'name': rnd.choice([None, 'a', 'b', 'c'])}
+                           for _ in range(rnd.randint(0, 10))] for _ in range(rnd.randint(1, 5))]
+            self.check(partitions, rnd.randint(1, 15))
+
+if __name__ == '__main__':
+    unittest.main()
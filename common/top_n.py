@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Exact top-N rows of Spark dataframes without a global sort.
+
+Every partition keeps bounded heaps of its best rows, one heap per ranking,
+so several rankings of the same dataframe are computed from a single scan.
+Heaps of all partitions are merged on the driver. Only partitions * n rows
+of every ranking leave the executors, instead of range partitioning and
+sorting the whole dataframe as orderBy().limit() does.
+"""
+
+# system modules
+import heapq
+
+TOP = 100
+
+class Reversed(object):
+    "Sort key wrapper which reverses order of wrapped key"
+    __slots__ = ['key']
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+def ranking_key(value, ascending):
+    """
+    Sort key of a column value such that larger key means better rank.
+    Null values are ranked first in ascending and last in descending order,
+    as they are by orderBy.
+    """
+    if ascending:
+        return Reversed((value is not None, value))
+    return (value is not None, value)
+
+def partition_heaps(rankings, n):
+    """
+    Returns function for mapPartitionsWithIndex which yields name, entries
+    pairs with n best entries of every ranking in the partition. Entry is
+    (key, (-partition, -position), row) tuple. Negated partition and position
+    make entries unique and earlier rows win ties, so rows themselves are
+    never compared.
+    """
+    def heaps(index, rows):
+        result = dict((name, []) for name in rankings)
+        for position, row in enumerate(rows):
+            for name, (column, ascending) in rankings.items():
+                heap = result[name]
+                entry = (ranking_key(row[column], ascending), (-index, -position), row)
+                if len(heap) < n:
+                    heapq.heappush(heap, entry)
+                elif heap[0] < entry:
+                    heapq.heapreplace(heap, entry)
+        for name, heap in result.items():
+            yield name, heap
+    return heaps
+
+def merge_heaps(heaps, rankings, n=TOP):
+    """
+    Merges name, entries pairs of partition_heaps of all partitions into
+    dictionary of lists of n best rows of every ranking in ranking order
+    """
+    entries = dict((name, []) for name in rankings)
+    for name, heap in heaps:
+        entries[name].extend(heap)
+
+    result = {}
+    for name, ranked in entries.items():
+        best = heapq.nlargest(n, ranked, key=lambda x: x[:2])
+        result[name] = [x[2] for x in best]
+    return result
+
+def top_rows(df, rankings, n=TOP):
+    """
+    Returns dictionary of lists of n best rows of df for every ranking.
+    rankings is a dictionary name: (column, ascending), rows of each list are
+    in ranking order. Ties are resolved by position of rows in df.
+    """
+    if n <= 0:
+        return dict((name, []) for name in rankings)
+    return merge_heaps(df.rdd.mapPartitionsWithIndex(partition_heaps(rankings, n)).collect(), rankings, n)
+
+def top_frames(df, rankings, n=TOP):
+    """
+    Same as top_rows but returns dataframes with schema of df. Each of them
+    has a single partition, so rows are written out in ranking order.
+    """
+    sqlContext = df.sql_ctx
+    frames = {}
+    for name, rows in top_rows(df, rankings, n).items():
+        rdd = sqlContext._sc.parallelize(rows, 1)
+        frames[name] = sqlContext.createDataFrame(rdd, df.schema)
+    return frames
+
+def top_frame(df, column, ascending=False, n=TOP):
+    "Dataframe with n best rows of df ranked by given column"
+    return top_frames(df, {column: (column, ascending)}, n)[column]
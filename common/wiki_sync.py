@@ -0,0 +1,56 @@
+"""
+Synchronization of report files with the wiki repository.
+
+Only files whose content differs are copied and only files which are not in
+the source directory any more are removed, so unchanged files of the wiki
+are not touched and commits of reports contain only changed files. Files of
+the source directory which were not produced by the current run (e.g. plots
+of sites which are gone) are removed from both directories.
+"""
+
+# system modules
+import os
+import shutil
+import filecmp
+
+def remove_stale(src, files):
+    "Removes files of src directory which are not in files list, returns their number"
+    produced = set(os.path.abspath(x) for x in files)
+    removed = 0
+    for name in sorted(os.listdir(src)):
+        src_file = os.path.join(src, name)
+        if os.path.isfile(src_file) and os.path.abspath(src_file) not in produced:
+            os.remove(src_file)
+            removed += 1
+    return removed
+
+def sync_directory(src, dest, files=None):
+    """
+    Makes dest directory a copy of src directory, returns numbers of copied,
+    removed and unchanged files. If files produced by the current run are
+    given, other files of src are removed first.
+    """
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    if files is not None:
+        remove_stale(src, files)
+    copied = removed = unchanged = 0
+    names = set()
+    for name in sorted(os.listdir(src)):
+        src_file = os.path.join(src, name)
+        dest_file = os.path.join(dest, name)
+        if not os.path.isfile(src_file):
+            continue
+        names.add(name)
+        if os.path.isfile(dest_file) and filecmp.cmp(src_file, dest_file, shallow=False):
+            unchanged += 1
+            continue
+        shutil.copy2(src_file, dest_file)
+        copied += 1
+    for name in sorted(os.listdir(dest)):
+        dest_file = os.path.join(dest, name)
+        if name not in names and os.path.isfile(dest_file):
+            os.remove(dest_file)
+            removed += 1
+    print('Synchronized %s with %s: %s copied, %s removed, %s unchanged' % (dest, src, copied, removed, unchanged))
+    return copied, removed, unchanged
@@ -4,30 +4,136 @@ import matplotlib as mpl
 # We will not be showing images because we don't haw UI
 mpl.use('Agg')
 import matplotlib.pyplot as plt
+from multiprocessing import Pool, cpu_count
+import argparse
+import os
+import re
+import sys
 
-# Read data
-df = pd.read_csv('df.csv')
+sys.path.append('../common')
+from chunked_csv import chunked_aggregate
 
-# Aggregate by the same column twice
-result = df.groupby('site').agg({'size': 'sum', 'site': 'count'})
+# Only these columns of df.csv are read
+COLUMNS = {'site': 'category', 'size': 'int64'}
 
-# We could also use lambdas
-# result = df.groupby('site').agg({'size': lambda x: x.sum(), 'site': lambda x: x.count()})
+SIZES_FILE = 'site_sizes_by_date.csv'
+COUNTS_FILE = 'site_counts_by_date.csv'
+TREND_FILE = 'site_trends.pdf'
+TOP_SITES = 15
 
-result.columns.values[0] = 'number_of_sites'
-result.columns.values[1] = 'sum_size'
+def site_counts(df):
+    # Sum of sizes and number of rows of every site
+    grouped = df.groupby('site', observed=True)
+    return pd.DataFrame({'size': grouped['size'].sum(), 'count': grouped.size()}, columns=['size', 'count'])
 
-# Print results
-print(result)
+def site_summary(fname):
+    # Read and aggregate data in chunks of rows, so memory does not grow with size of the file
+    return chunked_aggregate(fname, COLUMNS, site_counts, ['site'])
 
-# Construct plot
-result.plot(kind='bar', subplots=True, layout=(2, 1), figsize=(8, 6), fontsize=5)
+def snapshot_files(directory):
+    "Dictionary of snapshot dates and csv files, date (YYYYMMDD) is a part of file name"
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        match = re.search(r'(\d{8})', name)
+        if name.endswith('.csv') and match:
+            if match.group(1) in files:
+                raise Exception('More than one snapshot of %s in %s' % (match.group(1), directory))
+            files[match.group(1)] = os.path.join(directory, name)
+    return files
 
-# Remove xlabel
-plt.xlabel(' ')
+def date_summary(args):
+    date, fname = args
+    return date, site_summary(fname)
 
-# We have a lot of data so turn on tight layout mode
-plt.tight_layout()
+def site_history(files, workers):
+    "Sizes and row counts of sites (rows) in all snapshot dates (columns), snapshots are aggregated in parallel"
+    jobs = sorted(files.items())
+    if workers > 1 and len(jobs) > 1:
+        pool = Pool(min(workers, len(jobs)))
+        try:
+            results = pool.map(date_summary, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [date_summary(x) for x in jobs]
 
-# Export plot to file
-plt.savefig('figure.pdf', dpi=100)
+    sizes = pd.DataFrame(dict((date, result['size']) for date, result in results), columns=sorted(files))
+    counts = pd.DataFrame(dict((date, result['count']) for date, result in results), columns=sorted(files))
+    # Sites missing in a snapshot have no data there
+    sizes = sizes.fillna(0).astype('int64').sort_index()
+    counts = counts.fillna(0).astype('int64').sort_index()
+    sizes.index.name = counts.index.name = 'site'
+    return sizes, counts
+
+def make_trend_plot(sizes, counts, file_path, top=TOP_SITES):
+    "Size and row count trends of sites which are the largest in the latest snapshot"
+    sites = sizes[sizes.columns[-1]].sort_values(ascending=False).index[:top]
+    dates = pd.to_datetime(sizes.columns, format='%Y%m%d')
+
+    fig, axes = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
+    for site in sites:
+        axes[0].plot(dates, sizes.loc[site].values / 1000000000000., marker='.', label=site)
+        axes[1].plot(dates, counts.loc[site].values, marker='.', label=site)
+    axes[0].set_ylabel('Terabytes')
+    axes[1].set_ylabel('Number')
+    axes[0].legend(fontsize=6, ncol=3)
+
+    fig.autofmt_xdate()
+    plt.tight_layout()
+    plt.savefig(file_path, dpi=100)
+    plt.close(fig)
+
+def analyse_snapshot():
+    result = site_summary('df.csv')
+
+    result.columns.values[0] = 'number_of_sites'
+    result.columns.values[1] = 'sum_size'
+
+    # Print results
+    print(result)
+
+    # Construct plot
+    result.plot(kind='bar', subplots=True, layout=(2, 1), figsize=(8, 6), fontsize=5)
+
+    # Remove xlabel
+    plt.xlabel(' ')
+
+    # We have a lot of data so turn on tight layout mode
+    plt.tight_layout()
+
+    # Export plot to file
+    plt.savefig('figure.pdf', dpi=100)
+
+def analyse_snapshots(directory, workers):
+    files = snapshot_files(directory)
+    if not files:
+        raise Exception('No snapshot files with YYYYMMDD dates in names in %s' % directory)
+
+    sizes, counts = site_history(files, workers)
+    sizes.to_csv(SIZES_FILE)
+    counts.to_csv(COUNTS_FILE)
+    print('Sizes and row counts of %s sites in %s snapshots are written to %s and %s'
+          % (len(sizes), len(files), SIZES_FILE, COUNTS_FILE))
+
+    make_trend_plot(sizes, counts, TREND_FILE)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshots", action="store",
+                        dest="snapshots",
+                        default='',
+                        help="Directory of per-date csv files, e.g. df_20170228.csv. Site history is built instead of df.csv analysis")
+    parser.add_argument("--workers", action="store", type=int,
+                        dest="workers",
+                        default=cpu_count(),
+                        help="Number of processes aggregating snapshots, default is number of cores")
+    opts = parser.parse_args()
+
+    if opts.snapshots:
+        analyse_snapshots(opts.snapshots, opts.workers)
+    else:
+        analyse_snapshot()
+
+if __name__ == '__main__':
+    main()
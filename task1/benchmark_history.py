@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Benchmark of site history of analyse.py with different numbers of worker
+processes. Per-date snapshot files are generated, every number of workers
+aggregates all of them and results are compared with the result of one
+worker. Script fails if they differ.
+
+Usage: python benchmark_history.py --dates=16 --rows=1000000
+"""
+
+# system modules
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import datetime
+from multiprocessing import cpu_count
+
+import numpy as np
+import pandas as pd
+
+# local modules
+from analyse import site_history, snapshot_files
+
+SITES = ['T1_US_FNAL_Disk', 'T1_DE_KIT_Disk', 'T1_IT_CNAF_Disk', 'T2_CH_CERN', 'T2_US_Nebraska',
+         'T2_DE_DESY', 'T2_US_Purdue', 'T2_IT_Pisa', 'T3_US_FNALLPC', 'T3_IT_Trieste']
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Benchmark of parallel site history aggregation"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("--dates", action="store", type=int,
+            dest="dates", default=16, help='Number of generated snapshots, default 16')
+        self.parser.add_argument("--rows", action="store", type=int,
+            dest="rows", default=1000000, help='Number of rows of every snapshot, default 1000000')
+        self.parser.add_argument("--workers", action="store",
+            dest="workers", default='', help='Comma-separated numbers of workers, default 1, 2, 4, ... up to number of cores')
+        self.parser.add_argument("--seed", action="store", type=int,
+            dest="seed", default=42, help='Seed of random generator, default 42')
+
+def write_snapshots(directory, ndates, nrows, seed):
+    "Writes df.csv like files of consecutive dates"
+    rnd = np.random.RandomState(seed)
+    day = datetime.date(2017, 2, 28)
+    for idx in range(ndates):
+        date = (day - datetime.timedelta(days=idx)).strftime('%Y%m%d')
+        df = pd.DataFrame({'date': date,
+                           'site': np.array(SITES, dtype=object)[rnd.randint(0, len(SITES), nrows)],
+                           'dataset': '/Primary/Campaign-v1/AODSIM',
+                           'size': rnd.randint(0, 10**12, nrows)})
+        df.to_csv(os.path.join(directory, 'df_%s.csv' % date), index=False)
+
+def worker_counts(workers):
+    if workers:
+        return [int(x) for x in workers.split(',')]
+    counts = [1]
+    while counts[-1] * 2 <= cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpu_count():
+        counts.append(cpu_count())
+    return counts
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+
+    # Snapshots of csv files would make every run after the first one faster
+    os.environ['CSV_CACHE_DISABLE'] = '1'
+
+    directory = tempfile.mkdtemp()
+    try:
+        write_snapshots(directory, opts.dates, opts.rows, opts.seed)
+        files = snapshot_files(directory)
+        total_rows = opts.dates * opts.rows
+
+        print('| Workers | Time (s) | Rows per second | Speedup |')
+        print('| ------- | ------ | ------ | ------ |')
+        expected = None
+        mismatches = []
+        base_time = None
+        for workers in worker_counts(opts.workers):
+            time0 = time.time()
+            sizes, counts = site_history(files, workers)
+            elapsed = time.time() - time0
+            if expected is None:
+                expected = (sizes, counts)
+                base_time = elapsed
+            elif not (sizes.equals(expected[0]) and counts.equals(expected[1])):
+                mismatches.append(workers)
+            print('| %s | %.2f | %.0f | %.1fx |' % (workers, elapsed, total_rows / elapsed, base_time / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+    if mismatches:
+        raise Exception('Results differ from one worker for workers: %s' % ', '.join(str(x) for x in mismatches))
+    print('All numbers of workers produce the same site history for %s snapshots of %s rows' % (opts.dates, opts.rows))
+
+if __name__ == '__main__':
+    main()
@@ -7,13 +7,20 @@ import json
 import argparse
 from types import NoneType
 
-from pyspark import SparkContext, StorageLevel
-from pyspark.sql import HiveContext
+from pyspark import SparkContext
+from pyspark.sql.functions import count, sum
 
 # CMSSpark modules
-from CMSSpark.spark_utils import dbs_tables, phedex_tables, print_rows
-from CMSSpark.spark_utils import spark_context, split_dataset
+from CMSSpark.spark_utils import print_rows
+from CMSSpark.spark_utils import split_dataset
+from CMSSpark.job_context import job_context, job_sql_context, stop_context
 from CMSSpark.utils import elapsed_time
+from CMSSpark.table_cache import dbs_table_columns
+from CMSSpark.spark_metrics import SparkMetrics
+
+METRICS_FILE = 'dbs_metrics.json'
+METRICS_HISTORY_FILE = 'dbs_metrics_history.json'
+MODES = ['blocks', 'files']
 
 class OptionParser():
     def __init__(self):
@@ -43,6 +50,11 @@ class OptionParser():
         msg = 'DBS instance on HDFS: global (default), phys01, phys02, phys03'
         self.parser.add_argument("--inst", action="store",
             dest="inst", default="global", help=msg)
+        self.parser.add_argument("--cache", action="store",
+            dest="cache", default="", help='Location of Parquet cache of DBS and PhEDEx tables, see table_cache.py')
+        msg = 'Summary mode: blocks (default) sums per-block totals, files joins every file row with its block'
+        self.parser.add_argument("--mode", action="store", choices=MODES,
+            dest="mode", default="blocks", help=msg)
         self.parser.add_argument("--no-log4j", action="store_true",
             dest="no-log4j", default=False, help="Disable spark log4j messages")
         self.parser.add_argument("--yarn", action="store_true",
@@ -50,22 +62,37 @@ class OptionParser():
         self.parser.add_argument("--verbose", action="store_true",
             dest="verbose", default=False, help="verbose output")
 
-def run(fout, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='GLOBAL'):
+def block_summary(ddf_df, fdf_df):
     """
-    Main function to run pyspark job. It requires a schema file, an HDFS directory
-    with data and optional script with mapper/reducer functions.
+    Returns dataset, nfiles, nevents, size dataframe computed from block
+    totals. Block table has no event counts, so file table is aggregated by
+    f_block_id once. Partial aggregation keeps only one row per block in the
+    shuffle and every file is counted exactly once. File rows have the id of
+    their dataset, so block table is not joined.
     """
-    # define spark context, it's main object which allow to communicate with spark
-    ctx = spark_context('cms', yarn, verbose)
-    sqlContext = HiveContext(ctx)
+    # block_id, dataset_id, nfiles, nevents, size
+    blocks_df = fdf_df.groupBy('f_block_id', 'f_dataset_id')\
+                      .agg(count('f_file_id').alias('nfiles'),
+                           sum('f_event_count').alias('nevents'),
+                           sum('f_file_size').alias('size'))
 
-    # read DBS and Phedex tables
-    tables = {}
-    tables.update(dbs_tables(sqlContext, inst=inst, verbose=verbose))
-    ddf = tables['ddf']
-    bdf = tables['bdf']
-    fdf = tables['fdf']
+    # dataset_id, nfiles, nevents, size
+    datasets_df = blocks_df.groupBy('f_dataset_id')\
+                           .agg(sum('nfiles').alias('nfiles'),
+                                sum('nevents').alias('nevents'),
+                                sum('size').alias('size'))
 
+    # dataset, nfiles, nevents, size
+    return datasets_df.join(ddf_df, datasets_df.f_dataset_id == ddf_df.d_dataset_id)\
+                      .select(ddf_df.d_dataset.alias('dataset'), 'nfiles', 'nevents', 'size')
+
+def file_summary(sqlContext):
+    """
+    Returns dataset, nfiles, nevents, size dataframe computed from join of
+    every file row with its block and dataset. Block file counts are summed
+    over file rows, so nfiles is multiplied by number of files in a block.
+    Kept to compare results with block_summary.
+    """
     # join tables
     cols = ['d_dataset','d_dataset_id', 'b_block_id','b_file_count','f_block_id','f_file_id','f_dataset_id','f_event_count','f_file_size']
 
@@ -74,11 +101,8 @@ def run(fout, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='G
     print(stmt)
     joins = sqlContext.sql(stmt)
 
-    # keep table around
-    joins.persist(StorageLevel.MEMORY_AND_DISK)
-
     # construct aggregation
-    fjoin = joins\
+    return joins\
             .groupBy(['d_dataset'])\
             .agg({'b_file_count':'sum', 'f_event_count':'sum', 'f_file_size':'sum'})\
             .withColumnRenamed('d_dataset', 'dataset')\
@@ -86,16 +110,39 @@ def run(fout, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='G
             .withColumnRenamed('sum(f_event_count)', 'nevents')\
             .withColumnRenamed('sum(f_file_size)', 'size')
 
-    # keep table around
-    fjoin.persist(StorageLevel.MEMORY_AND_DISK)
+def run(fout, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='GLOBAL', cache=None, mode='blocks'):
+    """
+    Main function to run pyspark job. It requires a schema file, an HDFS directory
+    with data and optional script with mapper/reducer functions.
+    """
+    # define spark context, it's main object which allow to communicate with spark
+    ctx = job_context('cms', yarn, verbose)
+    sqlContext = job_sql_context(ctx)
+    metrics = SparkMetrics(ctx, 'dbs')
+
+    # read DBS tables, block table is needed only to join files with datasets
+    columns = {'ddf': ['d_dataset', 'd_dataset_id'],
+               'fdf': ['f_block_id', 'f_file_id', 'f_dataset_id', 'f_event_count', 'f_file_size']}
+    if mode == 'files':
+        columns['bdf'] = ['b_block_id', 'b_dataset_id', 'b_file_count']
+    tables = dbs_table_columns(sqlContext, inst, columns, cache=cache, verbose=verbose)
+    for name, table in tables.items():
+        table.registerTempTable(name)
+
+    if mode == 'blocks':
+        fjoin = block_summary(tables['ddf'], tables['fdf'])
+    else:
+        fjoin = file_summary(sqlContext)
 
     # write out results back to HDFS, the fout parameter defines area on HDFS
     # it is either absolute path or area under /user/USERNAME
     if  fout:
-        fjoin.write.format("com.databricks.spark.csv")\
-                .option("header", "true").save(fout)
+        with metrics.action('write dbs_datasets'):
+            fjoin.write.format("com.databricks.spark.csv")\
+                    .option("header", "true").save(fout)
 
-    ctx.stop()
+    metrics.write(METRICS_FILE, METRICS_HISTORY_FILE)
+    stop_context(ctx)
 
 def main():
     "Main function"
@@ -113,7 +160,9 @@ def main():
         raise Exception('Unsupported DBS instance "%s"' % inst)
     patterns = opts.patterns.split(',') if opts.patterns else []
     antipatterns = opts.antipatterns.split(',') if opts.antipatterns else []
-    run(fout, yarn, verbose, patterns, antipatterns, inst)
+    cache = opts.cache
+    mode = opts.mode
+    run(fout, yarn, verbose, patterns, antipatterns, inst, cache, mode)
     print('Start time  : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time0)))
     print('End time    : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time.time())))
     print('Elapsed time: %s sec' % elapsed_time(time0))
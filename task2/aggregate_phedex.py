@@ -5,19 +5,23 @@ import sys
 import time
 import json
 import argparse
-from types import NoneType
+import datetime
 
 # pyspark modules
 from pyspark import SparkContext, StorageLevel
-from pyspark.sql import HiveContext
-from pyspark.sql.functions import lit, sum, count, col, split
-from pyspark.sql.functions import udf
-from pyspark.sql.types import StringType, IntegerType
+from pyspark.sql.functions import lit, col
 
 # CMSSpark modules
-from CMSSpark.spark_utils import phedex_tables, print_rows
-from CMSSpark.spark_utils import spark_context, split_dataset
+from CMSSpark.spark_utils import print_rows
+from CMSSpark.spark_utils import split_dataset
+from CMSSpark.job_context import job_context, job_sql_context, stop_context
 from CMSSpark.utils import elapsed_time, split_date
+from CMSSpark.table_cache import phedex_table
+from CMSSpark.cms_columns import is_disk_site, unix_to_date
+from CMSSpark.spark_metrics import SparkMetrics
+
+METRICS_FILE = 'phedex_metrics.json'
+METRICS_HISTORY_FILE = 'phedex_metrics_history.json'
 
 class OptionParser():
     def __init__(self):
@@ -33,7 +37,13 @@ class OptionParser():
         self.parser.add_argument("--fout", action="store",
             dest="fout", default=fout, help='Output file name, default %s' % fout)
         self.parser.add_argument("--date", action="store",
-            dest="date", default="", help='Select CMSSW data for specific date (YYYYMMDD)')
+            dest="date", default="", help='Select CMSSW data for specific date (YYYYMMDD), use comma-separated list if you want to handle multiple dates')
+        self.parser.add_argument("--fromdate", action="store",
+            dest="fromdate", default="", help='Select CMSSW data starting from given date (YYYYMMDD), requires --todate')
+        self.parser.add_argument("--todate", action="store",
+            dest="todate", default="", help='Select CMSSW data up to given date including it (YYYYMMDD), requires --fromdate')
+        self.parser.add_argument("--cache", action="store",
+            dest="cache", default="", help='Location of Parquet cache of DBS and PhEDEx tables, see table_cache.py')
         self.parser.add_argument("--no-log4j", action="store_true",
             dest="no-log4j", default=False, help="Disable spark log4j messages")
         self.parser.add_argument("--yarn", action="store_true",
@@ -41,49 +51,37 @@ class OptionParser():
         self.parser.add_argument("--verbose", action="store_true",
             dest="verbose", default=False, help="verbose output")
 
-def dateStamp(date):
-    "Convert YYYYMMDD into sec since epoch"
-    sec = time.mktime(time.strptime(date, '%Y%m%d'))
-    return sec
-
-def unix2human(tstamp):
-    "Convert unix time stamp into human readable format"
-    return time.strftime('%Y%m%d', time.gmtime(tstamp))
-
-def site_filter(site):
-    "Filter site names without _MSS or _Buffer or _Export"
-    if site.endswith('_MSS') or site.endswith('_Buffer') or site.endswith('_Export'):
-        return 0
-    return 1
+def date_range(fromdate, todate):
+    "Return list of all dates (YYYYMMDD) from fromdate to todate including both"
+    start = datetime.datetime.strptime(fromdate, '%Y%m%d')
+    end = datetime.datetime.strptime(todate, '%Y%m%d')
+    if  start > end:
+        raise Exception('Date "%s" is after date "%s"' % (fromdate, todate))
+    return [(start + datetime.timedelta(days=x)).strftime('%Y%m%d') for x in range((end - start).days + 1)]
 
-def run(date, fout, yarn=None, verbose=None):
+def run(dates, fout, yarn=None, verbose=None, cache=None):
     """
     Main function to run pyspark job. It requires a schema file, an HDFS directory
     with data and optional script with mapper/reducer functions.
+    Snapshots of all given dates (list of YYYYMMDD) are processed in one job.
     """
     # define spark context, it's main object which allow to communicate with spark
-    ctx = spark_context('cms', yarn, verbose)
-    sqlContext = HiveContext(ctx)
+    ctx = job_context('cms', yarn, verbose)
+    sqlContext = job_sql_context(ctx)
+    metrics = SparkMetrics(ctx, 'phedex')
 
-    fromdate = '%s-%s-%s' % (date[:4], date[4:6], date[6:])
-    todate = fromdate
-    # read Phedex tables
-    tables = {}
-    tables.update(phedex_tables(sqlContext, verbose=verbose, fromdate=fromdate, todate=todate))
-    phedex_df = tables['phedex_df']
-
-    # register user defined function
-    unix2date = udf(unix2human, StringType())
-    siteFilter = udf(site_filter, IntegerType())
-    one_day = 60*60*24
+    # read Phedex tables, snapshot date is kept in date column
+    cols = ['node_name', 'dataset_name', 'block_bytes', 'replica_time_create', 'br_user_group_id']
+    snapshots = [phedex_table(sqlContext, date, cols, cache=cache, verbose=verbose).withColumn('date', lit(date))
+                 for date in dates]
+    phedex_df = reduce(lambda a,b: a.unionAll(b), snapshots)
 
     # aggregate phedex info into dataframe
-    cols = ['node_name', 'dataset_name', 'block_bytes', 'replica_time_create', 'br_user_group_id']
-    pdf = phedex_df.select(cols).where(siteFilter(col('node_name')) == 1)\
-            .groupBy(['node_name', 'dataset_name', 'replica_time_create', 'br_user_group_id'])\
+    # sites without _MSS or _Buffer or _Export only
+    pdf = phedex_df.where(is_disk_site(col('node_name')))\
+            .groupBy(['date', 'node_name', 'dataset_name', 'replica_time_create', 'br_user_group_id'])\
             .agg({'block_bytes':'sum'})\
-            .withColumn('date', lit(date))\
-            .withColumn('replica_date', unix2date(col('replica_time_create')))\
+            .withColumn('replica_date', unix_to_date('replica_time_create'))\
             .withColumnRenamed('sum(block_bytes)', 'size')\
             .withColumnRenamed('dataset_name', 'dataset')\
             .withColumnRenamed('node_name', 'site')\
@@ -93,18 +91,23 @@ def run(date, fout, yarn=None, verbose=None):
 
     # write out results back to HDFS, the fout parameter defines area on HDFS
     # it is either absolute path or area under /user/USERNAME
+    # each date is written to its own fout/YYYY/MM/DD directory from persisted pdf
     if  fout:
-        year, month, day = split_date(date)
-        out = '%s/%s/%s/%s' % (fout, year, month, day)
         cols = ['date','site','dataset','size','replica_date', 'groupid']
-        # don't write header since when we'll read back the data it will
-        # mismatch the data types, i.e. headers are string and rows
-        # may be different data types
-        pdf.select(cols)\
-            .write.format("com.databricks.spark.csv")\
-            .option("header", "true").save(out)
+        for date in dates:
+            year, month, day = split_date(date)
+            out = '%s/%s/%s/%s' % (fout, year, month, day)
+            # don't write header since when we'll read back the data it will
+            # mismatch the data types, i.e. headers are string and rows
+            # may be different data types
+            with metrics.action('write %s' % date):
+                pdf.where(col('date') == date)\
+                    .select(cols)\
+                    .write.format("com.databricks.spark.csv")\
+                    .option("header", "true").save(out)
 
-    ctx.stop()
+    metrics.write(METRICS_FILE, METRICS_HISTORY_FILE)
+    stop_context(ctx)
 
 def main():
     "Main function"
@@ -113,10 +116,23 @@ def main():
     print("Input arguments: %s" % opts)
     time0 = time.time()
     fout = opts.fout
-    date = opts.date
+    if  opts.fromdate or opts.todate:
+        if  not opts.fromdate or not opts.todate:
+            raise Exception('Both --fromdate and --todate should be given')
+        dates = [opts.fromdate, opts.todate]
+    elif opts.date:
+        dates = opts.date.split(',')
+    else:
+        raise Exception('Date is not given, use --date or --fromdate and --todate')
+    for date in dates:
+        if  len(date) != 8 or not date.isdigit():
+            raise Exception('Invalid date "%s". Example: 20170228' % date)
+    if  opts.fromdate:
+        dates = date_range(opts.fromdate, opts.todate)
     verbose = opts.verbose
     yarn = opts.yarn
-    run(date, fout, yarn, verbose)
+    cache = opts.cache
+    run(dates, fout, yarn, verbose, cache)
     print('Start time  : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time0)))
     print('End time    : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time.time())))
     print('Elapsed time: %s sec' % elapsed_time(time0))
@@ -1,61 +1,48 @@
+import numpy as np
 import pandas as pd
 
 import matplotlib as mpl
 # We will not be showing images because we don't haw UI
 mpl.use('Agg')
 import matplotlib.pyplot as plt
-from subprocess import check_output
+import time
 import os
-import shutil
-import operator
 import argparse
+import sys
+
+sys.path.append('../common')
+from metrics_report import spark_metrics_report
+from chunked_csv import CHUNK_ROWS, chunked_aggregate
+from plot_pool import PLOT_WORKERS, PlotPool, timings_table
+from report_builder import ReportBuilder, bytes_to_readable, head_rows, int_strings, rounded_strings, strings
+from wiki_sync import sync_directory
+from datastream_sizes import CONFIG_FILE as DATASTREAMS_FILE, datastream_sizes
+from datastream_sizes import read_config as read_datastreams
+from hdfs_client import default_client
 
 PHEDEX_PLOTS_PATH = 'phedex_plots/'
 DBS_PLOTS_PATH = 'dbs_plots/'
 PHEDEX_TIME_DATA_FILE = 'phedex_time_data.txt'
 DBS_TIME_DATA_FILE = 'dbs_time_data.txt'
+PHEDEX_METRICS_FILE = 'phedex_metrics.json'
+PHEDEX_METRICS_HISTORY_FILE = 'phedex_metrics_history.json'
+DBS_METRICS_FILE = 'dbs_metrics.json'
+DBS_METRICS_HISTORY_FILE = 'dbs_metrics_history.json'
 
-report = ''
+# Columns of csv files used by analysis and their types
+PHEDEX_COLUMNS = {'dataset': 'object', 'site': 'category', 'size': 'int64'}
+DBS_COLUMNS = {'dataset': 'object', 'size': 'int64'}
+
+report = ReportBuilder()
 
 def append_report(lines):
-    global report
-    report = report + lines
-    report = report + '\n'
+    report.append(lines)
 
 def write_df_to_report(df, head=0):
-    append_report('| Tier | Count | Size (TB) |')
-    append_report('| ------- | ------ | ------ |')
-
-    if head != 0:
-        df = df[:head]
-
-    for index, row in df.iterrows():
-        append_report('| ' + index + ' | ' + str(int(row['tier_count'])) + ' | ' + str(round(row['sum_size'], 1)) + ' |')
+    df = head_rows(df, head)
+    report.table(['Tier', 'Count', 'Size (TB)'],
+                 [strings(df.index), int_strings(df['tier_count'].tolist()), rounded_strings(df['sum_size'].values, 1)])
 
-def copy_directory(src, dest):
-    dest_dir = os.path.dirname(dest)
-    if not os.path.exists(dest_dir):
-        os.mkdir(dest_dir)
-    
-    # Delete destination first
-    shutil.rmtree(dest)
-
-    try:
-        shutil.copytree(src, dest)
-    # Directories are the same
-    except shutil.Error as e:
-        print('Directory not copied. Error: %s' % e)
-    # Any error saying that the directory doesn't exist
-    except OSError as e:
-        print('Directory not copied. Error: %s' % e)
-
-
-def bytes_to_readable(num, suffix='B'):
-    for unit in ['','K','M','G','T','P','E','Z']:
-        if abs(num) < 1024.0:
-            return "%3.1f %s%s" % (num, unit, suffix)
-        num /= 1024.0
-    return "%.1f %s%s" % (num, 'Yi', suffix)
 
 def create_plot_dirs():
     if not os.path.exists(PHEDEX_PLOTS_PATH):
@@ -66,7 +53,7 @@ def create_plot_dirs():
 def read_report_template():
     global report
     with open('../aggregation_template.md') as f:
-        report = f.read()
+        report = ReportBuilder(f.read())
 
 def read_phedex_time_data():
     with open(PHEDEX_TIME_DATA_FILE) as f:
@@ -76,15 +63,18 @@ def read_dbs_time_data():
     with open(DBS_TIME_DATA_FILE) as f:
         return f.read()
 
+def append_metrics(metrics_file, history_file):
+    metrics = spark_metrics_report(metrics_file, history_file)
+    if metrics:
+        append_report(metrics)
+
 def write_report():
-    global report
-    with open('../CERNTasks.wiki/CMS_Reports.md', 'w') as f:
-        f.write(report)
+    report.write('../CERNTasks.wiki/CMS_Reports.md')
 
 def commit_report():
     os.system('(cd ../CERNTasks.wiki/; git add -A; git commit -m "Auto-commiting report"; git push origin master)')
 
-def make_plot(result, file_path):
+def make_plot(result, plot_filename):
     axes = result.plot(kind='bar', subplots=True, layout=(2,1), figsize=(8, 6), fontsize=6)
 
     axes[0][0].set_title('')
@@ -94,101 +84,118 @@ def make_plot(result, file_path):
 
     plt.xticks(rotation=45, horizontalalignment='right')
     plt.tight_layout()
-    plot_filename = file_path + '_plot.jpg'
     plt.savefig(plot_filename, dpi=120)
 
-    return plot_filename
+def categorical(values, parse):
+    "Categorical column of parsed values, every distinct value is parsed only once"
+    codes, uniques = pd.factorize(values)
+    parsed = pd.Series(uniques, dtype=object).map(parse)
+    parsed = pd.Categorical(parsed, categories=sorted(parsed.dropna().unique()))
+    # Missing values have code -1 and stay missing
+    return pd.Categorical.from_codes(np.append(parsed.codes, -1)[codes], parsed.categories)
 
-def analyse_phedex_data():
-    df = pd.read_csv('phedex_df.csv')
-    # sites = df.groupby(df.site.str[:2])['site'].agg(lambda x: set(x)).index.tolist()
-    sites = ['T1', 'T2', 'T3']
+def site_tier(site):
+    return site[:2]
 
-    append_report('## PhEDEx data')
+def data_tier(dataset):
+    parts = dataset.split('/')
+    return parts[3] if len(parts) > 3 else None
+
+def parse_tiers(df):
+    "Adds categorical data_tier column and site_tier column if there are sites"
+    df['data_tier'] = categorical(df.dataset, data_tier)
+    if 'site' in df:
+        df['site_tier'] = categorical(df.site, site_tier)
+    return df
+
+def tier_counts(df, keys, count_column):
+    "Number of rows and sum of sizes grouped by keys"
+    result = df.groupby(keys, observed=True).agg({'size': 'sum', count_column: 'count'})
+    return result.rename(columns={'size': 'sum_size', count_column: 'tier_count'})
+
+def phedex_counts(df):
+    return tier_counts(parse_tiers(df), ['site_tier', 'data_tier'], 'site')
 
+def dbs_counts(df):
+    return tier_counts(parse_tiers(df), ['data_tier'], 'dataset')
+
+def to_terabytes(result):
+    result['sum_size'] = result['sum_size'] / 1000000000000
+    return result
+
+def site_tier_tables(result, sites):
+    "Data-tier tables of given site tiers from counts grouped by site tier and data tier"
+    result = to_terabytes(result)
+    site_tiers = result.index.get_level_values('site_tier')
+    tables = {}
     for site in sites:
-        result = df[df.site.str[:2] == site] \
-            .groupby(df.dataset.str.split('/').str[3]) \
-            .agg({'size': 'sum', 'site': 'count'})
+        table = result[site_tiers == site].reset_index(level='site_tier', drop=True)
+        table.sort_values('tier_count', ascending=False, inplace=True)
+        tables[site] = table
+    return tables
 
-        result = result.rename(columns={'size': 'sum_size', 'site': 'tier_count'})
+def analyse_phedex_data(plots, chunk_rows=CHUNK_ROWS):
+    counts = chunked_aggregate('phedex_df.csv', PHEDEX_COLUMNS, phedex_counts, ['site_tier', 'data_tier'], chunk_rows)
+    # sites = df.groupby(df.site.str[:2])['site'].agg(lambda x: set(x)).index.tolist()
+    sites = ['T1', 'T2', 'T3']
+    tables = site_tier_tables(counts, sites)
 
-        result.sort_values('tier_count', ascending=False, inplace=True)
+    append_report('## PhEDEx data')
 
-        # Bytes to terabytes
-        result['sum_size'] = result['sum_size'] / 1000000000000
+    for site in sites:
+        result = tables[site]
 
         append_report('### Site {0}. Showing TOP 5 most significant data-tiers'.format(site))
         write_df_to_report(result, 5)
 
-        plot_filename = make_plot(result, PHEDEX_PLOTS_PATH + site)
+        # Plot is rendered by a worker process while next tables are built
+        plot_filename = plots.submit(make_plot, result, PHEDEX_PLOTS_PATH + site + '_plot.jpg')
 
         append_report('### Plot')
         append_report('[[images/' + plot_filename + ']]')
     
     time = read_phedex_time_data()
     append_report('#### Spark job run time: {0}'.format(time))
+    append_metrics(PHEDEX_METRICS_FILE, PHEDEX_METRICS_HISTORY_FILE)
 
-    # Move plot files to wiki repo
-    copy_directory(PHEDEX_PLOTS_PATH, '../CERNTasks.wiki/images/' + PHEDEX_PLOTS_PATH)
-
-def analyse_dbs_data():
-    df = pd.read_csv('dbs_df.csv')
-    result = df.groupby(df.dataset.str.split('/').str[3]).agg({'size': 'sum', 'dataset': 'count'})
-
-    result = result.rename(columns={'size': 'sum_size', 'dataset': 'tier_count'})
-
+def analyse_dbs_data(plots, chunk_rows=CHUNK_ROWS):
+    result = chunked_aggregate('dbs_df.csv', DBS_COLUMNS, dbs_counts, ['data_tier'], chunk_rows)
+    result = to_terabytes(result)
     result.sort_values('tier_count', ascending=False, inplace=True)
 
-    # Bytes to terabytes
-    result['sum_size'] = result['sum_size'] / 1000000000000
-
     append_report('## DBS data. Showing TOP 5 most significant data-tiers')
     write_df_to_report(result, 5)
 
-    plot_filename = make_plot(result, DBS_PLOTS_PATH + 'dbs')
+    plot_filename = plots.submit(make_plot, result, DBS_PLOTS_PATH + 'dbs_plot.jpg')
 
     append_report('### Plot')
     append_report('[[images/' + plot_filename + ']]')
 
     time = read_dbs_time_data()
     append_report('#### Spark job run time: {0}'.format(time))
+    append_metrics(DBS_METRICS_FILE, DBS_METRICS_HISTORY_FILE)
 
-    # Move plot file to wiki repo
-    copy_directory(DBS_PLOTS_PATH, '../CERNTasks.wiki/images/' + DBS_PLOTS_PATH)
-
-def aggregate_all_datastreams_info():
+def aggregate_all_datastreams_info(config_file=DATASTREAMS_FILE, refresh=False):
     append_report('## Sizes of all datastreams')
     append_report('| Stream | Size |')
     append_report('| ------- | ------ |')
 
-    locations = { 
-        'AAA (JSON) user logs accessing XrootD servers': 'hdfs:///project/monitoring/archive/xrootd/raw/gled',
-        'EOS (JSON) user logs accesses CERN EOS': 'hdfs:///project/monitoring/archive/eos/logs/reports/cms',
-        'HTCondor (JSON) CMS Jobs logs': 'hdfs:///project/monitoring/archive/condor/raw/metric',
-        'FTS (JSON) CMS FTS logs': 'hdfs:///project/monitoring/archive/fts/raw/complete',
-        'CMSSW (Avro) CMSSW jobs': 'hdfs:///project/awg/cms/cmssw-popularity/avro-snappy',
-        'JobMonitoring (Avro) CMS Dashboard DB snapshot': 'hdfs:///project/awg/cms/jm-data-popularity/avro-snappy',
-        'WMArchive (Avro) CMS Workflows archive': 'hdfs:///cms/wmarchive/avro',
-        'ASO (CSV) CMS ASO accesses': 'hdfs:///project/awg/cms/CMS_ASO/filetransfersdb/merged',
-        'DBS (CSV) CMS Data Bookkeeping snapshot': 'hdfs:///project/awg/cms/CMS_DBS3_PROD_GLOBAL/current',
-        'PhEDEx (CSV) CMS data location DB snapshot': 'hdfs:///project/awg/cms/phedex/block-replicas-snapshots'
-    }
-
-    results = {}
-
-    for name, location in locations.iteritems():
-        out = check_output(['hadoop', 'fs', '-du', '-s', location])
-        size = float(out.split(' ')[0])
-        results[name] = size
-   
-    total_sum = sum(results.values())
+    results = datastream_sizes(read_datastreams(config_file), refresh=refresh)
+
+    total_sum = sum(x['size'] for x in results if x['size'] is not None)
 
     # Sort by value
-    results = sorted(results.items(), key=operator.itemgetter(1), reverse=True)
+    results = sorted(results, key=lambda x: x['size'] or 0, reverse=True)
 
     for result in results:
-        append_report('| ' + result[0] + ' | ' + bytes_to_readable(result[1]) + ' |')
+        if result['size'] is None:
+            size = 'unknown'
+        else:
+            size = bytes_to_readable(result['size'])
+        if result['stale']:
+            measured = time.strftime('%Y-%m-%d %H:%M', time.localtime(result['time'])) if result['time'] else 'never'
+            size += ' (stale, measured ' + measured + ')'
+        append_report('| ' + result['name'] + ' | ' + size + ' |')
 
     append_report('| **Total** | **' + bytes_to_readable(total_sum) + '** |')
 
@@ -198,14 +205,41 @@ def main():
                         dest="commit", 
                         default=False, 
                         help="Determines whether report should be committed to Github wiki")
+    parser.add_argument("--chunk-rows", action="store", type=int,
+                        dest="chunk_rows",
+                        default=CHUNK_ROWS,
+                        help="Number of csv rows aggregated at once, default %s" % CHUNK_ROWS)
+    parser.add_argument("--plot-workers", action="store", type=int,
+                        dest="plot_workers",
+                        default=PLOT_WORKERS,
+                        help="Number of processes rendering plots, 0 renders them in this process, default %s" % PLOT_WORKERS)
+    parser.add_argument("--datastreams", action="store",
+                        dest="datastreams",
+                        default=DATASTREAMS_FILE,
+                        help="Config with datastream locations, default %s" % DATASTREAMS_FILE)
+    parser.add_argument("--refresh-datastreams", action="store_true",
+                        dest="refresh_datastreams",
+                        default=False,
+                        help="Measure sizes of all datastreams even if cached sizes are not expired")
     opts = parser.parse_args()
 
     create_plot_dirs()
     read_report_template()
   
-    analyse_phedex_data()
-    analyse_dbs_data()
-    aggregate_all_datastreams_info()
+    plots = PlotPool(opts.plot_workers)
+    try:
+        analyse_phedex_data(plots, opts.chunk_rows)
+        analyse_dbs_data(plots, opts.chunk_rows)
+        aggregate_all_datastreams_info(opts.datastreams, opts.refresh_datastreams)
+        plot_files = plots.wait()
+    finally:
+        plots.close()
+    print(timings_table(plots.timings))
+    print(default_client().stats_table())
+
+    # Copy changed plot files to wiki repo, plots which were not produced by this run are removed
+    sync_directory(PHEDEX_PLOTS_PATH, '../CERNTasks.wiki/images/' + PHEDEX_PLOTS_PATH, plot_files)
+    sync_directory(DBS_PLOTS_PATH, '../CERNTasks.wiki/images/' + DBS_PLOTS_PATH, plot_files)
 
     write_report()
 
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+Memory benchmark of chunked aggregation of phedex_df.csv used by analyse.py
+against reading the whole file with inferred dtypes. Both run in their own
+processes on the same generated csv file, their peak resident memory and
+run time are compared. Script fails if their tables differ.
+
+Usage: python benchmark_chunks.py --rows=5000000 --chunk-rows=1000000
+"""
+
+# system modules
+import os
+import sys
+import time
+import pickle
+import resource
+import argparse
+import tempfile
+import subprocess
+
+import pandas as pd
+
+# local modules
+from analyse import PHEDEX_COLUMNS, phedex_counts, site_tier_tables
+from benchmark_tiers import SITE_TIERS, generate_frame, same_tables
+
+sys.path.append('../common')
+from chunked_csv import CHUNK_ROWS, chunked_aggregate
+
+METHODS = ['full', 'chunked']
+WRITE_ROWS = 1000000
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Memory benchmark of chunked csv aggregation against reading the whole csv file"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("--rows", action="store", type=int,
+            dest="rows", default=5000000, help='Number of generated rows, default 5000000')
+        self.parser.add_argument("--datasets", action="store", type=int,
+            dest="datasets", default=200000, help='Number of distinct datasets, default 200000')
+        self.parser.add_argument("--chunk-rows", action="store", type=int,
+            dest="chunk_rows", default=CHUNK_ROWS, help='Number of rows of one chunk, default %s' % CHUNK_ROWS)
+        self.parser.add_argument("--seed", action="store", type=int,
+            dest="seed", default=42, help='Seed of random generator, default 42')
+        self.parser.add_argument("--csv", action="store",
+            dest="csv", default='', help='Use existing phedex_df.csv like file instead of generated one')
+        self.parser.add_argument("--method", action="store", choices=METHODS,
+            dest="method", default='', help='Run only one method and write its tables to --fout, used internally')
+        self.parser.add_argument("--fout", action="store",
+            dest="fout", default='', help='Output file of --method')
+
+def write_csv(fname, nrows, ndatasets, seed):
+    "Writes generated phedex_df.csv like file in parts, so generator memory stays small"
+    for start in range(0, nrows, WRITE_ROWS):
+        df = generate_frame(min(WRITE_ROWS, nrows - start), ndatasets, seed + start)
+        df['date'] = '20170228'
+        df['replica_date'] = '20170101'
+        df['groupid'] = 1
+        df = df[['date', 'site', 'dataset', 'size', 'replica_date', 'groupid']]
+        df.to_csv(fname, mode='a' if start else 'w', header=not start, index=False)
+
+def run_method(method, fname, chunk_rows):
+    "Tables of given method"
+    if method == 'full':
+        counts = phedex_counts(pd.read_csv(fname))
+    else:
+        counts = chunked_aggregate(fname, PHEDEX_COLUMNS, phedex_counts, ['site_tier', 'data_tier'], chunk_rows)
+    return site_tier_tables(counts, SITE_TIERS)
+
+def max_rss():
+    "Peak resident memory of this process in megabytes"
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss / 1024. / (1024 if sys.platform == 'darwin' else 1)
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+
+    # Snapshots of csv files would make the method that runs second faster
+    os.environ['CSV_CACHE_DISABLE'] = '1'
+
+    if opts.method:
+        time0 = time.time()
+        tables = run_method(opts.method, opts.csv, opts.chunk_rows)
+        with open(opts.fout, 'wb') as ostream:
+            pickle.dump({'tables': tables, 'time': time.time() - time0, 'memory': max_rss()}, ostream)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    fname = opts.csv or os.path.join(tmpdir, 'phedex_df.csv')
+    if not opts.csv:
+        write_csv(fname, opts.rows, opts.datasets, opts.seed)
+    results = {}
+    try:
+        for method in METHODS:
+            fout = os.path.join(tmpdir, '%s.pickle' % method)
+            subprocess.check_call([sys.executable, __file__, '--method=%s' % method, '--csv=%s' % fname,
+                                   '--chunk-rows=%s' % opts.chunk_rows, '--fout=%s' % fout])
+            with open(fout, 'rb') as istream:
+                results[method] = pickle.load(istream)
+            os.remove(fout)
+    finally:
+        if not opts.csv:
+            os.remove(fname)
+        os.rmdir(tmpdir)
+
+    print('File: %.1f MB' % (os.path.getsize(opts.csv) / 1024. / 1024) if opts.csv else 'Rows: %s' % opts.rows)
+    print('| Method | Time (s) | Peak memory (MB) |')
+    print('| ------- | ------ | ------ |')
+    for method in METHODS:
+        print('| %s | %.2f | %.0f |' % (method, results[method]['time'], results[method]['memory']))
+
+    if not same_tables(results['full']['tables'], results['chunked']['tables']):
+        raise Exception('Chunked tables differ from tables of the whole file')
+    print('Chunked tables are the same as tables of the whole file')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmark of data-tier tables of analyse.py: one parse of categorical site
+and data tiers with one two-key groupby against the previous loop which
+filtered and split dataset names once per site tier. Tables of both are
+compared and script fails if they differ.
+
+Usage: python benchmark_tiers.py --rows=3000000
+"""
+
+# system modules
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# local modules
+from analyse import phedex_counts, site_tier_tables
+
+SITE_TIERS = ['T1', 'T2', 'T3']
+SITES = ['T0_CH_CERN_MSS', 'T1_US_FNAL_Buffer', 'T1_US_FNAL_MSS', 'T1_DE_KIT_Disk', 'T1_IT_CNAF_Export',
+         'T2_CH_CERN', 'T2_US_Nebraska', 'T2_DE_DESY', 'T3_US_FNALLPC', 'T3_IT_Trieste']
+TIERS = ['AOD', 'AODSIM', 'MINIAOD', 'MINIAODSIM', 'RAW', 'RECO', 'GEN-SIM', 'USER']
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Benchmark of vectorized data-tier tables against per site tier loop"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("--rows", action="store", type=int,
+            dest="rows", default=3000000, help='Number of generated rows, default 3000000')
+        self.parser.add_argument("--datasets", action="store", type=int,
+            dest="datasets", default=200000, help='Number of distinct datasets, default 200000')
+        self.parser.add_argument("--seed", action="store", type=int,
+            dest="seed", default=42, help='Seed of random generator, default 42')
+
+def generate_frame(nrows, ndatasets, seed):
+    "Generate phedex_df.csv like frame: dataset, site, size"
+    rnd = np.random.RandomState(seed)
+    datasets = np.array(['/Primary%s/Campaign%s-v%s/%s' % (idx, idx % 50, idx % 3 + 1, TIERS[idx % len(TIERS)])
+                         for idx in range(ndatasets)], dtype=object)
+    return pd.DataFrame({'dataset': datasets[rnd.randint(0, ndatasets, nrows)],
+                         'site': np.array(SITES, dtype=object)[rnd.randint(0, len(SITES), nrows)],
+                         'size': rnd.randint(0, 10**12, nrows)})
+
+def loop_tables(df):
+    "Tables of the previous implementation of analyse_phedex_data"
+    tables = {}
+    for site in SITE_TIERS:
+        result = df[df.site.str[:2] == site] \
+            .groupby(df.dataset.str.split('/').str[3]) \
+            .agg({'size': 'sum', 'site': 'count'})
+        result = result.rename(columns={'size': 'sum_size', 'site': 'tier_count'})
+        result.sort_values('tier_count', ascending=False, inplace=True)
+        result['sum_size'] = result['sum_size'] / 1000000000000
+        tables[site] = result
+    return tables
+
+def vectorized_tables(df):
+    "Tables of analyse_phedex_data"
+    return site_tier_tables(phedex_counts(df), SITE_TIERS)
+
+def same_tables(tables1, tables2):
+    "True if tables have the same data tiers in the same order and the same values"
+    for site in SITE_TIERS:
+        table1, table2 = tables1[site], tables2[site]
+        if list(table1.index) != list(table2.index) or list(table1.columns) != list(table2.columns):
+            return False
+        if not np.array_equal(table1.values, table2.values):
+            return False
+    return True
+
+def main():
+    "Main function"
+    optmgr = OptionParser()
+    opts = optmgr.parser.parse_args()
+
+    df = generate_frame(opts.rows, opts.datasets, opts.seed)
+
+    time0 = time.time()
+    loop = loop_tables(df.copy())
+    loop_time = time.time() - time0
+
+    time0 = time.time()
+    vectorized = vectorized_tables(df.copy())
+    vectorized_time = time.time() - time0
+
+    print('| Implementation | Time (s) | Speedup |')
+    print('| ------- | ------ | ------ |')
+    print('| Loop over site tiers | %.2f | 1.0x |' % loop_time)
+    print('| Categorical tiers, one groupby | %.2f | %.1fx |' % (vectorized_time, loop_time / max(vectorized_time, 1e-6)))
+
+    if not same_tables(loop, vectorized):
+        raise Exception('Vectorized tables differ from loop tables')
+    print('Vectorized tables are the same as loop tables for %s rows' % opts.rows)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Sizes of CMS datastreams in HDFS for the report of analyse.py.
+
+Datastream locations are read from a JSON config (datastreams.json). Sizes
+are measured with du of hdfs_client.py concurrently by a bounded pool of
+threads, each call has a timeout. Measured sizes are kept in a cache file,
+sizes measured within ttl_hours are reused without calling hadoop. If a
+location can not be measured, its last cached size is used and marked as
+stale, such locations are measured again by the next run.
+
+Usage: python datastream_sizes.py [--config=datastreams.json] [--refresh]
+"""
+
+# system modules
+import json
+import time
+import argparse
+import sys
+from multiprocessing.pool import ThreadPool
+
+sys.path.append('../common')
+from hdfs_client import default_client
+
+CONFIG_FILE = 'datastreams.json'
+CACHE_FILE = '.datastream_sizes.json'
+WORKERS = 4
+TIMEOUT = 120
+TTL_HOURS = 6
+
+def read_config(fname=CONFIG_FILE):
+    with open(fname) as istream:
+        config = json.load(istream)
+    config.setdefault('workers', WORKERS)
+    config.setdefault('timeout', TIMEOUT)
+    config.setdefault('ttl_hours', TTL_HOURS)
+    return config
+
+def read_cache(fname=CACHE_FILE):
+    try:
+        with open(fname) as istream:
+            return json.load(istream)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def write_cache(cache, fname=CACHE_FILE):
+    with open(fname, 'w') as ostream:
+        json.dump(cache, ostream, indent=2, sort_keys=True)
+
+def datastream_sizes(config, cache_file=CACHE_FILE, refresh=False):
+    """
+    Returns list of dictionaries with name, location, size, time of
+    measurement and stale flag of all datastreams of config. Size is None
+    if location could not be measured and it was never measured before.
+    """
+    client = default_client()
+    cache = read_cache(cache_file)
+    now = time.time()
+    ttl = config['ttl_hours'] * 3600
+
+    def fresh(location):
+        return not refresh and location in cache and now - cache[location]['time'] < ttl
+
+    def measure(location):
+        try:
+            return location, client.du(location, config['timeout']), None
+        except Exception as exc:
+            return location, None, str(exc)
+
+    locations = [x['location'] for x in config['streams'] if not fresh(x['location'])]
+    errors = {}
+    if locations:
+        pool = ThreadPool(max(1, min(config['workers'], len(locations))))
+        try:
+            for location, size, error in pool.map(measure, locations):
+                if error:
+                    errors[location] = error
+                    print('Size of %s is not measured: %s' % (location, error))
+                else:
+                    cache[location] = {'size': size, 'time': now}
+        finally:
+            pool.close()
+            pool.join()
+        write_cache(cache, cache_file)
+
+    results = []
+    for stream in config['streams']:
+        entry = cache.get(stream['location'], {})
+        results.append({'name': stream['name'],
+                        'location': stream['location'],
+                        'size': entry.get('size'),
+                        'time': entry.get('time'),
+                        'stale': stream['location'] in errors})
+    return results
+
+def main():
+    "Main function"
+    parser = argparse.ArgumentParser(prog='PROG', description='Sizes of CMS datastreams in HDFS')
+    parser.add_argument("--config", action="store",
+        dest="config", default=CONFIG_FILE, help='Config with datastream locations, default %s' % CONFIG_FILE)
+    parser.add_argument("--refresh", action="store_true",
+        dest="refresh", default=False, help='Measure all locations even if cached sizes are not expired')
+    opts = parser.parse_args()
+    for result in datastream_sizes(read_config(opts.config), refresh=opts.refresh):
+        print('%s %s%s' % (result['location'], result['size'], ' (stale)' if result['stale'] else ''))
+    print(default_client().stats_table())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Pipeline of task 2: PhEDEx and DBS aggregations run in parallel, their
+results are merged into phedex_df.csv and dbs_df.csv and analysed into the
+report. See ../common/pipeline.py for options.
+"""
+
+# system modules
+import os
+import sys
+import time
+
+# common directory goes first, otherwise this module would import itself as pipeline
+sys.path.insert(0, '../common')
+from pipeline import LOCAL_ROOT, pipeline_parser, run_pipeline
+
+DATE = '20170228'
+
+def pipeline_nodes(report=True):
+    "Nodes of task 2 pipeline"
+    copy = ' && '.join('cp %s ../CMSSpark/src/python/CMSSpark/%s' % (x, os.path.basename(x)) for x in
+                       ['aggregate_phedex.py', 'aggregate_dbs.py', '../common/cms_columns.py', '../common/table_cache.py',
+                        '../common/spark_metrics.py', '../common/job_context.py'])
+    nodes = [
+        {'name': 'copy', 'command': copy},
+        {'name': 'phedex', 'deps': ['copy'],
+         'skip': 'python ../common/result_cache.py get {phedex_cache}',
+         'command': 'python ../common/hdfs_client.py rm {phedex_hdir}; '
+                    '../common/run_job aggregate_phedex.py --fout={phedex_hdir} {yarn} --verbose --date={date} --cache={cache}'},
+        {'name': 'phedex_csv', 'deps': ['phedex'], 'skip_with': 'phedex',
+         'command': 'rm -f phedex_df.csv && '
+                    'python ../common/merge_parts.py --src={phedex_hdir}/{year}/{month}/{day} --fout=phedex_df.csv && '
+                    'python ../common/result_cache.py put {phedex_cache}'},
+        {'name': 'dbs', 'deps': ['copy'],
+         'skip': 'python ../common/result_cache.py get {dbs_cache}',
+         'command': 'python ../common/hdfs_client.py rm {dbs_hdir}; '
+                    '../common/run_job aggregate_dbs.py --fout={dbs_hdir} {yarn} --verbose --cache={cache}'},
+        {'name': 'dbs_csv', 'deps': ['dbs'], 'skip_with': 'dbs',
+         'command': 'rm -f dbs_df.csv && '
+                    'python ../common/merge_parts.py --src={dbs_hdir} --fout=dbs_df.csv && '
+                    'python ../common/result_cache.py put {dbs_cache}'},
+    ]
+    if report:
+        nodes.append({'name': 'report', 'deps': ['phedex_csv', 'dbs_csv'], 'command': 'python analyse.py'})
+    return nodes
+
+def pipeline_params(date, local=False):
+    "Parameters of task 2 pipeline commands"
+    user = os.environ.get('USER', 'user')
+    if local:
+        base = 'file://%s/cms/users/%s' % (os.environ.get('HDFS_LOCAL_ROOT', LOCAL_ROOT), user)
+    else:
+        base = 'hdfs:///cms/users/%s' % user
+    # DBS dumps are refreshed daily, so DBS results are cached for the current day
+    return {'date': date, 'year': date[:4], 'month': date[4:6], 'day': date[6:],
+            'yarn': '' if local else '--yarn',
+            'cache': os.environ.get('PARQUET_CACHE', ''),
+            'phedex_hdir': '%s/phedex_datasets' % base,
+            'dbs_hdir': '%s/dbs_datasets' % base,
+            'phedex_cache': '--job=phedex_datasets --date=%s --outputs=phedex_df.csv '
+                            '--sources=aggregate_phedex.py,../common/cms_columns.py,../common/table_cache.py' % date,
+            'dbs_cache': '--job=dbs_datasets --date=%s --inst=GLOBAL --options=mode=blocks --outputs=dbs_df.csv '
+                         '--sources=aggregate_dbs.py,../common/table_cache.py' % time.strftime('%Y%m%d')}
+
+def main():
+    "Main function"
+    parser = pipeline_parser('Task 2 pipeline: PhEDEx and DBS aggregation, csv files and report')
+    parser.add_argument("--date", action="store",
+        dest="date", default=DATE, help='PhEDEx snapshot date (YYYYMMDD), default %s' % DATE)
+    parser.add_argument("--no-report", action="store_true",
+        dest="no_report", default=False, help="Do not run analyse.py")
+    opts = parser.parse_args()
+    run_pipeline('task2', pipeline_nodes(not opts.no_report), pipeline_params(opts.date, opts.local), opts)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Spark script which produces all task3 outputs in a single application.
+DBS and PhEDEx tables are read once and shared by all aggregations.
+"""
+
+# system modules
+import os
+import json
+import time
+import argparse
+
+from pyspark import StorageLevel
+
+# CMSSpark modules
+from CMSSpark.job_context import job_context, job_sql_context, stop_context
+from CMSSpark.utils import elapsed_time
+from CMSSpark.campaign_tables import DBS_INSTANCES, dbs_dataset_sizes
+from CMSSpark.campaign_tables import phedex_dataset_sizes, phedex_site_sizes
+from CMSSpark.aggregate_campaigns import aggregate_campaigns
+from CMSSpark.aggregate_campaign_tier import aggregate_campaign_tier, campaign_tier_sizes, print_pruning_counters
+from CMSSpark.campaign_partials import write_partial
+from CMSSpark.spark_metrics import SparkMetrics
+from CMSSpark.top_n import TOP
+from CMSSpark.result_sink import FORMATS, MAX_ROWS, write_result
+from CMSSpark.aggregate_campaigns import CSV_FILES as CAMPAIGNS_CSV_FILES
+from CMSSpark.aggregate_campaign_tier import CSV_FILE as CAMPAIGN_TIER_CSV_FILE
+from CMSSpark.aggregate_campaign_tier import PRUNING_FILE
+from CMSSpark.aggregate_campaigns import METRICS_FILE as CAMPAIGNS_METRICS_FILE
+from CMSSpark.aggregate_campaigns import METRICS_HISTORY_FILE as CAMPAIGNS_METRICS_HISTORY_FILE
+from CMSSpark.aggregate_campaign_tier import METRICS_FILE as CAMPAIGN_TIER_METRICS_FILE
+from CMSSpark.aggregate_campaign_tier import METRICS_HISTORY_FILE as CAMPAIGN_TIER_METRICS_HISTORY_FILE
+
+CAMPAIGN_OUTPUTS = ['phedex', 'dbs', 'site_campaign_count']
+OUTPUTS = CAMPAIGN_OUTPUTS + ['campaign_tier']
+
+# CSV files of outputs read by visualize.py
+CSV_FILES = dict(CAMPAIGNS_CSV_FILES, campaign_tier=CAMPAIGN_TIER_CSV_FILE)
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Spark script to process DBS+PhEDEx metadata"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        hdir = 'hdfs:///project/awg/cms'
+        msg = 'Location of CMS folders on HDFS, default %s' % hdir
+        self.parser.add_argument("--hdir", action="store",
+            dest="hdir", default=hdir, help=msg)
+        fout = 'task3'
+        self.parser.add_argument("--fout", action="store",
+            dest="fout", default=fout, help='Output directory name, default %s' % fout)
+        msg = 'Comma-separated list of outputs to compute: %s (default all)' % ', '.join(OUTPUTS)
+        self.parser.add_argument("--outputs", action="store",
+            dest="outputs", default=','.join(OUTPUTS), help=msg)
+        msg = 'DBS instance used for campaign_tier output: global (default), phys01, phys02, phys03'
+        self.parser.add_argument("--inst", action="store",
+            dest="inst", default="global", help=msg)
+        self.parser.add_argument("--cache", action="store",
+            dest="cache", default="", help='Location of Parquet cache of DBS and PhEDEx tables, see table_cache.py')
+        self.parser.add_argument("--store", action="store",
+            dest="store", default="", help='Location of the store of per-date partial aggregates, see campaign_partials.py')
+        self.parser.add_argument("--top", action="store", type=int,
+            dest="top", default=TOP, help='Number of rows kept in ranked outputs, default %s' % TOP)
+        self.parser.add_argument("--prune", action="store_true",
+            dest="prune", default=False, help="Drop DBS files of datasets which are not in PhEDEx before joining DBS tables of campaign_tier output")
+        self.parser.add_argument("--local", action="store",
+            dest="local", default="", help='Local directory where results of at most --local-rows rows are written directly, see result_sink.py')
+        self.parser.add_argument("--local-rows", action="store", type=int,
+            dest="local_rows", default=MAX_ROWS, help='Maximal number of rows of results written to local directory, default %s' % MAX_ROWS)
+        self.parser.add_argument("--local-format", action="store", choices=FORMATS,
+            dest="local_format", default="csv", help='Format of local result files: csv (default) or parquet')
+        self.parser.add_argument("--no-log4j", action="store_true",
+            dest="no-log4j", default=False, help="Disable spark log4j messages")
+        self.parser.add_argument("--yarn", action="store_true",
+            dest="yarn", default=False, help="run job on analytics cluster via yarn resource manager")
+        self.parser.add_argument("--verbose", action="store_true",
+            dest="verbose", default=False, help="verbose output")
+
+        self.parser.add_argument("--date", action="store",
+            dest="date", default="", help='Select CMSSW data for specific date (YYYYMMDD)')
+
+def quiet_logs(sc):
+    """
+    Sets logger's level to ERROR so INFO logs would not show up.
+    """
+    logger = sc._jvm.org.apache.log4j
+    logger.LogManager.getRootLogger().setLevel(logger.Level.ERROR)
+
+def run(fout, date, outputs=OUTPUTS, yarn=None, verbose=None, inst='GLOBAL', cache=None, store=None, top=TOP,
+        local=None, local_rows=MAX_ROWS, local_format='csv', prune=False):
+    """
+    Main function to run pyspark job. Reads DBS and PhEDEx tables once, keeps
+    dataset level intermediate tables around and produces requested outputs.
+    With prune, DBS sizes of campaign_tier output are read only for datasets
+    present in PhEDEx.
+    """
+
+    # define spark context, it's main object which allow to communicate with spark
+    ctx = job_context('cms', yarn, verbose)
+
+    quiet_logs(ctx)
+
+    sqlContext = job_sql_context(ctx)
+    metrics = SparkMetrics(ctx, 'task3')
+
+    campaigns = [x for x in outputs if x in CAMPAIGN_OUTPUTS]
+    campaign_tier = 'campaign_tier' in outputs
+
+    # Campaign outputs are built from all DBS instances,
+    # campaign - tier output only from the given one
+    instances = DBS_INSTANCES if campaigns else [inst]
+
+    # inst, dataset, dbs_size
+    # pruned campaign - tier output reads its own DBS sizes below
+    if campaigns or not prune:
+        dbs_df = dbs_dataset_sizes(sqlContext, instances, verbose=verbose, cache=cache)
+        dbs_df.persist(StorageLevel.MEMORY_AND_DISK)
+
+    # dataset, site, size
+    site_sizes_df = phedex_site_sizes(sqlContext, date, verbose=verbose, cache=cache)
+    site_sizes_df.persist(StorageLevel.MEMORY_AND_DISK)
+
+    results = {}
+    partials = {}
+
+    if campaigns:
+        campaign_results = aggregate_campaigns(dbs_df, site_sizes_df, top)
+        for name in campaigns:
+            results[name] = campaign_results[name]
+        for name in ['campaign_site', 'campaign_dbs']:
+            partials[name] = campaign_results[name]
+
+        # Pie charts of campaigns need sizes of campaigns in each site
+        if 'phedex' in campaigns or 'dbs' in campaigns:
+            results['campaign_sites'] = campaign_results['campaign_sites']
+
+    if campaign_tier:
+        # dataset, phedex_size, size_on_disk
+        phedex_df = phedex_dataset_sizes(site_sizes_df)
+        phedex_df.persist(StorageLevel.MEMORY_AND_DISK)
+
+        if prune:
+            # only datasets present in PhEDEx make it to the result
+            counters = {}
+            with metrics.action('prune fdf'):
+                inst_dbs_df = dbs_dataset_sizes(sqlContext, [inst], verbose=verbose, cache=cache,
+                                                datasets=phedex_df.select('dataset'), counters=counters)
+            print_pruning_counters(counters)
+            with open(PRUNING_FILE, 'w') as ostream:
+                json.dump(counters, ostream, indent=2, sort_keys=True)
+        else:
+            inst_dbs_df = dbs_df.where(dbs_df.inst == inst)
+        partials['campaign_tier'] = campaign_tier_sizes(inst_dbs_df, phedex_df)
+        results['campaign_tier'] = aggregate_campaign_tier(partials['campaign_tier'], top)
+
+    # write out results back to HDFS, the fout parameter defines area on HDFS
+    # it is either absolute path or area under /user/USERNAME
+    # Small results are written directly to local directory if it is given
+    if fout or local:
+        for name, result in results.items():
+            with metrics.action('write %s' % name):
+                write_result(result, '%s/%s' % (fout, name) if fout else None,
+                             os.path.join(local, CSV_FILES[name]) if local else None,
+                             local_rows, local_format)
+
+    # keep partial aggregates of this date for multi-date rollups
+    if store:
+        for name, partial in partials.items():
+            with metrics.action('store %s' % name):
+                write_partial(partial, store, name, date)
+
+    # Both report sections are produced by this single application
+    if campaigns:
+        metrics.write(CAMPAIGNS_METRICS_FILE, CAMPAIGNS_METRICS_HISTORY_FILE)
+    if campaign_tier:
+        metrics.write(CAMPAIGN_TIER_METRICS_FILE, CAMPAIGN_TIER_METRICS_HISTORY_FILE)
+
+    stop_context(ctx)
+
+def main():
+    "Main function"
+    optmgr  = OptionParser()
+    opts = optmgr.parser.parse_args()
+    print("Input arguments: %s" % opts)
+    time0 = time.time()
+    fout = opts.fout
+    date = opts.date
+    verbose = opts.verbose
+    yarn = opts.yarn
+    inst = opts.inst
+    if  inst in ['global', 'phys01', 'phys02', 'phys03']:
+        inst = inst.upper()
+    else:
+        raise Exception('Unsupported DBS instance "%s"' % inst)
+    outputs = opts.outputs.split(',') if opts.outputs else []
+    for output in outputs:
+        if output not in OUTPUTS:
+            raise Exception('Unsupported output "%s"' % output)
+    cache = opts.cache
+    store = opts.store
+    top = opts.top
+    run(fout, date, outputs, yarn, verbose, inst, cache, store, top,
+        opts.local, opts.local_rows, opts.local_format, opts.prune)
+    print('Start time  : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time0)))
+    print('End time    : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time.time())))
+    print('Elapsed time: %s' % elapsed_time(time0))
+
+    # Both report sections are produced by this single application
+    if [x for x in outputs if x in CAMPAIGN_OUTPUTS]:
+        with open("spark_exec_time_campaigns.txt", "w") as text_file:
+            text_file.write(elapsed_time(time0))
+
+    if 'campaign_tier' in outputs:
+        with open("spark_exec_time_campaign_tier.txt", "w") as text_file:
+            text_file.write(elapsed_time(time0))
+
+if __name__ == '__main__':
+    main()
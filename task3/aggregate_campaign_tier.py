@@ -13,15 +13,25 @@ import argparse
 from types import NoneType
 
 from pyspark import SparkContext, StorageLevel
-from pyspark.sql import HiveContext
-from pyspark.sql.functions import udf
 
 # CMSSpark modules
-from CMSSpark.spark_utils import dbs_tables, phedex_tables, print_rows
-from CMSSpark.spark_utils import spark_context, split_dataset
+from CMSSpark.spark_utils import print_rows
+from CMSSpark.spark_utils import split_dataset
+from CMSSpark.job_context import job_context, job_sql_context, stop_context
 from CMSSpark.utils import elapsed_time
+from CMSSpark.campaign_tables import dbs_dataset_sizes, phedex_dataset_sizes, phedex_site_sizes
+from CMSSpark.campaign_partials import write_partial
+from CMSSpark.cms_columns import dataset_campaign, dataset_tier
+from CMSSpark.spark_metrics import SparkMetrics
+from CMSSpark.top_n import TOP, top_frame
+from CMSSpark.result_sink import FORMATS, MAX_ROWS, write_result
 
-LIMIT = 100
+METRICS_FILE = 'spark_metrics_campaign_tier.json'
+METRICS_HISTORY_FILE = 'spark_metrics_campaign_tier_history.json'
+PRUNING_FILE = 'campaign_tier_pruning.json'
+
+# CSV file of the output read by visualize.py
+CSV_FILE = 'campaign_tier_df.csv'
 
 class OptionParser():
     def __init__(self):
@@ -51,6 +61,20 @@ class OptionParser():
         msg = 'DBS instance on HDFS: global (default), phys01, phys02, phys03'
         self.parser.add_argument("--inst", action="store",
             dest="inst", default="global", help=msg)
+        self.parser.add_argument("--cache", action="store",
+            dest="cache", default="", help='Location of Parquet cache of DBS and PhEDEx tables, see table_cache.py')
+        self.parser.add_argument("--store", action="store",
+            dest="store", default="", help='Location of the store of per-date partial aggregates, see campaign_partials.py')
+        self.parser.add_argument("--prune", action="store_true",
+            dest="prune", default=False, help="Drop DBS files of datasets which are not in PhEDEx before joining DBS tables")
+        self.parser.add_argument("--top", action="store", type=int,
+            dest="top", default=TOP, help='Number of rows kept in ranked outputs, default %s' % TOP)
+        self.parser.add_argument("--local", action="store",
+            dest="local", default="", help='Local directory where results of at most --local-rows rows are written directly, see result_sink.py')
+        self.parser.add_argument("--local-rows", action="store", type=int,
+            dest="local_rows", default=MAX_ROWS, help='Maximal number of rows of results written to local directory, default %s' % MAX_ROWS)
+        self.parser.add_argument("--local-format", action="store", choices=FORMATS,
+            dest="local_format", default="csv", help='Format of local result files: csv (default) or parquet')
         self.parser.add_argument("--no-log4j", action="store_true",
             dest="no-log4j", default=False, help="Disable spark log4j messages")
         self.parser.add_argument("--yarn", action="store_true",
@@ -68,88 +92,19 @@ def quiet_logs(sc):
     logger = sc._jvm.org.apache.log4j
     logger.LogManager.getRootLogger().setLevel(logger.Level.ERROR)
 
-def run(fout, date, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='GLOBAL'):
+def campaign_tier_sizes(dbs_df, phedex_df):
     """
-    Main function to run pyspark job. It requires a schema file, an HDFS directory
-    with data and optional script with mapper/reducer functions.
+    Aggregates DBS and PhEDEx data by campaign and tier. dbs_df must have
+    dataset and dbs_size columns, phedex_df must have dataset, phedex_size
+    and size_on_disk columns.
     """
-    
-    # define spark context, it's main object which allow to communicate with spark
-    ctx = spark_context('cms', yarn, verbose)
-
-    quiet_logs(ctx)
-
-    sqlContext = HiveContext(ctx)
-    
-    fromdate = '%s-%s-%s' % (date[:4], date[4:6], date[6:])
-    todate = fromdate
-
-    # read DBS and Phedex tables
-    tables = {}
-    tables.update(dbs_tables(sqlContext, inst=inst, verbose=verbose))
-    tables.update(phedex_tables(sqlContext, verbose=verbose, fromdate=fromdate, todate=todate))
-    phedex = tables['phedex_df']
-    
-    daf = tables['daf']
-    ddf = tables['ddf']
-    fdf = tables['fdf']
-
-    # DBS
-    dbs_fdf_cols = ['f_dataset_id', 'f_file_size']
-    dbs_ddf_cols = ['d_dataset_id', 'd_dataset', 'd_dataset_access_type_id']
-    dbs_daf_cols = ['dataset_access_type_id', 'dataset_access_type']
-
-    fdf_df = fdf.select(dbs_fdf_cols)
-    ddf_df = ddf.select(dbs_ddf_cols)
-    daf_df = daf.select(dbs_daf_cols)
-    
-    # dataset, dbs_size, dataset_access_type_id
-    dbs_df = fdf_df.join(ddf_df, fdf_df.f_dataset_id == ddf_df.d_dataset_id)\
-                   .drop('f_dataset_id')\
-                   .drop('d_dataset_id')\
-                   .withColumnRenamed('d_dataset', 'dataset')\
-                   .withColumnRenamed('f_file_size', 'size')\
-                   .withColumnRenamed('d_dataset_access_type_id', 'dataset_access_type_id')
-
-    # dataset, size, dataset_access_type
-    dbs_df = dbs_df.join(daf_df, dbs_df.dataset_access_type_id == daf_df.dataset_access_type_id)\
-                   .drop(dbs_df.dataset_access_type_id)\
-                   .drop(daf_df.dataset_access_type_id)
-
-    # dataset, dbs_size
-    dbs_df = dbs_df.where(dbs_df.dataset_access_type == 'VALID')\
-                   .groupBy('dataset')\
-                   .agg({'size':'sum'})\
-                   .withColumnRenamed('sum(size)', 'dbs_size')
-
-    # PhEDEx
-
-    size_on_disk_udf = udf(lambda site, size: 0 if site.endswith(('_MSS', '_Buffer', '_Export')) else size)
-
-    # dataset, size, site
-    phedex_cols = ['dataset_name', 'block_bytes', 'node_name']
-    phedex_df = phedex.select(phedex_cols)\
-                      .withColumnRenamed('dataset_name', 'dataset')\
-                      .withColumnRenamed('block_bytes', 'size')\
-                      .withColumnRenamed('node_name', 'site')
-    
-    # dataset, phedex_size, size_on_disk
-    phedex_df = phedex_df.withColumn('size_on_disk', size_on_disk_udf(phedex_df.site, phedex_df.size))\
-                         .groupBy('dataset')\
-                         .agg({'size':'sum', 'size_on_disk': 'sum'})\
-                         .withColumnRenamed('sum(size)', 'phedex_size')\
-                         .withColumnRenamed('sum(size_on_disk)', 'size_on_disk')
-
     # dataset, dbs_size, phedex_size, size_on_disk
     result = phedex_df.join(dbs_df, phedex_df.dataset == dbs_df.dataset)\
                       .drop(dbs_df.dataset)
 
-    extract_campaign_udf = udf(lambda dataset: dataset.split('/')[2])
-    extract_tier_udf = udf(lambda dataset: dataset.split('/')[3])
-
     # campaign, tier, dbs_size, phedex_size, size_on_disk
-    result = result.withColumn('campaign', extract_campaign_udf(result.dataset))\
-                   .withColumn('tier', extract_tier_udf(result.dataset))\
+    result = result.withColumn('campaign', dataset_campaign(result.dataset))\
+                   .withColumn('tier', dataset_tier(result.dataset))\
                    .drop('dataset')\
                    .groupBy(['campaign', 'tier'])\
                    .agg({'dbs_size':'sum', 'phedex_size': 'sum', 'size_on_disk': 'sum'})\
@@ -157,19 +112,83 @@ def run(fout, date, yarn=None, verbose=None, patterns=None, antipatterns=None, i
                    .withColumnRenamed('sum(phedex_size)', 'phedex_size')\
                    .withColumnRenamed('sum(size_on_disk)', 'size_on_disk')
 
+    return result
+
+def print_pruning_counters(counters):
+    "Prints numbers of kept and pruned DBS file rows and bytes of each instance"
+    for inst, values in sorted(counters.items()):
+        total_rows = values['kept_rows'] + values['pruned_rows']
+        total_bytes = values['kept_bytes'] + values['pruned_bytes']
+        print('DBS %s files kept: %s rows, %s bytes' % (inst, values['kept_rows'], values['kept_bytes']))
+        print('DBS %s files pruned: %s of %s rows, %s of %s bytes'\
+              % (inst, values['pruned_rows'], total_rows, values['pruned_bytes'], total_bytes))
+
+def aggregate_campaign_tier(result, top=TOP):
+    """
+    Returns top most significant campaign - tier pairs of campaign_tier_sizes result.
+    """
     # campaign, tier, dbs_size, phedex_size, size_on_disk
     result = result.withColumn('sum_size', result.dbs_size + result.phedex_size)
-    result = result.orderBy(result.sum_size, ascending=False)\
-                   .drop('sum_size')\
-                   .limit(LIMIT)
+    result = top_frame(result, 'sum_size', n=top).drop('sum_size')
+
+    return result
+
+def run(fout, date, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='GLOBAL', cache=None, store=None, prune=False, top=TOP,
+        local=None, local_rows=MAX_ROWS, local_format='csv'):
+    """
+    Main function to run pyspark job. It requires a schema file, an HDFS directory
+    with data and optional script with mapper/reducer functions.
+    """
     
+    # define spark context, it's main object which allow to communicate with spark
+    ctx = job_context('cms', yarn, verbose)
+
+    quiet_logs(ctx)
+
+    sqlContext = job_sql_context(ctx)
+    metrics = SparkMetrics(ctx, 'campaign_tier')
+
+    # read DBS and Phedex tables
+
+    # dataset, phedex_size, size_on_disk
+    phedex_df = phedex_dataset_sizes(phedex_site_sizes(sqlContext, date, verbose=verbose, cache=cache))
+
+    # dataset, dbs_size
+    if prune:
+        # only datasets present in PhEDEx make it to the result
+        phedex_df.persist(StorageLevel.MEMORY_AND_DISK)
+        counters = {}
+        with metrics.action('prune fdf'):
+            dbs_df = dbs_dataset_sizes(sqlContext, [inst], verbose=verbose, cache=cache,
+                                       datasets=phedex_df.select('dataset'), counters=counters)
+        print_pruning_counters(counters)
+        with open(PRUNING_FILE, 'w') as ostream:
+            json.dump(counters, ostream, indent=2, sort_keys=True)
+    else:
+        dbs_df = dbs_dataset_sizes(sqlContext, [inst], verbose=verbose, cache=cache)
+
+    # campaign, tier, dbs_size, phedex_size, size_on_disk
+    sizes_df = campaign_tier_sizes(dbs_df, phedex_df)
+    if store:
+        sizes_df.persist(StorageLevel.MEMORY_AND_DISK)
+
+    result = aggregate_campaign_tier(sizes_df, top)
+
     # write out results back to HDFS, the fout parameter defines area on HDFS
     # it is either absolute path or area under /user/USERNAME
-    if fout:
-        result.write.format("com.databricks.spark.csv")\
-                    .option("header", "true").save(fout)
+    # Small result is written directly to local directory if it is given
+    if fout or local:
+        with metrics.action('write campaign_tier'):
+            write_result(result, fout, os.path.join(local, CSV_FILE) if local else None,
+                         local_rows, local_format)
+
+    # keep partial aggregates of this date for multi-date rollups
+    if store:
+        with metrics.action('store campaign_tier'):
+            write_partial(sizes_df, store, 'campaign_tier', date)
 
-    ctx.stop()
+    metrics.write(METRICS_FILE, METRICS_HISTORY_FILE)
+    stop_context(ctx)
 
 def main():
     "Main function"
@@ -188,7 +207,12 @@ def main():
         raise Exception('Unsupported DBS instance "%s"' % inst)
     patterns = opts.patterns.split(',') if opts.patterns else []
     antipatterns = opts.antipatterns.split(',') if opts.antipatterns else []
-    run(fout, date, yarn, verbose, patterns, antipatterns, inst)
+    cache = opts.cache
+    store = opts.store
+    prune = opts.prune
+    top = opts.top
+    run(fout, date, yarn, verbose, patterns, antipatterns, inst, cache, store, prune, top,
+        opts.local, opts.local_rows, opts.local_format)
     print('Start time  : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time0)))
     print('End time    : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time.time())))
     print('Elapsed time: %s' % elapsed_time(time0))
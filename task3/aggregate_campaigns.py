@@ -5,24 +5,32 @@ Spark script to parse and aggregate DBS and PhEDEx records on HDFS.
 
 # system modules
 import os
-import re
 import sys
 import time
-import json
 import argparse
-from types import NoneType
 
 from pyspark import SparkContext, StorageLevel
-from pyspark.sql import HiveContext
-from pyspark.sql.functions import struct, array, udf, countDistinct
-from pyspark.sql.types import IntegerType, LongType, StringType, StructType, StructField
+from pyspark.sql.functions import countDistinct, col, desc, max, sum, when, row_number
+from pyspark.sql.window import Window
 
 # CMSSpark modules
-from CMSSpark.spark_utils import dbs_tables, phedex_tables, print_rows
-from CMSSpark.spark_utils import spark_context, split_dataset
+from CMSSpark.job_context import job_context, job_sql_context, stop_context
 from CMSSpark.utils import elapsed_time
-
-LIMIT = 100
+from CMSSpark.campaign_tables import DBS_INSTANCES, dbs_dataset_sizes, phedex_site_sizes
+from CMSSpark.campaign_partials import write_partial
+from CMSSpark.cms_columns import dataset_campaign
+from CMSSpark.spark_metrics import SparkMetrics
+from CMSSpark.top_n import TOP, top_frame, top_frames
+from CMSSpark.result_sink import FORMATS, MAX_ROWS, write_result
+
+METRICS_FILE = 'spark_metrics_campaigns.json'
+METRICS_HISTORY_FILE = 'spark_metrics_campaigns_history.json'
+
+# CSV files of outputs read by visualize.py
+CSV_FILES = {'phedex': 'campaigns_phedex_df.csv',
+             'dbs': 'campaigns_dbs_df.csv',
+             'site_campaign_count': 'site_campaign_count_df.csv',
+             'campaign_sites': 'campaign_sites_df.csv'}
 
 class OptionParser():
     def __init__(self):
@@ -52,6 +60,18 @@ class OptionParser():
         msg = 'DBS instance on HDFS: global (default), phys01, phys02, phys03'
         self.parser.add_argument("--inst", action="store",
             dest="inst", default="global", help=msg)
+        self.parser.add_argument("--cache", action="store",
+            dest="cache", default="", help='Location of Parquet cache of DBS and PhEDEx tables, see table_cache.py')
+        self.parser.add_argument("--store", action="store",
+            dest="store", default="", help='Location of the store of per-date partial aggregates, see campaign_partials.py')
+        self.parser.add_argument("--top", action="store", type=int,
+            dest="top", default=TOP, help='Number of rows kept in ranked outputs, default %s' % TOP)
+        self.parser.add_argument("--local", action="store",
+            dest="local", default="", help='Local directory where results of at most --local-rows rows are written directly, see result_sink.py')
+        self.parser.add_argument("--local-rows", action="store", type=int,
+            dest="local_rows", default=MAX_ROWS, help='Maximal number of rows of results written to local directory, default %s' % MAX_ROWS)
+        self.parser.add_argument("--local-format", action="store", choices=FORMATS,
+            dest="local_format", default="csv", help='Format of local result files: csv (default) or parquet')
         self.parser.add_argument("--no-log4j", action="store_true",
             dest="no-log4j", default=False, help="Disable spark log4j messages")
         self.parser.add_argument("--yarn", action="store_true",
@@ -62,9 +82,6 @@ class OptionParser():
         self.parser.add_argument("--date", action="store",
             dest="date", default="", help='Select CMSSW data for specific date (YYYYMMDD)')
 
-def extract_campaign(dataset):
-    return dataset.split('/')[2]
-
 def quiet_logs(sc):
     """
     Sets logger's level to ERROR so INFO logs would not show up.
@@ -72,171 +89,136 @@ def quiet_logs(sc):
     logger = sc._jvm.org.apache.log4j
     logger.LogManager.getRootLogger().setLevel(logger.Level.ERROR)
 
-def get_mss(row):
-    sorted_values = sorted([x for x in row if x != None], reverse=True)
-    return sorted_values[0]
-
-def get_second_mss(row):
-    sorted_values = sorted([x for x in row if x != None], reverse=True)
-    return sorted_values[1] if len(sorted_values) > 1 else None
-    
-def get_mss_name(row, sites_columns):
-    list_of_values = [x for x in row]
-    tuples = zip(list_of_values, sites_columns)
-    tuples = sorted([x for x in tuples if x[0] != None], key=lambda x: x[0], reverse=True)
-    return tuples[0][1]
-
-def get_second_mss_name(row, sites_columns):
-    list_of_values = [x for x in row]
-    tuples = zip(list_of_values, sites_columns)
-    tuples = sorted([x for x in tuples if x[0] != None], key=lambda x: x[0], reverse=True)
-    return tuples[1][1] if len(tuples) > 1 else None
-
-def run(fout, date, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='GLOBAL'):
+def aggregate_campaigns(dbs_df, site_sizes_df, top=TOP):
     """
-    Main function to run pyspark job. It requires a schema file, an HDFS directory
-    with data and optional script with mapper/reducer functions.
+    Aggregates DBS and PhEDEx data by campaign. dbs_df must have dataset and
+    dbs_size columns, site_sizes_df must have dataset, site and size columns.
+    Returns dictionary of resulting dataframes keyed by output name together
+    with campaign_site and campaign_dbs partial aggregates. Ranked outputs
+    keep top rows.
     """
-    
-    # define spark context, it's main object which allow to communicate with spark
-    ctx = spark_context('cms', yarn, verbose)
-
-    quiet_logs(ctx)
-
-    sqlContext = HiveContext(ctx)
-    
-    fromdate = '%s-%s-%s' % (date[:4], date[4:6], date[6:])
-    todate = fromdate
-
-    # read Phedex and DBS tables
-    tables = {}
-
-    tables.update(phedex_tables(sqlContext, verbose=verbose, fromdate=fromdate, todate=todate))
-    phedex = tables['phedex_df']
-
-    instances = ['GLOBAL', 'PHYS01', 'PHYS02', 'PHYS03']
-    for instance in instances:
-        dbs_dict = dbs_tables(sqlContext, inst=instance, verbose=verbose)
-        for key, val in dbs_dict.items():
-            new_key = '%s_%s' % (key, instance)
-            tables[new_key] = val
-    
-    daf = reduce(lambda a,b: a.unionAll(b), [tables['daf_%s' % x] for x in instances])
-    ddf = reduce(lambda a,b: a.unionAll(b), [tables['ddf_%s' % x] for x in instances])
-    fdf = reduce(lambda a,b: a.unionAll(b), [tables['fdf_%s' % x] for x in instances])
-
-    dbs_fdf_cols = ['f_dataset_id', 'f_file_size']
-    dbs_ddf_cols = ['d_dataset_id', 'd_dataset', 'd_dataset_access_type_id']
-    dbs_daf_cols = ['dataset_access_type_id', 'dataset_access_type']
-
-    fdf_df = fdf.select(dbs_fdf_cols)
-    ddf_df = ddf.select(dbs_ddf_cols)
-    daf_df = daf.select(dbs_daf_cols)
-
     # Aggregate by campaign and find total PhEDEx and DBS size of each campaign
 
-    extract_campaign_udf = udf(lambda dataset: dataset.split('/')[2])
+    # campaign, dbs_size
+    dbs_df = dbs_df.withColumn('campaign', dataset_campaign(dbs_df.dataset))\
+                   .groupBy(['campaign'])\
+                   .agg({'dbs_size':'sum'})\
+                   .withColumnRenamed('sum(dbs_size)', 'dbs_size')
 
-    # dataset, size, dataset_access_type_id
-    dbs_df = fdf_df.join(ddf_df, fdf_df.f_dataset_id == ddf_df.d_dataset_id)\
-                   .drop('f_dataset_id')\
-                   .drop('d_dataset_id')\
-                   .withColumnRenamed('d_dataset', 'dataset')\
-                   .withColumnRenamed('f_file_size', 'size')\
-                   .withColumnRenamed('d_dataset_access_type_id', 'dataset_access_type_id')
+    # Select campaign - site pairs and their sizes (from PhEDEx)
 
-    # dataset, size, dataset_access_type
-    dbs_df = dbs_df.join(daf_df, dbs_df.dataset_access_type_id == daf_df.dataset_access_type_id)\
-                   .drop(dbs_df.dataset_access_type_id)\
-                   .drop(daf_df.dataset_access_type_id)
+    # campaign, site, size
+    campaign_site_df = site_sizes_df.withColumn('campaign', dataset_campaign(site_sizes_df.dataset))\
+                                    .groupBy(['campaign', 'site'])\
+                                    .agg({'size':'sum'})\
+                                    .withColumnRenamed('sum(size)', 'size')
 
-    # campaign, dbs_size
-    dbs_df = dbs_df.where(dbs_df.dataset_access_type == 'VALID')\
-                   .withColumn('campaign', extract_campaign_udf(dbs_df.dataset))\
-                   .groupBy(['campaign'])\
-                   .agg({'size':'sum'})\
-                   .withColumnRenamed('sum(size)', 'dbs_size')\
-                   .drop('dataset')
+    # keep table around, it is used by every result below
+    campaign_site_df.persist(StorageLevel.MEMORY_AND_DISK)
 
     # campaign, phedex_size
-    phedex_cols = ['dataset_name', 'block_bytes']
-    phedex_df = phedex.select(phedex_cols)
-    phedex_df = phedex_df.withColumn('campaign', extract_campaign_udf(phedex_df.dataset_name))\
-                .groupBy(['campaign'])\
-                .agg({'block_bytes':'sum'})\
-                .withColumnRenamed('sum(block_bytes)', 'phedex_size')
+    phedex_df = campaign_site_df.groupBy(['campaign'])\
+                                .agg({'size':'sum'})\
+                                .withColumnRenamed('sum(size)', 'phedex_size')
 
     # campaign, dbs_size, phedex_size
     dbs_phedex_df = dbs_df.join(phedex_df, dbs_df.campaign == phedex_df.campaign)\
                           .drop(dbs_df.campaign)
 
-    print 'DISTINCT DBS AND PHEDEX CAMPAIGN COUNT:'
-    print dbs_phedex_df.select('campaign').distinct().count()
-
-    # Select campaign - site pairs and their sizes (from PhEDEx)
-
-    # campaign, site, size
-    phedex_cols = ['dataset_name', 'node_name', 'block_bytes']
-    campaign_site_df = phedex.select(phedex_cols)
-    campaign_site_df = campaign_site_df.withColumn('campaign', extract_campaign_udf(campaign_site_df.dataset_name))\
-                .groupBy(['campaign', 'node_name'])\
-                .agg({'block_bytes':'sum'})\
-                .withColumnRenamed('sum(block_bytes)', 'size')\
-                .withColumnRenamed('node_name', 'site')
-
     # Aggregate data for site - campaign count table
 
     # site, count
     site_campaign_count_df = campaign_site_df.groupBy(['site'])\
                                              .agg(countDistinct('campaign'))\
-                                             .withColumnRenamed('count(campaign)', 'campaign_count')\
-                                             .orderBy('campaign_count', ascending=False)\
-                                             .limit(LIMIT)
+                                             .withColumnRenamed('count(campaign)', 'campaign_count')
+    site_campaign_count_df = top_frame(site_campaign_count_df, 'campaign_count', n=top)
 
     # Find two most significant sites for each campaign
 
-    columns_before_pivot = campaign_site_df.columns
+    # Rank sites inside every campaign by size. Ties are broken by site name
+    # so results are deterministic.
+    site_window = Window.partitionBy('campaign').orderBy(desc('size'), 'site')
+    ranked_df = campaign_site_df.withColumn('rank', row_number().over(site_window))
 
-    result = campaign_site_df.groupBy(['campaign'])\
-                             .pivot('site')\
-                             .sum('size')\
-                             .na.fill(0)
-    
-    columns_after_pivot = result.columns
-    sites_columns = [x for x in columns_after_pivot if x not in columns_before_pivot]
-
-    number_of_sites_udf = udf(lambda row: len([x for x in row if x != 0]), IntegerType())
-    mss_udf = udf(get_mss, LongType())
-    second_mss_udf = udf(get_second_mss, LongType())
-    mss_name_udf = udf(lambda row: get_mss_name(row, sites_columns), StringType())
-    second_mss_name_udf = udf(lambda row: get_second_mss_name(row, sites_columns), StringType())
-
-    result = result.withColumn('sites', number_of_sites_udf(struct([result[x] for x in sites_columns])))\
-                   .withColumn('mss', mss_udf(struct([result[x] for x in sites_columns])))\
-                   .withColumn('mss_name', mss_name_udf(struct([result[x] for x in sites_columns])))\
-                   .withColumn('second_mss', second_mss_udf(struct([result[x] for x in sites_columns])))\
-                   .withColumn('second_mss_name', second_mss_name_udf(struct([result[x] for x in sites_columns])))
+    # campaign, mss, mss_name, second_mss, second_mss_name, sites
+    result = ranked_df.groupBy('campaign')\
+                      .agg(max(when(col('rank') == 1, col('size'))).alias('mss'),
+                           max(when(col('rank') == 1, col('site'))).alias('mss_name'),
+                           max(when(col('rank') == 2, col('size'))).alias('second_mss'),
+                           max(when(col('rank') == 2, col('site'))).alias('second_mss_name'),
+                           sum(when(col('size') != 0, 1).otherwise(0)).alias('sites'))\
+                      .na.fill({'second_mss': 0, 'second_mss_name': '-'})
 
     # campaign, phedex_size, dbs_size, mss, mss_name, second_mss, second_mss_name, sites
     result = result.join(dbs_phedex_df, result.campaign == dbs_phedex_df.campaign)\
                    .drop(result.campaign)
 
-    sorted_by_phedex = result.orderBy(result.phedex_size, ascending=False).limit(LIMIT)
-    sorted_by_dbs = result.orderBy(result.dbs_size, ascending=False).limit(LIMIT)
+    # both rankings are computed from a single scan of result
+    rankings = {'phedex': ('phedex_size', False), 'dbs': ('dbs_size', False)}
+    ranked = top_frames(result, rankings, top)
+    sorted_by_phedex = ranked['phedex']
+    sorted_by_dbs = ranked['dbs']
+
+    # Sizes of campaigns in every site in long format (campaign, site, size).
+    # Only campaigns which made it to one of the tables above are needed to
+    # draw the pie charts.
+    top_campaigns = sorted_by_phedex.select('campaign')\
+                                    .unionAll(sorted_by_dbs.select('campaign'))\
+                                    .distinct()
+    campaign_sites = campaign_site_df.join(top_campaigns,
+                                          campaign_site_df.campaign == top_campaigns.campaign,
+                                          'leftsemi')
+
+    return {'phedex': sorted_by_phedex,
+            'dbs': sorted_by_dbs,
+            'site_campaign_count': site_campaign_count_df,
+            'campaign_sites': campaign_sites,
+            'campaign_site': campaign_site_df,
+            'campaign_dbs': dbs_df}
+
+def run(fout, date, yarn=None, verbose=None, patterns=None, antipatterns=None, inst='GLOBAL', cache=None, store=None, top=TOP,
+        local=None, local_rows=MAX_ROWS, local_format='csv'):
+    """
+    Main function to run pyspark job. It requires a schema file, an HDFS directory
+    with data and optional script with mapper/reducer functions.
+    """
     
-    # write out results back to HDFS, the fout parameter defines area on HDFS
-    # it is either absolute path or area under /user/USERNAME
-    if fout:
-        sorted_by_phedex.write.format("com.databricks.spark.csv")\
-                              .option("header", "true").save('%s/phedex' % fout)
-        
-        sorted_by_dbs.write.format("com.databricks.spark.csv")\
-                           .option("header", "true").save('%s/dbs' % fout)
+    # define spark context, it's main object which allow to communicate with spark
+    ctx = job_context('cms', yarn, verbose)
+
+    quiet_logs(ctx)
+
+    sqlContext = job_sql_context(ctx)
+    metrics = SparkMetrics(ctx, 'campaigns')
 
-        site_campaign_count_df.write.format("com.databricks.spark.csv")\
-                              .option("header", "true").save('%s/site_campaign_count' % fout)
+    # read Phedex and DBS tables
+
+    # dataset, site, size
+    site_sizes_df = phedex_site_sizes(sqlContext, date, verbose=verbose, cache=cache)
+
+    # inst, dataset, dbs_size
+    dbs_df = dbs_dataset_sizes(sqlContext, DBS_INSTANCES, verbose=verbose, cache=cache)
 
-    ctx.stop()
+    results = aggregate_campaigns(dbs_df, site_sizes_df, top)
+
+    # write out results back to HDFS, the fout parameter defines area on HDFS
+    # it is either absolute path or area under /user/USERNAME
+    # Small results are written directly to local directory if it is given
+    if fout or local:
+        for name in ['phedex', 'dbs', 'site_campaign_count', 'campaign_sites']:
+            with metrics.action('write %s' % name):
+                write_result(results[name], '%s/%s' % (fout, name) if fout else None,
+                             os.path.join(local, CSV_FILES[name]) if local else None,
+                             local_rows, local_format)
+
+    # keep partial aggregates of this date for multi-date rollups
+    if store:
+        for name in ['campaign_site', 'campaign_dbs']:
+            with metrics.action('store %s' % name):
+                write_partial(results[name], store, name, date)
+
+    metrics.write(METRICS_FILE, METRICS_HISTORY_FILE)
+    stop_context(ctx)
 
 def main():
     "Main function"
@@ -255,7 +237,11 @@ def main():
         raise Exception('Unsupported DBS instance "%s"' % inst)
     patterns = opts.patterns.split(',') if opts.patterns else []
     antipatterns = opts.antipatterns.split(',') if opts.antipatterns else []
-    run(fout, date, yarn, verbose, patterns, antipatterns, inst)
+    cache = opts.cache
+    store = opts.store
+    top = opts.top
+    run(fout, date, yarn, verbose, patterns, antipatterns, inst, cache, store, top,
+        opts.local, opts.local_rows, opts.local_format)
     print('Start time  : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time0)))
     print('End time    : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time.time())))
     print('Elapsed time: %s' % elapsed_time(time0))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Store of per-date partial campaign aggregates.
+
+Every aggregation run can keep its partial results keyed by snapshot date
+so multi-date views can be built from them without reading raw DBS and
+PhEDEx tables again. Store layout (store can be any Hadoop supported location):
+    <store>/campaign_site/date=YYYYMMDD    campaign, site, size
+    <store>/campaign_dbs/date=YYYYMMDD     campaign, dbs_size
+    <store>/campaign_tier/date=YYYYMMDD    campaign, tier, dbs_size, phedex_size, size_on_disk
+"""
+
+# pyspark modules
+from pyspark.sql.functions import col
+
+PARTIALS = ['campaign_site', 'campaign_dbs', 'campaign_tier']
+
+def partial_path(store, name, date):
+    "Location of partial aggregate of given name and date (YYYYMMDD) in the store"
+    return '%s/%s/date=%s' % (store, name, date)
+
+def write_partial(df, store, name, date):
+    "Writes partial aggregate of given date (YYYYMMDD) to the store replacing previous one"
+    if  name not in PARTIALS:
+        raise Exception('Unsupported partial aggregate "%s"' % name)
+    df.write.mode('overwrite').parquet(partial_path(store, name, date))
+
+def read_partials(sqlContext, store, name, fromdate=None, todate=None):
+    """
+    Reads all stored partial aggregates of given name. Dataframe has
+    additional date column (YYYYMMDD string). Dates can be limited with
+    fromdate and todate (YYYYMMDD), both included.
+    """
+    if  name not in PARTIALS:
+        raise Exception('Unsupported partial aggregate "%s"' % name)
+
+    # Partition discovery would turn date into integer column, keep it string
+    sqlContext.setConf('spark.sql.sources.partitionColumnTypeInference.enabled', 'false')
+    df = sqlContext.read.parquet('%s/%s' % (store, name))
+
+    # Filters on partition column only read matching date directories
+    if  fromdate:
+        df = df.where(col('date') >= fromdate)
+    if  todate:
+        df = df.where(col('date') <= todate)
+    return df
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Spark script to build multi-date campaign views from stored per-date
+partial aggregates (see campaign_partials.py). Raw DBS and PhEDEx tables
+are not read, so adding a new date costs only one day of aggregation.
+"""
+
+# system modules
+import time
+import argparse
+
+from pyspark import StorageLevel
+from pyspark.sql.functions import col, lag, lit, max, sum
+from pyspark.sql.window import Window
+
+# CMSSpark modules
+from CMSSpark.job_context import job_context, job_sql_context, stop_context
+from CMSSpark.utils import elapsed_time
+from CMSSpark.campaign_partials import read_partials
+from CMSSpark.spark_metrics import SparkMetrics
+
+VIEWS = ['campaign_series', 'campaign_deltas', 'campaign_window', 'campaign_tier_series']
+METRICS_FILE = 'spark_metrics_campaign_rollup.json'
+METRICS_HISTORY_FILE = 'spark_metrics_campaign_rollup_history.json'
+
+class OptionParser():
+    def __init__(self):
+        "User based option parser"
+        desc = "Spark script to build multi-date campaign views from stored partial aggregates"
+        self.parser = argparse.ArgumentParser(prog='PROG', description=desc)
+        self.parser.add_argument("--store", action="store",
+            dest="store", default="", help='Location of the store of per-date partial aggregates')
+        fout = 'campaign_rollup'
+        self.parser.add_argument("--fout", action="store",
+            dest="fout", default=fout, help='Output directory name, default %s' % fout)
+        self.parser.add_argument("--fromdate", action="store",
+            dest="fromdate", default="", help='Use partial aggregates starting from given date (YYYYMMDD)')
+        self.parser.add_argument("--todate", action="store",
+            dest="todate", default="", help='Use partial aggregates up to given date including it (YYYYMMDD)')
+        self.parser.add_argument("--window", action="store", type=int,
+            dest="window", default=7, help='Number of the latest stored dates used for campaign_window view, default 7')
+        msg = 'Comma-separated list of views to build: %s (default all)' % ', '.join(VIEWS)
+        self.parser.add_argument("--views", action="store",
+            dest="views", default=','.join(VIEWS), help=msg)
+        self.parser.add_argument("--no-log4j", action="store_true",
+            dest="no-log4j", default=False, help="Disable spark log4j messages")
+        self.parser.add_argument("--yarn", action="store_true",
+            dest="yarn", default=False, help="run job on analytics cluster via yarn resource manager")
+        self.parser.add_argument("--verbose", action="store_true",
+            dest="verbose", default=False, help="verbose output")
+
+def quiet_logs(sc):
+    """
+    Sets logger's level to ERROR so INFO logs would not show up.
+    """
+    logger = sc._jvm.org.apache.log4j
+    logger.LogManager.getRootLogger().setLevel(logger.Level.ERROR)
+
+def campaign_series(site_df, dbs_df):
+    """
+    Daily series of campaign sizes: date, campaign, phedex_size, dbs_size.
+    Campaign which is missing in PhEDEx or DBS on some date has 0 size there.
+    """
+    phedex_df = site_df.groupBy(['date', 'campaign'])\
+                       .agg({'size':'sum'})\
+                       .withColumnRenamed('sum(size)', 'phedex_size')\
+                       .withColumn('dbs_size', lit(0).cast('long'))
+    dbs_df = dbs_df.withColumn('phedex_size', lit(0).cast('long'))
+
+    cols = ['date', 'campaign', 'phedex_size', 'dbs_size']
+    return phedex_df.select(cols)\
+                    .unionAll(dbs_df.select(cols))\
+                    .groupBy(['date', 'campaign'])\
+                    .agg(sum('phedex_size').alias('phedex_size'), sum('dbs_size').alias('dbs_size'))
+
+def campaign_deltas(series_df):
+    """
+    Changes of campaign sizes since the previous stored date the campaign was
+    present: date, campaign, phedex_size, dbs_size, phedex_delta, dbs_delta.
+    Deltas are empty for the first date of each campaign.
+    """
+    previous = Window.partitionBy('campaign').orderBy('date')
+    return series_df.withColumn('phedex_delta', col('phedex_size') - lag('phedex_size', 1).over(previous))\
+                    .withColumn('dbs_delta', col('dbs_size') - lag('dbs_size', 1).over(previous))
+
+def campaign_window(series_df, dates):
+    """
+    Maximum and average campaign sizes over given dates: campaign,
+    max_phedex_size, avg_phedex_size, max_dbs_size, avg_dbs_size.
+    Dates on which campaign is missing count as 0 in the average.
+    """
+    ndates = float(len(dates))
+    return series_df.where(col('date').isin(dates))\
+                    .groupBy('campaign')\
+                    .agg(max('phedex_size').alias('max_phedex_size'),
+                         (sum('phedex_size') / ndates).alias('avg_phedex_size'),
+                         max('dbs_size').alias('max_dbs_size'),
+                         (sum('dbs_size') / ndates).alias('avg_dbs_size'))
+
+def run(store, fout, fromdate=None, todate=None, window=7, views=VIEWS, yarn=None, verbose=None):
+    """
+    Main function to run pyspark job. It reads stored partial aggregates of
+    given dates and builds requested multi-date views from them.
+    """
+    # define spark context, it's main object which allow to communicate with spark
+    ctx = job_context('cms', yarn, verbose)
+
+    quiet_logs(ctx)
+
+    sqlContext = job_sql_context(ctx)
+    metrics = SparkMetrics(ctx, 'campaign_rollup')
+
+    results = {}
+
+    if [x for x in views if x != 'campaign_tier_series']:
+        # date, campaign, site, size
+        site_df = read_partials(sqlContext, store, 'campaign_site', fromdate, todate)
+        # date, campaign, dbs_size
+        dbs_df = read_partials(sqlContext, store, 'campaign_dbs', fromdate, todate)
+
+        # date, campaign, phedex_size, dbs_size
+        series_df = campaign_series(site_df, dbs_df)
+        series_df.persist(StorageLevel.MEMORY_AND_DISK)
+
+        if 'campaign_series' in views:
+            results['campaign_series'] = series_df.orderBy(['campaign', 'date'])
+        if 'campaign_deltas' in views:
+            results['campaign_deltas'] = campaign_deltas(series_df).orderBy(['campaign', 'date'])
+        if 'campaign_window' in views:
+            # the latest stored dates, only distinct dates are collected to the driver
+            with metrics.action('collect dates'):
+                dates = [x.date for x in series_df.select('date').distinct().collect()]
+            dates = sorted(dates)[-window:]
+            print('Window dates: %s' % ', '.join(dates))
+            results['campaign_window'] = campaign_window(series_df, dates)
+
+    if 'campaign_tier_series' in views:
+        # date, campaign, tier, dbs_size, phedex_size, size_on_disk
+        tier_df = read_partials(sqlContext, store, 'campaign_tier', fromdate, todate)
+        results['campaign_tier_series'] = tier_df.orderBy(['campaign', 'tier', 'date'])
+
+    # write out results back to HDFS, the fout parameter defines area on HDFS
+    # it is either absolute path or area under /user/USERNAME
+    if fout:
+        for name, result in results.items():
+            with metrics.action('write %s' % name):
+                result.write.format("com.databricks.spark.csv")\
+                      .option("header", "true").save('%s/%s' % (fout, name))
+
+    metrics.write(METRICS_FILE, METRICS_HISTORY_FILE)
+    stop_context(ctx)
+
+def main():
+    "Main function"
+    optmgr  = OptionParser()
+    opts = optmgr.parser.parse_args()
+    print("Input arguments: %s" % opts)
+    time0 = time.time()
+    if  not opts.store:
+        raise Exception('Location of the store is not given')
+    views = opts.views.split(',') if opts.views else []
+    for view in views:
+        if view not in VIEWS:
+            raise Exception('Unsupported view "%s"' % view)
+    run(opts.store, opts.fout, opts.fromdate, opts.todate, opts.window, views, opts.yarn, opts.verbose)
+    print('Start time  : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time0)))
+    print('End time    : %s' % time.strftime('%Y-%m-%d %H:%M:%S GMT', time.gmtime(time.time())))
+    print('Elapsed time: %s' % elapsed_time(time0))
+
+    with open("spark_exec_time_campaign_rollup.txt", "w") as text_file:
+        text_file.write(elapsed_time(time0))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Intermediate DBS and PhEDEx tables shared by task3 Spark scripts.
+"""
+
+# pyspark modules
+from pyspark import StorageLevel
+from pyspark.sql.functions import broadcast, col, count, lit, sum, when
+
+# CMSSpark modules
+from CMSSpark.table_cache import dbs_table_columns, phedex_table
+from CMSSpark.cms_columns import size_on_disk
+
+DBS_INSTANCES = ['GLOBAL', 'PHYS01', 'PHYS02', 'PHYS03']
+
+def pruned_dataset_sizes(fdf_df, ddf_df, daf_df, datasets):
+    """
+    Sums sizes of VALID files of given datasets (dataframe with dataset
+    column). Ids of these datasets are broadcast to executors and files of all
+    other datasets are dropped while the file table is read, before any
+    shuffle. Returns dataset, dbs_size dataframe and dictionary with numbers of
+    kept and pruned file rows and their bytes.
+    """
+    # d_dataset_id, d_dataset of VALID datasets which are in datasets
+    valid_df = ddf_df.join(daf_df, ddf_df.d_dataset_access_type_id == daf_df.dataset_access_type_id)\
+                     .where(daf_df.dataset_access_type == 'VALID')\
+                     .select(['d_dataset_id', 'd_dataset'])
+    ids_df = valid_df.join(datasets, valid_df.d_dataset == datasets.dataset, 'leftsemi')
+    ids_df.persist(StorageLevel.MEMORY_AND_DISK)
+
+    keep_df = ids_df.select(ids_df.d_dataset_id.alias('keep_id'))
+
+    # Files of pruned datasets get -1 dataset id, so partial aggregation
+    # collapses them into a single row in each partition. This keeps pruned
+    # rows out of the shuffle and still counts them in the same pass.
+    files_df = fdf_df.join(broadcast(keep_df), fdf_df.f_dataset_id == keep_df.keep_id, 'left_outer')\
+                     .withColumn('dataset_id', when(col('keep_id').isNull(), -1).otherwise(col('f_dataset_id')))\
+                     .groupBy('dataset_id')\
+                     .agg(count(lit(1)).alias('files'), sum('f_file_size').alias('size'))
+    files_df.persist(StorageLevel.MEMORY_AND_DISK)
+
+    counters = {'kept_rows': 0, 'kept_bytes': 0, 'pruned_rows': 0, 'pruned_bytes': 0}
+    stats = files_df.withColumn('part', when(col('dataset_id') == -1, 'pruned').otherwise('kept'))\
+                    .groupBy('part')\
+                    .agg(sum('files').alias('files'), sum('size').alias('size'))\
+                    .collect()
+    for row in stats:
+        counters['%s_rows' % row.part] = row.files
+        counters['%s_bytes' % row.part] = row.size or 0
+
+    # dataset, dbs_size
+    dbs_df = files_df.join(ids_df, files_df.dataset_id == ids_df.d_dataset_id)\
+                     .select(col('d_dataset').alias('dataset'), col('size').alias('dbs_size'))
+
+    return dbs_df, counters
+
+def dbs_dataset_sizes(sqlContext, instances=DBS_INSTANCES, verbose=None, cache=None, datasets=None, counters=None):
+    """
+    Reads DBS tables of given instances and returns dataframe with the total
+    size of VALID files of each dataset: inst, dataset, dbs_size
+    If datasets dataframe (with dataset column) is given, only these datasets
+    are kept and the file table is pruned before it is joined with datasets.
+    Pruning counters of each instance are then stored in counters dictionary.
+    """
+    frames = []
+    for inst in instances:
+        columns = {'fdf': ['f_dataset_id', 'f_file_size'],
+                   'ddf': ['d_dataset_id', 'd_dataset', 'd_dataset_access_type_id'],
+                   'daf': ['dataset_access_type_id', 'dataset_access_type']}
+        tables = dbs_table_columns(sqlContext, inst, columns, cache=cache, verbose=verbose)
+
+        fdf_df = tables['fdf']
+        ddf_df = tables['ddf']
+        daf_df = tables['daf']
+
+        if datasets is not None:
+            dbs_df, inst_counters = pruned_dataset_sizes(fdf_df, ddf_df, daf_df, datasets)
+            if counters is not None:
+                counters[inst] = inst_counters
+            frames.append(dbs_df.withColumn('inst', lit(inst)).select(['inst', 'dataset', 'dbs_size']))
+            continue
+
+        # dataset, size, dataset_access_type_id
+        dbs_df = fdf_df.join(ddf_df, fdf_df.f_dataset_id == ddf_df.d_dataset_id)\
+                       .drop('f_dataset_id')\
+                       .drop('d_dataset_id')\
+                       .withColumnRenamed('d_dataset', 'dataset')\
+                       .withColumnRenamed('f_file_size', 'size')\
+                       .withColumnRenamed('d_dataset_access_type_id', 'dataset_access_type_id')
+
+        # dataset, size, dataset_access_type
+        dbs_df = dbs_df.join(daf_df, dbs_df.dataset_access_type_id == daf_df.dataset_access_type_id)\
+                       .drop(dbs_df.dataset_access_type_id)\
+                       .drop(daf_df.dataset_access_type_id)
+
+        # inst, dataset, dbs_size
+        dbs_df = dbs_df.where(dbs_df.dataset_access_type == 'VALID')\
+                       .groupBy('dataset')\
+                       .agg({'size':'sum'})\
+                       .withColumnRenamed('sum(size)', 'dbs_size')\
+                       .withColumn('inst', lit(inst))
+
+        frames.append(dbs_df.select(['inst', 'dataset', 'dbs_size']))
+
+    return reduce(lambda a,b: a.unionAll(b), frames)
+
+def phedex_site_sizes(sqlContext, date, verbose=None, cache=None):
+    """
+    Reads PhEDEx snapshot of given date (YYYYMMDD) and returns dataframe with
+    the size of each dataset in each site: dataset, site, size
+    """
+    phedex_cols = ['dataset_name', 'node_name', 'block_bytes']
+    phedex = phedex_table(sqlContext, date, phedex_cols, cache=cache, verbose=verbose)
+
+    return phedex.groupBy(['dataset_name', 'node_name'])\
+                 .agg({'block_bytes':'sum'})\
+                 .withColumnRenamed('sum(block_bytes)', 'size')\
+                 .withColumnRenamed('dataset_name', 'dataset')\
+                 .withColumnRenamed('node_name', 'site')
+
+def phedex_dataset_sizes(site_sizes_df):
+    """
+    Aggregates dataset, site, size dataframe into dataset, phedex_size, size_on_disk.
+    Data in _MSS, _Buffer and _Export sites does not count as data on disk.
+    """
+    return site_sizes_df.withColumn('size_on_disk', size_on_disk(site_sizes_df.site, site_sizes_df.size))\
+                        .groupBy('dataset')\
+                        .agg({'size':'sum', 'size_on_disk': 'sum'})\
+                        .withColumnRenamed('sum(size)', 'phedex_size')\
+                        .withColumnRenamed('sum(size_on_disk)', 'size_on_disk')
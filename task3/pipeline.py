@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Pipeline of task 3: all outputs are aggregated by aggregate_all.py, outputs
+which were too large to be written locally are merged into csv files and
+visualize.py builds the report. See ../common/pipeline.py for options.
+"""
+
+# system modules
+import os
+import sys
+import time
+
+# common directory goes first, otherwise this module would import itself as pipeline
+sys.path.insert(0, '../common')
+from pipeline import LOCAL_ROOT, pipeline_parser, run_pipeline
+
+DATE = '20170228'
+OUTPUTS = ['phedex', 'dbs', 'site_campaign_count', 'campaign_tier']
+
+# Csv files of outputs, campaign_sites comes together with phedex and dbs outputs
+CSV_FILES = {'phedex': 'campaigns_phedex_df.csv',
+             'dbs': 'campaigns_dbs_df.csv',
+             'site_campaign_count': 'site_campaign_count_df.csv',
+             'campaign_sites': 'campaign_sites_df.csv',
+             'campaign_tier': 'campaign_tier_df.csv'}
+
+SOURCES = ['campaign_tables.py', 'campaign_partials.py', 'aggregate_campaigns.py', 'aggregate_campaign_tier.py',
+           'aggregate_all.py', '../common/table_cache.py', '../common/cms_columns.py', '../common/top_n.py',
+           '../common/result_sink.py']
+
+def output_names(outputs):
+    "Names of all outputs which are produced for requested outputs"
+    names = list(outputs)
+    if 'phedex' in outputs or 'dbs' in outputs:
+        names.append('campaign_sites')
+    return names
+
+def pipeline_nodes(outputs, report=True):
+    "Nodes of task 3 pipeline"
+    copy = ' && '.join('cp %s ../CMSSpark/src/python/CMSSpark/%s' % (x, os.path.basename(x)) for x in
+                       SOURCES + ['../common/spark_metrics.py', '../common/job_context.py'])
+    csv_files = ' '.join(CSV_FILES[x] for x in output_names(outputs))
+    nodes = [
+        {'name': 'copy', 'command': copy},
+        {'name': 'aggregate', 'deps': ['copy'],
+         'skip': 'python ../common/result_cache.py get {cache_args}',
+         'command': 'rm -f %s; python ../common/hdfs_client.py rm {hdir}; '
+                    '../common/run_job aggregate_all.py --fout={hdir} {yarn} --verbose --date={date} --outputs={outputs} '
+                    '--cache={cache} --store={store} {prune} --local=$(pwd)' % csv_files},
+    ]
+    merges = []
+    for name in output_names(outputs):
+        merges.append('%s_csv' % name)
+        nodes.append({'name': '%s_csv' % name, 'deps': ['aggregate'], 'skip_with': 'aggregate',
+                      'command': 'python ../common/merge_parts.py --src={hdir}/%s --fout=%s --skip-missing'
+                                 % (name, CSV_FILES[name])})
+    nodes.append({'name': 'cache', 'deps': merges, 'skip_with': 'aggregate',
+                  'command': 'python ../common/result_cache.py put {cache_args}'})
+    if report:
+        nodes.append({'name': 'report', 'deps': ['cache'], 'command': 'python visualize.py'})
+    return nodes
+
+def pipeline_params(date, outputs, local=False, prune=False):
+    "Parameters of task 3 pipeline commands"
+    user = os.environ.get('USER', 'user')
+    if local:
+        base = 'file://%s/cms/users/%s' % (os.environ.get('HDFS_LOCAL_ROOT', LOCAL_ROOT), user)
+    else:
+        base = 'hdfs:///cms/users/%s' % user
+    # Per-date partial aggregates are kept here for multi-date rollups
+    store = os.environ.get('CAMPAIGN_STORE') or '%s/campaign_partials' % base
+    csv_files = ','.join(CSV_FILES[x] for x in output_names(outputs))
+    # DBS dumps are refreshed daily, so results are cached for the current day
+    dbs_date = time.strftime('%Y%m%d')
+    return {'date': date,
+            'outputs': ','.join(outputs),
+            'yarn': '' if local else '--yarn',
+            'cache': os.environ.get('PARQUET_CACHE', ''),
+            'hdir': '%s/task3' % base,
+            'store': store,
+            'prune': '--prune' if prune else '',
+            'cache_args': '--job=task3 --date=%s --inst=GLOBAL,PHYS01,PHYS02,PHYS03 --options=outputs=%s,store=%s,prune=%s,dbs_date=%s '
+                          '--sources=%s --outputs=%s' % (date, ','.join(outputs), store, prune, dbs_date,
+                                                         ','.join(SOURCES), csv_files)}
+
+def main():
+    "Main function"
+    parser = pipeline_parser('Task 3 pipeline: campaign aggregations, csv files and report')
+    parser.add_argument("--date", action="store",
+        dest="date", default=DATE, help='PhEDEx snapshot date (YYYYMMDD), default %s' % DATE)
+    parser.add_argument("--outputs", action="store",
+        dest="outputs", default=','.join(OUTPUTS), help='Comma-separated list of outputs, default %s' % ','.join(OUTPUTS))
+    parser.add_argument("--no-report", action="store_true",
+        dest="no_report", default=False, help="Do not run visualize.py")
+    parser.add_argument("--prune", action="store_true",
+        dest="prune", default=bool(os.environ.get('PRUNE_DBS')),
+        help="Prune DBS files of datasets which are not in PhEDEx for campaign_tier output, default is set by PRUNE_DBS")
+    opts = parser.parse_args()
+    outputs = [x for x in opts.outputs.split(',') if x]
+    for output in outputs:
+        if output not in OUTPUTS:
+            raise Exception('Unsupported output "%s"' % output)
+    if len(opts.date) != 8:
+        raise Exception('Invalid date "%s". Example: 20170228' % opts.date)
+    run_pipeline('task3', pipeline_nodes(outputs, not opts.no_report), pipeline_params(opts.date, outputs, opts.local, opts.prune), opts)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,3 @@
-import pandas as pd
 
 import matplotlib as mpl
 # We will not be showing images because we don't haw UI
@@ -6,85 +5,51 @@ mpl.use('Agg')
 import matplotlib.pyplot as plt
 from subprocess import check_output
 import os
-import shutil
 import operator
 import argparse
+import sys
+
+sys.path.append('../common')
+from metrics_report import spark_metrics_report
+from csv_snapshot import read_csv
+from plot_pool import PLOT_WORKERS, PlotPool, timings_table
+from report_builder import ReportBuilder, head_rows, int_strings, pb_pib_strings, ratio_strings, strings
 
 PLOTS_PATH = '../CERNTasks.wiki/images/campaign_plots/'
 
-report = ''
+report = ReportBuilder()
 
 def append_report(lines):
-    global report
-    report = report + lines
-    report = report + '\n'
-
-def to_pb_string(bytes, decimal_points=1):
-    return str(round(bytes / float(1000**5), decimal_points + 1))
-
-def to_pib_string(bytes, decimal_points=1):
-    return str(round(bytes / float(1024**5), decimal_points))
+    report.append(lines)
 
 def write_campaigns_to_report(df, head=0):
-    append_report('| Campaign | PhEDEx Size (PB - PiB) | DBS Size (PB - PiB) | Ratio | Most Significant Site | Second Most Significant Site | Most Significant Site Size (PB - PiB) | Second Most Significant Site Size (PB - PiB) | Number of Sites |')
-    append_report('| ------- | ------ | ------ | ------ | ------ | ------ | ------ | ------ | ------ |')
-
-    if head != 0:
-        df = df[:head]
-
-    for index, row in df.iterrows():
-        append_report('| ' + row['campaign'] + 
-                      ' | ' + to_pb_string(row['phedex_size']) + ' - ' + to_pib_string(row['phedex_size']) + 
-                      ' | ' + to_pb_string(row['dbs_size']) + ' - ' + to_pib_string(row['dbs_size']) + 
-                      ' | ' + '{:.2f}'.format(float(row['phedex_size']/row['dbs_size'])) + 
-                      ' | ' + row['mss_name'] + 
-                      ' | ' + row['second_mss_name'] + 
-                      ' | ' + to_pb_string(row['mss']) + ' - ' + to_pib_string(row['mss']) + 
-                      ' | ' + to_pb_string(row['second_mss']) + ' - ' + to_pib_string(row['second_mss']) + 
-                      ' | ' + str(row['sites']) + 
-                      ' |')
-def write_sites_to_report(df, head=0):
-    append_report('| Site | Campaign Count |')
-    append_report('| ------- | ------ |')
+    df = head_rows(df, head)
+    report.table(['Campaign', 'PhEDEx Size (PB - PiB)', 'DBS Size (PB - PiB)', 'Ratio', 'Most Significant Site',
+                  'Second Most Significant Site', 'Most Significant Site Size (PB - PiB)',
+                  'Second Most Significant Site Size (PB - PiB)', 'Number of Sites'],
+                 [df['campaign'].tolist(),
+                  pb_pib_strings(df['phedex_size'].tolist()),
+                  pb_pib_strings(df['dbs_size'].tolist()),
+                  ratio_strings(df['phedex_size'].tolist(), df['dbs_size'].tolist()),
+                  df['mss_name'].tolist(),
+                  df['second_mss_name'].tolist(),
+                  pb_pib_strings(df['mss'].tolist()),
+                  pb_pib_strings(df['second_mss'].tolist()),
+                  strings(df['sites'].tolist())])
 
-    if head != 0:
-        df = df[:head]
-
-    for index, row in df.iterrows():
-        append_report('| ' + row['site'] + ' | ' + str(int(row['campaign_count'])) + ' |')
+def write_sites_to_report(df, head=0):
+    df = head_rows(df, head)
+    report.table(['Site', 'Campaign Count'], [df['site'].tolist(), int_strings(df['campaign_count'].tolist())])
 
 def write_campaign_tier_relationship_to_report(df, head=0):
-    append_report('| Campaign | Tier | DBS Size (PB - PiB) | PhEDEx Size (PB - PiB) | Size on Disk (PB - PiB) | Ratio |')
-    append_report('| ------- | ------ | ------ | ------ | ------ | ------ |')
-
-    if head != 0:
-        df = df[:head]
-
-    for index, row in df.iterrows():
-        append_report('| ' + row['campaign'] + 
-                      ' | ' + row['tier'] + 
-                      ' | ' + to_pb_string(row['dbs_size']) + ' - ' + to_pib_string(row['dbs_size']) +
-                      ' | ' + to_pb_string(row['phedex_size']) + ' - ' + to_pib_string(row['phedex_size']) +
-                      ' | ' + to_pb_string(row['size_on_disk']) + ' - ' + to_pib_string(row['size_on_disk']) +
-                      ' | ' + '{:.2f}'.format(float(row['phedex_size']/row['dbs_size'])) + 
-                      ' |')
-
-def copy_directory(src, dest):
-    dest_dir = os.path.dirname(dest)
-    if not os.path.exists(dest_dir):
-        os.mkdir(dest_dir)
-
-    # Delete destination first
-    shutil.rmtree(dest)
-
-    try:
-        shutil.copytree(src, dest)
-    # Directories are the same
-    except shutil.Error as e:
-        print('Directory not copied. Error: %s' % e)
-    # Any error saying that the directory doesn't exist
-    except OSError as e:
-        print('Directory not copied. Error: %s' % e)
+    df = head_rows(df, head)
+    report.table(['Campaign', 'Tier', 'DBS Size (PB - PiB)', 'PhEDEx Size (PB - PiB)', 'Size on Disk (PB - PiB)', 'Ratio'],
+                 [df['campaign'].tolist(),
+                  df['tier'].tolist(),
+                  pb_pib_strings(df['dbs_size'].tolist()),
+                  pb_pib_strings(df['phedex_size'].tolist()),
+                  pb_pib_strings(df['size_on_disk'].tolist()),
+                  ratio_strings(df['phedex_size'].tolist(), df['dbs_size'].tolist())])
 
 def create_plot_dirs():
     if not os.path.exists(PLOTS_PATH):
@@ -95,26 +60,37 @@ def append_report_header():
     append_report('Results of gathering PhEDEx and DBS information aggregated by campaign')
 
 def write_report():
-    global report
-    with open('../CERNTasks.wiki/CMS_Campaign_Reports.md', 'w') as f:
-        f.write(report)
+    report.write('../CERNTasks.wiki/CMS_Campaign_Reports.md')
 
 def commit_report():
     os.system('(cd ../CERNTasks.wiki/; git add -A; git commit -m "Auto-commiting report"; git push origin master)')
 
+def append_metrics(metrics_file, history_file):
+    metrics = spark_metrics_report(metrics_file, history_file)
+    if metrics:
+        append_report(metrics)
+
 def append_campaign_execution_time():
     with open('spark_exec_time_campaigns.txt', 'r') as f:
         append_report('#### Spark job execution time for data above: %s' % f.read())
+    append_metrics('spark_metrics_campaigns.json', 'spark_metrics_campaigns_history.json')
 
 def append_campaign_tier_execution_time():
     with open('spark_exec_time_campaign_tier.txt', 'r') as f:
         append_report('#### Spark job execution time for data above: %s' % f.read())
+    append_metrics('spark_metrics_campaign_tier.json', 'spark_metrics_campaign_tier_history.json')
+
+def pie_chart_data(df, sites_df):
+    campaigns = df.head(6)['campaign']
 
-def plot_pie_charts(df, file_name):
-    head = df.head(6)\
-             .set_index('campaign')\
-             .drop(['mss_name', 'second_mss_name', 'mss', 'second_mss', 'dbs_size', 'phedex_size', 'sites'], axis=1)
+    # campaign_sites_df.csv is in long format (campaign, site, size), make it
+    # one row per campaign with one column per site
+    return sites_df[sites_df.campaign.isin(campaigns)]\
+             .pivot_table(index='campaign', columns='site', values='size', aggfunc='sum')\
+             .reindex(campaigns)\
+             .fillna(0)
 
+def plot_pie_charts(head, plot_filepath):
     fig, axes = plt.subplots(2, 3, figsize=(30, 15))
     for i, (idx, row) in enumerate(head.iterrows()):
         ax = axes[i // 3, i % 3]
@@ -125,11 +101,11 @@ def plot_pie_charts(df, file_name):
     plt.tight_layout()
     plt.subplots_adjust(left=0.1, right=0.9, top=0.9, bottom=0.1, wspace=0.4)
 
-    plot_filepath = PLOTS_PATH + file_name
     plt.savefig(plot_filepath, dpi=120)
 
-def visualize_data_by_campaign():
-    df = pd.read_csv('campaigns_dbs_df.csv')
+def visualize_data_by_campaign(plots):
+    sites_df = read_csv('campaign_sites_df.csv')
+    df = read_csv('campaigns_dbs_df.csv')
 
     append_report('## Campaigns')
     
@@ -137,28 +113,29 @@ def visualize_data_by_campaign():
     write_campaigns_to_report(df, 10)
 
     # Make pie chart of sites for most significant DBS campaigns
+    # Pie charts are rendered by a worker process while next tables are built
     plot_filename = 'dbs_size_campaigns_plot.jpg'
-    plot_pie_charts(df, plot_filename)
+    plots.submit(plot_pie_charts, pie_chart_data(df, sites_df), PLOTS_PATH + plot_filename)
 
     append_report('### Plot of 6 most significant DBS campaigns')
     append_report('Each pie chart visualizes the size of campaign data in each data site that campaign is present.')
     append_report('![6 most significant DBS campaigns](images/campaign_plots/%s)' % plot_filename)
 
-    df = pd.read_csv('campaigns_phedex_df.csv')
+    df = read_csv('campaigns_phedex_df.csv')
 
     append_report('### Showing TOP 10 most significant campaigns by PhEDEx size')
     write_campaigns_to_report(df, 10)
 
     # Make pie chart of sites for most significant PhEDEx campaigns
     plot_filename = 'phedex_size_campaigns_plot.jpg'
-    plot_pie_charts(df, plot_filename)
+    plots.submit(plot_pie_charts, pie_chart_data(df, sites_df), PLOTS_PATH + plot_filename)
 
     append_report('### Plot of 6 most significant PhEDEx campaigns')
     append_report('Each pie chart visualizes the size of campaign data in each data site that campaign is present.')
     append_report('![6 most significant PhEDEx campaigns](images/campaign_plots/%s)' % plot_filename)
 
 def visualize_site_campaign_count():
-    df = pd.read_csv('site_campaign_count_df.csv')
+    df = read_csv('site_campaign_count_df.csv')
 
     append_report('## Sites')
 
@@ -167,7 +144,7 @@ def visualize_site_campaign_count():
     write_sites_to_report(df, 10)
 
 def visualize_campaign_tier_relationship():
-    df = pd.read_csv('campaign_tier_df.csv')
+    df = read_csv('campaign_tier_df.csv')
 
     append_report('## Campaign sizes in data tiers')
 
@@ -181,16 +158,26 @@ def main():
                         dest="commit", 
                         default=False, 
                         help="Determines whether report should be committed to Github wiki")
+    parser.add_argument("--plot-workers", action="store", type=int,
+                        dest="plot_workers",
+                        default=PLOT_WORKERS,
+                        help="Number of processes rendering plots, 0 renders them in this process, default %s" % PLOT_WORKERS)
     opts = parser.parse_args()
 
     create_plot_dirs()
     append_report_header()
-  
-    visualize_data_by_campaign()
-    visualize_site_campaign_count()
-    append_campaign_execution_time()
-    visualize_campaign_tier_relationship()
-    append_campaign_tier_execution_time()
+
+    plots = PlotPool(opts.plot_workers)
+    try:
+        visualize_data_by_campaign(plots)
+        visualize_site_campaign_count()
+        append_campaign_execution_time()
+        visualize_campaign_tier_relationship()
+        append_campaign_tier_execution_time()
+        plots.wait()
+    finally:
+        plots.close()
+    print(timings_table(plots.timings))
 
     write_report()
 